@@ -22,6 +22,7 @@ setup(
     entry_points={
         "console_scripts": [
             "runes=runes_cli.cli:main",
+            "runesd=runes_cli.agent:main",
         ],
     },
     # Other metadata
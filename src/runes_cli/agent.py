@@ -0,0 +1,219 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import time
+
+import click
+
+from .config import AGENT_SOCKET, CATALOG_TTL, PREFETCH_CATEGORIES, PREFETCH_RECENT
+from .persistence import data_dir
+
+# `runesd` is an optional long-lived agent. It keeps the Docker client, the
+# SQLite connection, the HTTP session and the runes catalog warm and serves
+# the batch commands over a Unix socket. The protocol is one JSON request
+# line, {"op": ..., "args": {...}}, answered by NDJSON records. While its
+# Docker events watcher is connected, `ps` is answered from the database alone.
+# It also keeps the warm container pools (see `pool`) filled and applies the
+# configured image prefetch policy (see `prefetch`).
+
+socket_path = AGENT_SOCKET or os.path.join(data_dir, "runesd.sock")
+
+# op -> name of the function in `batch` that serves it
+OPERATIONS = {
+    "ps": "list_runes",
+    "run": "run_runes",
+    "stop": "stop_runes",
+    "restart": "restart_runes",
+    "catalog": "list_catalog",
+}
+
+# Seconds a client has to send its request line once connected
+REQUEST_TIMEOUT = 10
+
+
+class AgentError(Exception):
+    pass
+
+
+def connect():
+    """
+    Connects to the agent socket. Returns None when no agent is listening.
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request(op, **args):
+    """
+    Sends a request to the agent and returns an iterator over its reply
+    records, or None when no agent is running.
+    """
+    sock = connect()
+    if sock is None:
+        return None
+
+    sock.sendall(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+    return read_records(sock)
+
+
+def read_records(sock):
+    with sock, sock.makefile("r", encoding="utf-8") as reply:
+        for line in reply:
+            record = json.loads(line)
+            if "error" in record:
+                raise AgentError(record["error"])
+            yield record
+
+
+class Agent:
+    def __init__(self):
+        from .pool import PoolRefiller
+        from .prefetch import Prefetcher
+        from .watcher import EventWatcher
+
+        self.catalog = None
+        self.catalog_fetched_at = 0
+        self.watcher = EventWatcher()
+        self.refiller = PoolRefiller()
+        self.prefetcher = Prefetcher(self.get_catalog)
+
+    def warm(self):
+        from .api import get_session
+        from .containers import docker_check
+        from .persistence import get_connection
+
+        if not docker_check():
+            raise AgentError("Unable to connect to Docker.")
+        get_connection()
+        get_session()
+        self.get_catalog()
+        self.watcher.start()
+        self.refiller.start()
+        if PREFETCH_CATEGORIES or PREFETCH_RECENT:
+            self.prefetcher.start()
+
+    def get_catalog(self):
+        from .api import get_remote_images
+
+        if (
+            self.catalog is None
+            or time.monotonic() - self.catalog_fetched_at > CATALOG_TTL
+        ):
+            try:
+                self.catalog = get_remote_images()
+                self.catalog_fetched_at = time.monotonic()
+            except Exception as e:
+                if self.catalog is None:
+                    raise
+                click.echo(f"Using cached catalog, refresh failed: {e}", err=True)
+        return self.catalog
+
+    def handle(self, op, args):
+        from . import batch
+        from .hosts import get_hosts
+
+        if op not in OPERATIONS:
+            raise AgentError(f"Unknown operation: {op}")
+
+        if op == "catalog":
+            args = dict(args, remote_images=self.get_catalog())
+        elif op == "ps" and self.watcher.connected.is_set() and len(get_hosts()) == 1:
+            # The events watcher only follows the local host
+            args = dict(args, reconcile=False)
+        return getattr(batch, OPERATIONS[op])(**args)
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            self.connection.settimeout(REQUEST_TIMEOUT)
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                return
+            # Replies can take as long as the operation does
+            self.connection.settimeout(None)
+            message = json.loads(line)
+            records = self.server.agent.handle(message["op"], message.get("args", {}))
+            for record in records:
+                self.write(record)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.write({"error": str(e)})
+
+    def write(self, record):
+        self.wfile.write(json.dumps(record).encode("utf-8") + b"\n")
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Each request gets its own thread (and its own SQLite connection), so a
+    # long `run` or a client that never sends its request doesn't block `ps`
+    daemon_threads = True
+
+    def __init__(self, path, agent):
+        self.agent = agent
+        super().__init__(path, AgentRequestHandler)
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    sock = connect()
+    if sock is not None:
+        sock.close()
+        raise AgentError(f"An agent is already listening on {path}")
+    os.unlink(path)
+
+
+@click.command()
+def main():
+    """Run the runes agent in the foreground."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise click.ClickException("runesd requires Unix domain sockets.")
+
+    agent = Agent()
+    try:
+        remove_stale_socket(socket_path)
+        agent.warm()
+    except Exception as e:
+        raise click.ClickException(str(e))
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    old_umask = os.umask(0o077)  # the socket can start runes as this user
+    try:
+        server = AgentServer(socket_path, agent)
+    finally:
+        os.umask(old_umask)
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    click.echo(f"runesd listening on {socket_path}", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.watcher.stop()
+        agent.refiller.stop()
+        agent.prefetcher.stop()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    main()
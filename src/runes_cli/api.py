@@ -5,6 +5,19 @@ from .config import URL_API, URL_AUTH
 from .models import RemoteImage, RemoteSource
 from .persistence import get_access_token
 
+_session = None
+
+
+def get_session():
+    """
+    Returns a process-wide requests session so calls to the API reuse their
+    HTTP connections.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
 
 def get_remote_sources() -> []:
     # remote_name: str, source_url: str, remote_version: str):
@@ -81,7 +94,7 @@ def publish_remote_source(
     }
 
     # Make the POST request
-    response = requests.post(endpoint, headers=headers, json=data)
+    response = get_session().post(endpoint, headers=headers, json=data)
 
     # Return the response object
     return response
@@ -96,7 +109,7 @@ def insert_remote_image_info(image_info, access_token):
             "Content-Type": "application/json",
         }
 
-        response = requests.post(endpoint_url, headers=headers, json=image_info)
+        response = get_session().post(endpoint_url, headers=headers, json=image_info)
         response.raise_for_status()  # This will raise an exception for HTTP errors
         return True
     except requests.RequestException as e:
@@ -131,7 +144,7 @@ def delete_elixir(remote_image_id):
         "Content-Type": "application/json",
     }
 
-    response = requests.delete(delete_url, headers=headers)
+    response = get_session().delete(delete_url, headers=headers)
 
     # Checking the response
     if response.status_code == 204:
@@ -141,7 +154,7 @@ def delete_elixir(remote_image_id):
 
 
 def get_remote_images() -> []:
-    response = requests.get(f"{URL_API}/api/hub/remote-images/")
+    response = get_session().get(f"{URL_API}/api/hub/remote-images/")
     remote_images_data = response.json()
 
     remote_images = [
@@ -171,7 +184,7 @@ def delete_remote_image(remote_image_id):
         "Content-Type": "application/json",
     }
 
-    response = requests.delete(delete_url, headers=headers)
+    response = get_session().delete(delete_url, headers=headers)
 
     # Checking the response
     if response.status_code == 204:
@@ -192,7 +205,7 @@ def delete_remote_source(remote_source_id):
         "Content-Type": "application/json",
     }
 
-    response = requests.delete(delete_url, headers=headers)
+    response = get_session().delete(delete_url, headers=headers)
 
     # Checking the response
     if response.status_code == 204:
@@ -206,7 +219,7 @@ def delete_remote_source(remote_source_id):
 def get_remote_sources() -> []:
     list_sources_url = f"{URL_API}/api/hub/remote-sources/"
 
-    response = requests.get(list_sources_url)
+    response = get_session().get(list_sources_url)
     remote_images_data = response.json()
 
     remote_sources = [
@@ -225,7 +238,7 @@ def get_remote_sources() -> []:
 
 def verify_token(token):
     # Attempt to obtain token pair
-    response = requests.post(
+    response = get_session().post(
         f"{URL_AUTH}/auth/token/verify",
         json={"token": token},
     )
@@ -0,0 +1,113 @@
+import gzip
+import os
+
+from .config import LOG_COMPRESSION, LOG_SEGMENT_BYTES
+from .persistence import data_dir, get_log_cursor, set_log_cursor
+
+# Incremental, compressed archives of rune logs. Every run fetches only the
+# lines written since the container's `archive` cursor and appends them, in
+# chunks of about CHUNK_BYTES, as compressed members (gzip) or frames (zstd)
+# to the container's current segment, which is rotated once it reaches
+# LOG_SEGMENT_BYTES. Concatenated members/frames decompress as one stream:
+# `zcat segment-000001.log.gz`.
+
+archive_dir = os.path.join(data_dir, "logs")
+
+CURSOR_CONSUMER = "archive"
+
+# Uncompressed bytes of log lines held in memory before they are written
+CHUNK_BYTES = 1024 * 1024
+
+
+def get_compression():
+    if LOG_COMPRESSION == "gzip":
+        return "gzip"
+    try:
+        import zstandard  # noqa: F401
+
+        return "zstd"
+    except ImportError:
+        if LOG_COMPRESSION == "zstd":
+            raise Exception("zstd log compression requires the zstandard package.")
+        return "gzip"
+
+
+def current_segment(container_dir, extension):
+    """
+    Returns the path of the segment to append to, starting a new one once the
+    latest has reached LOG_SEGMENT_BYTES.
+    """
+    segments = sorted(
+        name
+        for name in os.listdir(container_dir)
+        if name.startswith("segment-") and name.endswith(extension)
+    )
+    index = 1
+    if segments:
+        latest = segments[-1]
+        index = int(latest[len("segment-") : -len(extension)])
+        if os.path.getsize(os.path.join(container_dir, latest)) >= LOG_SEGMENT_BYTES:
+            index += 1
+    return os.path.join(container_dir, f"segment-{index:06d}{extension}")
+
+
+def compress(data, compression):
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def append_chunk(container_dir, extension, compression, chunk):
+    """
+    Appends the lines of chunk as one compressed member/frame to the current
+    segment and syncs it. Returns (segment, compressed size).
+    """
+    os.makedirs(container_dir, exist_ok=True)
+    segment = current_segment(container_dir, extension)
+    data = compress(b"".join(chunk), compression)
+    with open(segment, "ab") as segment_file:
+        segment_file.write(data)
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+    return segment, len(data)
+
+
+def archive_logs(container_id, client=None):
+    """
+    Appends the container's new log lines to its archive, a chunk at a time,
+    advancing its cursor after each chunk. Returns a summary of what was
+    archived.
+    """
+    from .logs import iter_new_log_lines
+
+    compression = get_compression()
+    extension = ".log.zst" if compression == "zstd" else ".log.gz"
+    container_dir = os.path.join(archive_dir, container_id)
+
+    summary = {"container_id": container_id, "lines": 0, "bytes": 0}
+
+    def flush():
+        segment, size = append_chunk(container_dir, extension, compression, chunk)
+        # Only advance the cursor once the lines are safely on disk
+        set_log_cursor(container_id, CURSOR_CONSUMER, last_ns)
+        summary["lines"] += len(chunk)
+        summary["bytes"] += size
+        summary["segment"] = segment
+
+    chunk, chunk_bytes, last_ns = [], 0, None
+    since_ns = get_log_cursor(container_id, CURSOR_CONSUMER)
+    for timestamp_ns, line in iter_new_log_lines(container_id, since_ns, client):
+        # Lines sharing a timestamp go in one chunk, the cursor can't split them
+        if chunk_bytes >= CHUNK_BYTES and timestamp_ns != last_ns:
+            flush()
+            chunk, chunk_bytes = [], 0
+        data = f"{timestamp_ns} {line}\n".encode("utf-8")
+        chunk.append(data)
+        chunk_bytes += len(data)
+        last_ns = timestamp_ns
+
+    if chunk:
+        flush()
+    return summary
@@ -0,0 +1,270 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from .config import DOCKER_WORKERS
+from .persistence import (
+    STATUS_RUNNING,
+    generate_uuid,
+    iter_container_states,
+    read_token_from_db,
+    set_or_update_token,
+)
+
+# Batch operations behind the non-interactive subcommands. Each one yields a
+# plain dict per target so the same code serves `runes` in-process and the
+# `runesd` agent over its socket.
+
+
+def list_runes(show_all=False, rebuild=False, reconcile=True):
+    """
+    Lists the runes in the database. Unless reconcile is False (the runesd
+    events watcher already keeps it current), the running ones are first
+    synced with Docker, on every host concurrently.
+    """
+    if rebuild:
+        from .containers import rebuild_container_states
+        from .hosts import for_each_host
+
+        for host, restored, error in for_each_host(
+            lambda host, client: rebuild_container_states(client, host)
+        ):
+            if error is not None:
+                click.echo(f"Error rebuilding from {host}: {error}", err=True)
+            for container in restored or []:
+                click.echo(f"Restored {container.container_id} from labels", err=True)
+
+    if show_all:
+        for container in iter_container_states():
+            yield container.to_dict()
+    elif not reconcile:
+        for container in iter_container_states(status=STATUS_RUNNING):
+            yield container.to_dict()
+    else:
+        for container in reconcile_all_hosts():
+            yield container.to_dict()
+
+
+def reconcile_all_hosts():
+    """
+    Reconciles the running runes of every host concurrently and returns
+    them. Runes of unreachable hosts are listed as stored.
+    """
+    from .containers import reconcile_container_states
+    from .hosts import LOCAL_HOST, for_each_host
+
+    running = []
+    for host, containers, error in for_each_host(
+        lambda host, client: reconcile_container_states(client, host)
+    ):
+        if error is not None:
+            click.echo(f"Error listing runes on {host}: {error}", err=True)
+            containers = [
+                container
+                for container in iter_container_states(status=STATUS_RUNNING)
+                if (container.host or LOCAL_HOST) == host
+            ]
+        running += containers
+    return running
+
+
+def run_runes(
+    images,
+    gpu=False,
+    remote_name=None,
+    remote_description="",
+    replicas=1,
+    unique_tokens=False,
+    workers=None,
+    cpus=None,
+    memory=None,
+    pids=None,
+    pin=True,
+    host=None,
+    placement=None,
+    use_pool=True,
+):
+    """
+    Starts the runes of each image, on `host` or else on the hosts chosen by
+    the placement policy (see `hosts`). With use_pool False, every rune is
+    started cold rather than handed out from the warm pool.
+    """
+    from .containers import start_replicas
+    from .hosts import get_hosts, place_replicas
+    from .models import ResourceSpec
+
+    resources = None
+    if cpus or memory or pids:
+        resources = ResourceSpec(cpus=cpus, memory=memory, pids=pids, pin=pin)
+
+    token = read_token_from_db()
+    if token is None:
+        token = set_or_update_token(token=generate_uuid())
+
+    hosts = get_hosts()
+    for image_name in images:
+        if host is not None or len(hosts) == 1:
+            placed = {host or hosts[0]: replicas}
+        else:
+            placed = {}
+            for chosen in place_replicas(replicas, image_name, placement, hosts):
+                placed[chosen] = placed.get(chosen, 0) + 1
+
+        def start_on(target):
+            return start_replicas(
+                image_name,
+                remote_name or image_name,
+                remote_description,
+                token,
+                replicas=placed[target],
+                gpu=gpu,
+                unique_tokens=unique_tokens,
+                max_workers=workers,
+                resources=resources,
+                host=target,
+                use_pool=use_pool,
+            )
+
+        with ThreadPoolExecutor(max_workers=len(placed)) as pool:
+            results = [
+                result
+                for host_results in pool.map(start_on, list(placed))
+                for result in host_results
+            ]
+        for result in results:
+            if not result["started"]:
+                click.echo(f"Error starting {image_name}: {result['error']}", err=True)
+            yield dict(result, image_name=image_name)
+
+
+def wait_for_replicas(image_name, results, requested_ns, timeout, ready_pattern):
+    """
+    Waits, concurrently, for the started replicas of an image to be ready,
+    adds the outcome to their results and records their time to ready.
+    requested_ns is when the start was requested.
+    """
+    from .containers import get_docker_client
+    from .readiness import record_start, wait_until_ready
+
+    started = [result for result in results if result["started"]]
+    if not started:
+        return
+
+    def wait_for(result):
+        return wait_until_ready(
+            result["container_id"],
+            requested_ns,
+            timeout,
+            ready_pattern,
+            client=get_docker_client(result.get("host")),
+        )
+
+    with ThreadPoolExecutor(max_workers=min(len(started), DOCKER_WORKERS)) as pool:
+        for result, readiness in zip(started, pool.map(wait_for, started)):
+            result.update(readiness)
+            record_start(
+                image_name,
+                result["container_id"],
+                requested_ns,
+                readiness,
+                pooled=result.get("pooled", False),
+            )
+
+
+def select_runes(container_ids=(), all=False, name=None, image_name=None):
+    """
+    Resolves the running runes to act on: every one with all, else those
+    matching a container id (or unique id prefix), a rune name or an image.
+    Returns a list of (container_id, host) pairs, and {id: error} for the
+    ids that match no running rune or, as a prefix, more than one.
+    """
+    targets = []
+    matches = {container_id: [] for container_id in container_ids}
+    for container in reconcile_all_hosts():
+        target = (container.container_id, container.host)
+        if (
+            all
+            or (name is not None and container.remote_name == name)
+            or (image_name is not None and container.image_name == image_name)
+        ):
+            targets.append(target)
+        for container_id in matches:
+            if container.container_id.startswith(container_id):
+                matches[container_id].append(target)
+
+    errors = {}
+    for container_id, found in matches.items():
+        # Like the docker CLI, a full id wins over longer ids it prefixes
+        found = [target for target in found if target[0] == container_id] or found
+        if not found:
+            errors[container_id] = f"No such rune: {container_id}"
+        elif len(found) > 1:
+            errors[container_id] = (
+                f"Multiple runes found with provided prefix: {container_id}"
+            )
+        else:
+            targets.append(found[0])
+    return list(dict.fromkeys(targets)), errors
+
+
+def stop_runes(
+    container_ids=(),
+    all=False,
+    name=None,
+    image_name=None,
+    grace=None,
+    force=True,
+    restart=False,
+    workers=None,
+):
+    from .containers import DEFAULT_STOP_GRACE, stop_containers
+
+    targets, errors = select_runes(container_ids, all, name, image_name)
+    for container_id, error in errors.items():
+        yield {"container_id": container_id, "ok": False, "error": error}
+
+    by_host = {}
+    for container_id, host in targets:
+        by_host.setdefault(host, []).append(container_id)
+    if not by_host:
+        return
+
+    def stop_on(host):
+        try:
+            results = stop_containers(
+                by_host[host],
+                grace=DEFAULT_STOP_GRACE if grace is None else grace,
+                force=force,
+                restart=restart,
+                max_workers=workers,
+                host=host,
+            )
+        except Exception as e:
+            results = [
+                {"container_id": container_id, "ok": False, "error": str(e)}
+                for container_id in by_host[host]
+            ]
+        if host is not None:
+            for result in results:
+                result["host"] = host
+        return results
+
+    # Every host at once
+    with ThreadPoolExecutor(max_workers=len(by_host)) as pool:
+        for results in pool.map(stop_on, list(by_host)):
+            yield from results
+
+
+def restart_runes(**args):
+    return stop_runes(restart=True, **args)
+
+
+def list_catalog(category=None, remote_images=None):
+    if remote_images is None:
+        from .api import get_remote_images
+
+        remote_images = get_remote_images()
+
+    for remote_image in remote_images:
+        if category is None or remote_image.category == category:
+            yield remote_image.to_dict()
@@ -1,22 +1,370 @@
+import hashlib
 import os
+import re
+import shlex
 import shutil
+import subprocess
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.request import urlopen
-from docker import DockerClient
 from urllib.parse import urlparse
 
+import click
+
+from .config import BUILD_WORKERS, BUILDKIT
+from .containers import get_docker_client
+from .notebooks import extract_install_commands, notebook_to_script
+from .persistence import (
+    data_dir,
+    delete_cached_build,
+    get_cached_build,
+    save_cached_build,
+)
+
+# Builds are content addressed: the notebook, Dockerfile and startup script
+# are hashed, and the hash is kept as an image label and in the local DB.
+# Building the same sources again re-tags the image built from them instead
+# of rebuilding it.
+#
+# The Dockerfile is ordered from the least to the most often changing layer
+# (system packages, Python tooling, startup script, notebook), so editing a
+# notebook only rebuilds its final COPY. With BuildKit (through the docker
+# CLI) the apt and pip downloads are also kept in cache mounts across
+# builds; the legacy builder of the Docker API gets the same layers without
+# them.
+#
+# Runtimes: "notebook" executes the notebook with nbconvert on start and then
+# serves Jupyter; "headless" runs the notebook converted to an IPython script
+# (see notebooks) as the container's only process, logging to stdout.
+#
+# Batches of builds (build_many) first build the base layers once, then run
+# the notebook builds on a bounded pool on top of them, each writing its
+# output to its own log file instead of interleaving on the terminal.
+
+LABEL_BUILD_HASH = "app.runes.build-hash"
+LABEL_RUNTIME = "app.runes.runtime"
+
+# Tag of the shared base layers built ahead of a batch of builds
+BASE_IMAGE_NAME = "runes-build-base"
+
+build_log_dir = os.path.join(data_dir, "build_logs")
+
+RUNTIMES = ["notebook", "headless"]
+
+# Files of the build context that make up the build hash
+BUILD_FILES = ["source.ipynb", "startup.sh", "Dockerfile"]
+
+STARTUP_SCRIPTS = {
+    # nbclient (what `nbconvert --execute` runs) with the kernel's stream
+    # output echoed as it arrives, so the rune's prints reach the container
+    # log (and readiness) rather than only the executed notebook
+    "notebook": """#!/bin/bash
+export PYTHONUNBUFFERED=1
+python - <<'RUNNER' 2>&1 | tee /usr/src/app/notebook_log.txt
+import sys
+
+import nbformat
+from nbclient import NotebookClient
+
+
+class StreamingClient(NotebookClient):
+    def output(self, outs, msg, display_id, cell_index):
+        if msg["msg_type"] == "stream":
+            stream = sys.stderr if msg["content"]["name"] == "stderr" else sys.stdout
+            stream.write(msg["content"]["text"])
+            stream.flush()
+        return super().output(outs, msg, display_id, cell_index)
+
+
+notebook = nbformat.read("/usr/src/app/source.ipynb", as_version=4)
+client = StreamingClient(notebook, resources={"metadata": {"path": "/usr/src/app"}})
+try:
+    client.execute()
+finally:
+    nbformat.write(notebook, "/usr/src/app/executed_notebook.ipynb")
+RUNNER
+exec start-notebook.sh --NotebookApp.token='' --NotebookApp.password=''""",
+    "headless": """#!/bin/bash
+export PYTHONUNBUFFERED=1
+cd /usr/src/app
+exec ipython --colors=NoColor /usr/src/app/rune.ipy""",
+}
+
+# What each runtime copies into the image: the notebook, or its script
+ENTRY_FILES = {"notebook": "source.ipynb", "headless": "rune.ipy"}
+
+SYSTEM_PACKAGES = [
+    "ffmpeg",
+    "git",
+    "gcc",
+    "g++",
+    "make",
+    "libsndfile1-dev",
+    "portaudio19-dev",
+]
+
+PYTHON_PACKAGES = ["nbconvert", "dawnet-client"]
+
+# jovyan:users in the jupyter base images
+NOTEBOOK_UID = 1000
+NOTEBOOK_GID = 100
+
+# The fixed layers every rune image starts with
+BASE_TEMPLATE = """{syntax}# Use the official Jupyter Notebook base image
+FROM jupyter/base-notebook
+
+USER root
+
+# System packages, the most stable layer
+RUN {apt_mounts}{apt_keep}apt-get update \\
+    && apt-get install -y {system_packages}{apt_clean}
+
+# The app directory, writable by jovyan
+RUN mkdir -p /usr/src/app && chown jovyan:users /usr/src/app
+
+# Switch back to jovyan to avoid permission issues
+USER jovyan
+
+# Set the working directory in the container
+WORKDIR /usr/src/app
+
+# Install nbconvert and necessary Python packages
+RUN {pip_mounts}pip install {pip_options}{python_packages}
+"""
+
+DOCKERFILE_TEMPLATE = """{base}{notebook_dependencies}
+# The startup script, then the notebook: only this last layer changes when
+# iterating on a notebook
+COPY --chown=jovyan:users startup.sh /usr/src/app/
+COPY --chown=jovyan:users {entry_file} /usr/src/app/
+{expose}
+# Use the custom startup script
+CMD ["bash", "/usr/src/app/startup.sh"]
+"""
+
+
+NOTEBOOK_APT_TEMPLATE = """
+# System packages installed by the notebook's cells
+USER root
+RUN {apt_mounts}{apt_keep}apt-get update \\
+    && apt-get install -y {packages}{apt_clean}
+USER jovyan
+"""
+
+NOTEBOOK_PIP_TEMPLATE = """
+# Python packages installed by the notebook's cells
+{installs}
+"""
+
+
+def template_options(buildkit):
+    """
+    The template values for BuildKit (apt and pip cache mounts) or the
+    legacy builder.
+    """
+    if buildkit:
+        return dict(
+            syntax="# syntax=docker/dockerfile:1\n",
+            apt_mounts=(
+                "--mount=type=cache,target=/var/cache/apt,sharing=locked \\\n"
+                "    --mount=type=cache,target=/var/lib/apt,sharing=locked \\\n"
+                "    "
+            ),
+            # The base image deletes downloaded packages after every install
+            apt_keep="rm -f /etc/apt/apt.conf.d/docker-clean \\\n    && ",
+            apt_clean="",
+            pip_mounts=(
+                f"--mount=type=cache,target=/home/jovyan/.cache/pip,"
+                f"uid={NOTEBOOK_UID},gid={NOTEBOOK_GID} \\\n    "
+            ),
+            pip_options="",
+        )
+    return dict(
+        syntax="",
+        apt_mounts="",
+        apt_keep="",
+        apt_clean=" \\\n    && rm -rf /var/lib/apt/lists/*",
+        pip_mounts="",
+        pip_options="--no-cache-dir ",
+    )
+
+
+def make_base_dockerfile(buildkit):
+    return BASE_TEMPLATE.format(
+        system_packages=" ".join(SYSTEM_PACKAGES),
+        python_packages=" ".join(PYTHON_PACKAGES),
+        **template_options(buildkit),
+    )
+
+
+def make_dockerfile(buildkit, apt_packages=(), pip_installs=(), runtime="notebook"):
+    """
+    Renders the Dockerfile: the base layers, then the apt packages and pip
+    installs taken from the notebook, then the notebook itself.
+    """
+    options = template_options(buildkit)
+    notebook_dependencies = ""
+    if apt_packages:
+        notebook_dependencies += NOTEBOOK_APT_TEMPLATE.format(
+            packages=" ".join(shlex.quote(package) for package in apt_packages),
+            **options,
+        )
+    if pip_installs:
+        notebook_dependencies += NOTEBOOK_PIP_TEMPLATE.format(
+            installs="\n".join(
+                f"RUN {options['pip_mounts']}pip install {options['pip_options']}{args}"
+                for args in pip_installs
+            )
+        )
+
+    expose = ""
+    if runtime == "notebook":
+        expose = "\n# Expose the port the notebook runs on\nEXPOSE 8888\n"
+    return DOCKERFILE_TEMPLATE.format(
+        base=make_base_dockerfile(buildkit),
+        notebook_dependencies=notebook_dependencies,
+        entry_file=ENTRY_FILES[runtime],
+        expose=expose,
+    )
+
+
+def echo(line, log=None):
+    """
+    Writes a line of build output to the build's log file, else to stderr.
+    """
+    if log is None:
+        click.echo(line, err=True)
+    else:
+        log.write(f"{line}\n")
+
+
+def buildkit_available():
+    return BUILDKIT and shutil.which("docker") is not None
+
+
+def build_hash(context_dir):
+    digest = hashlib.sha256()
+    for file_name in BUILD_FILES:
+        with open(os.path.join(context_dir, file_name), "rb") as f:
+            digest.update(file_name.encode("utf-8") + b"\0")
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
 
 class DockerImageBuilder:
     def __init__(self):
-        self.docker_client = DockerClient.from_env()
+        self.docker_client = get_docker_client()
+        if self.docker_client is None:
+            raise Exception("Unable to connect to Docker.")
 
     def download_file(self, url, destination_path):
         """Download a file from a URL to a specified local path."""
         with urlopen(url) as response, open(destination_path, "wb") as out_file:
             shutil.copyfileobj(response, out_file)
 
-    def build_docker_image(self, notebook_source, image_name):
-        """Build a Docker image from a Jupyter notebook URL."""
+    def find_cached_image(self, build_hash):
+        """
+        Returns the id of an image built from the hash: the one recorded in
+        the local DB if it still exists, else any image with the hash label.
+        """
+        import docker
+
+        cached = get_cached_build(build_hash)
+        if cached is not None:
+            try:
+                attrs = self.docker_client.api.inspect_image(cached[0])
+            except docker.errors.ImageNotFound:
+                delete_cached_build(build_hash)
+            else:
+                labels = attrs["Config"].get("Labels") or {}
+                if labels.get(LABEL_BUILD_HASH) == build_hash:
+                    return attrs["Id"]
+
+        images = self.docker_client.api.images(
+            filters={"label": f"{LABEL_BUILD_HASH}={build_hash}"}
+        )
+        return images[0]["Id"] if images else None
+
+    def tag_image(self, image_id, image_name):
+        from docker.utils import parse_repository_tag
+
+        repository, tag = parse_repository_tag(image_name)
+        self.docker_client.api.tag(image_id, repository, tag or "latest", force=True)
+
+    def build_with_buildkit(self, context_dir, image_name, labels, nocache, log=None):
+        """
+        Builds with BuildKit through the docker CLI (the Docker API client
+        only drives the legacy builder). Returns the image id.
+        """
+        with tempfile.TemporaryDirectory() as iid_dir:
+            iid_path = os.path.join(iid_dir, "image_id")
+            command = ["docker", "build", "--progress=plain", "-t", image_name]
+            command += ["--iidfile", iid_path]
+            for name, value in labels.items():
+                command += ["--label", f"{name}={value}"]
+            if nocache:
+                command.append("--no-cache")
+            command.append(context_dir)
+
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=dict(os.environ, DOCKER_BUILDKIT="1"),
+                text=True,
+            )
+            for line in process.stdout:
+                echo(line.rstrip(), log)
+            if process.wait() != 0:
+                raise Exception(f"docker build exited with {process.returncode}")
+
+            with open(iid_path) as f:
+                return f.read().strip()
+
+    def build_with_api(self, context_dir, image_name, labels, nocache, log=None):
+        """
+        Builds with the legacy builder of the Docker API. Returns the image id.
+        """
+        image_id = None
+        for chunk in self.docker_client.api.build(
+            path=context_dir,
+            tag=image_name,
+            rm=True,
+            nocache=nocache,
+            dockerfile="Dockerfile",
+            labels=labels,
+            decode=True,
+        ):
+            if "error" in chunk:
+                raise Exception(chunk["error"].strip())
+            if "stream" in chunk:
+                echo(chunk["stream"].strip(), log)
+            if "ID" in chunk.get("aux", {}):
+                image_id = chunk["aux"]["ID"]
+        if image_id is None:
+            image_id = self.docker_client.api.inspect_image(image_name)["Id"]
+        return image_id
+
+    def build_docker_image(
+        self,
+        notebook_source,
+        image_name,
+        force=False,
+        runtime="notebook",
+        log=None,
+        nocache=None,
+    ):
+        """
+        Build a Docker image from a Jupyter notebook URL, or re-tag the image
+        already built from the same sources unless force is set. Build output
+        goes to the log file if given. Returns a summary of the build.
+        """
+        if runtime not in RUNTIMES:
+            raise Exception(f"Unknown runtime: {runtime}")
+
+        started_at = time.monotonic()
+        buildkit = buildkit_available()
         with tempfile.TemporaryDirectory() as tmp_dir:
             # Paths for the necessary files
             notebook_path = os.path.join(tmp_dir, "source.ipynb")
@@ -33,64 +381,118 @@ class DockerImageBuilder:
 
             # Save the startup script
             with open(startup_script_path, "w") as startup_script:
-                startup_script.write(
-                    """#!/bin/bash
-jupyter nbconvert --to notebook --execute /usr/src/app/source.ipynb --output /usr/src/app/executed_notebook.ipynb | tee /usr/src/app/notebook_log.txt
-exec start-notebook.sh --NotebookApp.token='' --NotebookApp.password=''"""
-                )
+                startup_script.write(STARTUP_SCRIPTS[runtime])
+            os.chmod(startup_script_path, 0o755)
+
+            # Move the notebook's own installs into image layers
+            apt_packages, pip_installs = extract_install_commands(notebook_path)
+            if runtime == "headless":
+                notebook_to_script(notebook_path, os.path.join(tmp_dir, "rune.ipy"))
 
             # Create the Dockerfile
             with open(dockerfile_path, "w") as dockerfile:
                 dockerfile.write(
-                    """# Use the official Jupyter Notebook base image
-FROM jupyter/base-notebook
+                    make_dockerfile(buildkit, apt_packages, pip_installs, runtime)
+                )
 
-# Install FFmpeg
-USER root
+            source_hash = build_hash(tmp_dir)
+            image_id = None if force else self.find_cached_image(source_hash)
+            cached = image_id is not None
+            if cached:
+                echo(f"Sources unchanged, tagging {image_id[:19]} as {image_name}", log)
+                self.tag_image(image_id, image_name)
+            else:
+                build = self.build_with_buildkit if buildkit else self.build_with_api
+                labels = {LABEL_BUILD_HASH: source_hash, LABEL_RUNTIME: runtime}
+                nocache = force if nocache is None else nocache
+                image_id = build(tmp_dir, image_name, labels, nocache, log)
 
-# Update the package list and install ffmpeg, git, gcc, g++, make, and libsndfile1-dev
-RUN apt-get update && apt-get install -y \
-    ffmpeg \
-    git \
-    gcc \
-    g++ \
-    make \
-    libsndfile1-dev \
-    portaudio19-dev
+        save_cached_build(source_hash, image_id, image_name)
+        return {
+            "image_name": image_name,
+            "image_id": image_id,
+            "build_hash": source_hash,
+            "cached": cached,
+            "runtime": runtime,
+            "buildkit": buildkit,
+            "build_ms": round((time.monotonic() - started_at) * 1000, 1),
+        }
 
-# Copy the notebook and the startup script into the container
-COPY source.ipynb startup.sh /usr/src/app/
+    def warm_base(self, force=False, log=None):
+        """
+        Builds the base layers shared by every rune image once, so builds
+        started together afterwards all find them in the layer cache.
+        """
+        buildkit = buildkit_available()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "Dockerfile"), "w") as dockerfile:
+                dockerfile.write(make_base_dockerfile(buildkit))
+            build = self.build_with_buildkit if buildkit else self.build_with_api
+            return build(tmp_dir, BASE_IMAGE_NAME, {}, force, log)
 
-# Ensure the startup script is executable
-RUN chmod +x /usr/src/app/startup.sh
+    def build_many(self, jobs, max_workers=None, log_dir=None, force=False):
+        """
+        Builds the jobs ({"source", "image_name", "runtime"}) on a bounded
+        pool after warming the base layers, each writing its output to its
+        own file in log_dir. Yields a summary per build as they finish.
+        """
+        log_dir = log_dir or build_log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, f"{BASE_IMAGE_NAME}.log"), "w") as log:
+            self.warm_base(force, log)
 
-# Adjust permissions to ensure `jovyan` can write to /usr/src/app
-RUN chown -R jovyan:users /usr/src/app
+        def build_one(job):
+            log_path = os.path.join(log_dir, log_file_name(job["image_name"]))
+            started_at = time.monotonic()
+            with open(log_path, "w") as log:
+                try:
+                    summary = self.build_docker_image(
+                        job["source"],
+                        job["image_name"],
+                        force,
+                        job.get("runtime", "notebook"),
+                        log=log,
+                        # The base layers were just (re)built
+                        nocache=False,
+                    )
+                    summary["ok"] = True
+                except Exception as e:
+                    echo(f"Error building the docker image: {e}", log)
+                    summary = {
+                        "image_name": job["image_name"],
+                        "ok": False,
+                        "error": str(e),
+                        "build_ms": round((time.monotonic() - started_at) * 1000, 1),
+                    }
+            return dict(summary, source=job["source"], log=log_path)
 
-# Switch back to jovyan to avoid permission issues
-USER jovyan
+        workers = min(len(jobs), max_workers or BUILD_WORKERS)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = [pool.submit(build_one, job) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
 
-# Set the working directory in the container
-WORKDIR /usr/src/app
 
-# Install nbconvert and necessary Python packages
-RUN pip install nbconvert dawnet-client
+def log_file_name(image_name):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", image_name) + ".log"
 
-# Expose the port the notebook runs on
-EXPOSE 8888
 
-# Use the custom startup script
-CMD ["bash", "/usr/src/app/startup.sh"]
-"""
-                )
-            # Build Docker image and print logs
-            for chunk in self.docker_client.api.build(
-                path=tmp_dir,
-                tag=image_name,
-                rm=True,
-                nocache=True,
-                dockerfile="Dockerfile",
-                decode=True,
-            ):
-                if "stream" in chunk:
-                    print(chunk["stream"].strip())
+def build_report(summaries):
+    """
+    Aggregates the summaries of a batch of builds: counts, durations and the
+    images that failed.
+    """
+    from .stats import percentile
+
+    times = [summary["build_ms"] for summary in summaries if summary["ok"]]
+    report = {
+        "builds": len(summaries),
+        "ok": len(times),
+        "cached": sum(1 for summary in summaries if summary.get("cached")),
+        "failed": [summary["image_name"] for summary in summaries if not summary["ok"]],
+    }
+    if times:
+        report.update(
+            p50_ms=percentile(times, 50), max_ms=max(times), total_ms=sum(times)
+        )
+    return report
@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from .persistence import data_dir
+
+# Capabilities of the Docker daemon (runtimes, cpus, memory, storage driver)
+# are probed through the API once and cached on disk. The cache is keyed by
+# the daemon's host url and stays valid for as long as the daemon fingerprint
+# (host boot time + daemon socket creation time) is unchanged.
+
+capabilities_path = os.path.join(data_dir, "host_capabilities.json")
+
+# Seconds a probe of a daemon without a local socket (tcp://, ssh://) is kept
+REMOTE_PROBE_TTL = 3600
+
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+
+# Serializes updates of the cache file by the threads of this process (hosts
+# are probed concurrently); other processes are kept safe by writing through
+# a unique temporary file
+_cache_lock = threading.Lock()
+
+
+def get_boot_time():
+    try:
+        with open("/proc/stat") as stat:
+            for line in stat:
+                if line.startswith("btime "):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # No procfs (macOS); rounded so that clock jitter doesn't change it
+    return int(round(time.time() - time.monotonic(), -1))
+
+
+def daemon_fingerprint(docker_host):
+    """
+    A stamp of the running daemon instance that can be computed without
+    calling it, or None for daemons not reached through a local socket. The
+    daemon recreates its socket on every start.
+    """
+    if not docker_host.startswith("unix://"):
+        return None
+    try:
+        socket_ctime = os.stat(docker_host[len("unix://") :]).st_ctime
+    except OSError:
+        return None
+    return f"{get_boot_time()}:{socket_ctime}"
+
+
+def probe_host(client):
+    info = client.info()
+    return {
+        "daemon_id": info.get("ID"),
+        "server_version": info.get("ServerVersion"),
+        "runtimes": sorted((info.get("Runtimes") or {}).keys()),
+        "default_runtime": info.get("DefaultRuntime"),
+        "ncpu": info.get("NCPU"),
+        "mem_total": info.get("MemTotal"),
+        "storage_driver": info.get("Driver"),
+    }
+
+
+def load_cache():
+    try:
+        with open(capabilities_path) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    os.makedirs(data_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=data_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(cache, cache_file, indent=2)
+        os.replace(tmp_path, capabilities_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def is_fresh(entry, fingerprint):
+    if fingerprint is not None:
+        return entry.get("fingerprint") == fingerprint
+    return time.time() - entry.get("probed_at", 0) < REMOTE_PROBE_TTL
+
+
+def get_host_capabilities(client=None, docker_host=None, refresh=False):
+    """
+    Returns the cached capabilities of the Docker daemon, probing it through
+    the API only when the daemon has changed since the last probe.
+    """
+    docker_host = docker_host or os.getenv("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+    fingerprint = daemon_fingerprint(docker_host)
+
+    entry = load_cache().get(docker_host)
+    if entry is not None and not refresh and is_fresh(entry, fingerprint):
+        return entry["capabilities"]
+
+    if client is None:
+        from .containers import get_docker_client
+
+        client = get_docker_client()
+        if client is None:
+            raise Exception("Unable to connect to Docker.")
+
+    capabilities = probe_host(client)
+    with _cache_lock:
+        cache = load_cache()
+        cache[docker_host] = {
+            "fingerprint": fingerprint,
+            "probed_at": time.time(),
+            "capabilities": capabilities,
+        }
+        save_cache(cache)
+    return capabilities
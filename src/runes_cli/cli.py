@@ -1,52 +1,44 @@
-import asyncio
 import sys
+import json
 import click
-import docker
-import requests
-import questionary
-from questionary import select, prompt, Separator
 import os
 import re
 import platform
+from functools import partial
 from urllib.parse import urlparse
-import docker
 import getpass
-import webbrowser
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
 
 from .config import URL_AUTH, URL_API
-from .file_uploader import FileUploader
 
 from .models import RemoteContainer, RemoteSource
-from .containers import (
-    docker_check,
-    start_container,
-    stop_container,
-    is_container_running,
-    tail_logs,
-    get_docker_namespace,
-)
 from .persistence import (
     set_or_update_token,
     generate_uuid,
+    iter_container_states,
     read_token_from_db,
-    get_container_states,
     get_docker_credentials,
     save_docker_credentials,
     save_access_token,
     delete_access_tokens,
     get_access_token,
 )
-from .api import (
-    get_remote_images,
-    get_remote_sources,
-    insert_remote_image_info,
-    publish_remote_source,
-    delete_remote_source,
-    delete_remote_image,
-)
-from .builder import DockerImageBuilder
+
+# Heavy third party modules (docker, requests, questionary, aiohttp, tkinter)
+# and the modules built on them are imported inside the menu branches and
+# commands that use them, so that starting `runes` only pays for what runs.
+
+
+def select(*args, **kwargs):
+    from questionary import select as questionary_select
+
+    return questionary_select(*args, **kwargs)
+
+
+def text(*args, **kwargs):
+    from questionary import text as questionary_text
+
+    return questionary_text(*args, **kwargs)
+
 
 # default
 default_title = "Welcome to Signals & Sorcery!"
@@ -82,7 +74,36 @@ def clear_screen():
 @click.pass_context
 def cli(ctx):
     if ctx.invoked_subcommand is None:
-        menu(ctx)
+        clear_screen()
+        require_docker()
+
+        token = read_token_from_db()
+        if token is None:
+            print(set_or_update_token(token=generate_uuid()))
+
+        run_menu(ctx)
+
+
+def require_docker():
+    from .containers import docker_check
+
+    if not docker_check():
+        click.echo(
+            "Error: Unable to connect to Docker. Please ensure Docker is RUNNING and on the system PATH.",
+            err=True,
+        )
+        sys.exit(1)  # Exit with error code 1 if Docker is not accessible
+
+
+def run_menu(ctx):
+    """
+    Drives the interactive menu as a state machine. Every screen returns the
+    next screen to show (a callable taking ctx) or None to exit, so navigating
+    does not grow the stack or keep previous screens' data alive.
+    """
+    screen = menu
+    while screen is not None:
+        screen = screen(ctx)
 
 
 def menu(ctx):
@@ -110,15 +131,15 @@ def menu(ctx):
     clear_screen()
 
     if selected_entry_option == option_tokens:
-        tokens_menu(ctx)
+        return tokens_menu
     elif selected_entry_option == option_remotes:
-        remote_menu(ctx)
+        return remote_menu
     elif selected_entry_option == option_docker:
-        docker_menu(ctx)
+        return docker_menu
     elif selected_entry_option == option_sources:
-        source_menu(ctx)
+        return source_menu
     elif selected_entry_option == option_account:
-        account_menu(ctx)
+        return account_menu
     elif selected_entry_option == option_config:
         click.echo(f"URL_API={URL_API}")
         click.echo(f"URL_AUTH={URL_AUTH}")
@@ -132,13 +153,15 @@ option_account_sign_out = "sign out"
 
 
 def sign_up(ctx):
+    import webbrowser
+
     url = f"{URL_AUTH}/accounts/signup/"
 
     try:
         # Attempt to open the URL in the default browser
         webbrowser.open(url, new=2)
         print(f"Opened {url} in the default browser.")
-        menu(ctx)
+        return menu
     except Exception as e:
         # Handle exceptions, such as if a browser could not be started
         print(f"Failed to open {url} in the default browser. Error: {e}")
@@ -146,11 +169,15 @@ def sign_up(ctx):
 
 def verify_access_token(token):
     """Verifies the token's validity with the backend."""
+    import requests
+
     response = requests.post(f"{URL_AUTH}/auth/token/verify/", json={"token": token})
     return response.status_code == 200
 
 
 def sign_in(ctx):
+    import requests
+
     username = click.prompt("Email", type=str)
     password = click.prompt("Password", hide_input=True, type=str)
 
@@ -166,7 +193,7 @@ def sign_in(ctx):
             save_access_token(token)
             clear_screen()
             click.echo("Successfully signed in.")
-            menu(ctx)
+            return menu
         else:
             click.echo("Failed to verify the access token.")
     else:
@@ -177,7 +204,7 @@ def sign_out(ctx):
     # Simply remove the token from the database to "sign out"
     delete_access_tokens()
     click.echo("Successfully signed out.")
-    menu(ctx)
+    return menu
 
 
 def account_menu(ctx):
@@ -197,15 +224,15 @@ def account_menu(ctx):
     clear_screen()
 
     if selected_action == option_account_sign_in:
-        sign_in(ctx)
+        return sign_in
     elif selected_action == option_account_sign_up:
-        sign_up(ctx)
+        return sign_up
     elif selected_action == option_account_sign_out:
-        sign_out(ctx)
+        return sign_out
     elif selected_action == option_menu:
-        menu(ctx)
+        return menu
     else:
-        menu(ctx)
+        return menu
 
 
 def tokens_menu(ctx):
@@ -225,7 +252,7 @@ def tokens_menu(ctx):
     if selected_action == "add your token":
         token = click.prompt("Enter the new token", type=str)
         if not set_or_update_token(token):
-            menu(ctx)
+            return menu
 
         clear_screen()
         click.echo(f"Token has been updated to: {token}")
@@ -240,9 +267,9 @@ def tokens_menu(ctx):
         new_token = set_or_update_token()
         click.echo(f"New token generated: {new_token}")
     elif selected_action == "menu":
-        menu(ctx)
+        return menu
 
-    menu(ctx)
+    return menu
 
 
 def is_valid_docker_image_name(name):
@@ -329,17 +356,21 @@ def publish_elixir_source(ctx):
     access_token = get_access_token()
     if not access_token:
         click.echo("Please sign before publishing rune source.")
-        menu(ctx)
+        return menu
 
     token_valid = verify_access_token(access_token)
     if not token_valid:
         click.echo("Please sign in before publishing rune source.")
-        menu(ctx)
+        return menu
+
+    import asyncio
+    from .file_uploader import FileUploader
+    from .api import publish_remote_source
 
     uploader = FileUploader()
     # uploader.upload(source_url)
 
-    input_source = questionary.text(
+    input_source = text(
         "Enter a local path to an `.ipynb` file or a url to a public Google CoLab:",
         validate=lambda text: 1 <= len(text) <= 1500,
     ).ask()
@@ -353,26 +384,26 @@ def publish_elixir_source(ctx):
         colab_url = input_source
     else:
         click.echo("Invalid Input")
-        menu(ctx)
+        return menu
 
     # Collecting information using questionary
-    remote_name = questionary.text(
+    remote_name = text(
         "Rune name (maxLength: 100):",
         validate=lambda text: 1 <= len(text) <= 100,
     ).ask()
-    remote_description = questionary.text(
+    remote_description = text(
         "Rune description (maxLength: 250):",
         validate=lambda text: 1 <= len(text) <= 250,
     ).ask()
-    remote_category = questionary.select(
+    remote_category = select(
         "Select Rune category:",
         choices=["audio", "image", "text", "video"],
     ).ask()
-    processor = questionary.select(
+    processor = select(
         "Select the required processor:",
         choices=["cpu", "gpu"],
     ).ask()
-    remote_version = questionary.text(
+    remote_version = text(
         "Enter remote version (optional, maxLength: 25):",
         validate=lambda text: len(text) <= 25,
     ).ask()
@@ -400,13 +431,16 @@ def publish_elixir_source(ctx):
             f"Failed to publish Rune source code. Status code: {response.status_code}"
         )
 
-    menu(ctx)
+    return menu
 
 
 def select_file_gui():
     # Hides the deprecation warning
     os.environ["TK_SILENCE_DEPRECATION"] = "1"
 
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
+
     # Hides the root tkinter window
     root = Tk()
     root.withdraw()
@@ -424,6 +458,9 @@ def select_file_gui():
 
 
 def source_menu(ctx):
+    from .api import get_remote_sources, delete_remote_source
+    from .builder import DockerImageBuilder
+
     clear_screen()
 
     title = default_title
@@ -467,10 +504,9 @@ def source_menu(ctx):
         except Exception as e:
             click.echo(f"Invalid source URL: {e}")
 
-        menu(ctx)
+        return menu
     elif selected_action == option_publish:
-        publish_elixir_source(ctx)
-        menu(ctx)
+        return publish_elixir_source
 
     elif selected_action == option_delete:
         remotes = get_remote_sources()
@@ -502,11 +538,11 @@ def source_menu(ctx):
 
         if selected_source.remote_name == "menu":
             clear_screen()
-            menu(ctx)
+            return menu
         else:
             clear_screen()
             delete_remote_source(selected_source.id)
-            menu(ctx)
+            return menu
 
     elif selected_action == option_source_list:
         remotes = get_remote_sources()
@@ -537,7 +573,7 @@ def source_menu(ctx):
 
         if selected_source.remote_name == "menu":
             clear_screen()
-            menu(ctx)
+            return menu
         else:
             try:
                 print(f"selected_source.source_url: {selected_source.source_url}")
@@ -556,10 +592,10 @@ def source_menu(ctx):
                 clear_screen()
                 click.echo(f"Invalid source URL: {e}")
 
-            menu(ctx)
+            return menu
 
     else:
-        menu(ctx)
+        return menu
 
 
 def remote_menu(ctx):
@@ -581,9 +617,9 @@ def remote_menu(ctx):
 
     if selected_category:
         if selected_category == option_menu:
-            menu(ctx)
+            return menu
 
-        list_remotes(ctx, selected_category)
+        return partial(list_remotes, selected_category=selected_category)
 
 
 def docker_menu(ctx):
@@ -602,9 +638,9 @@ def docker_menu(ctx):
     clear_screen()
 
     if selected_category == option_menu:
-        menu(ctx)
+        return menu
     else:
-        list_docker_images(ctx, selected_category)
+        return partial(list_docker_images, selected_action=selected_category)
 
 
 def gather_image_info(image_name):
@@ -612,23 +648,23 @@ def gather_image_info(image_name):
     Prompts the user for missing image information and returns a dictionary with all data.
     """
     # Collecting information using questionary
-    rune_name = questionary.text(
+    rune_name = text(
         "Rune name (maxLength: 100):",
         validate=lambda text: 1 <= len(text) <= 100,
     ).ask()
-    rune_description = questionary.text(
+    rune_description = text(
         "Rune description (maxLength: 250):",
         validate=lambda text: 1 <= len(text) <= 250,
     ).ask()
-    rune_category = questionary.select(
+    rune_category = select(
         "Select Rune category:",
         choices=["audio", "image", "text", "video"],
     ).ask()
-    processor = questionary.select(
+    processor = select(
         "Select the required processor:",
         choices=["cpu", "gpu"],
     ).ask()
-    rune_version = questionary.text(
+    rune_version = text(
         "Enter remote version (optional, maxLength: 25):",
         validate=lambda text: len(text) <= 25,
     ).ask()
@@ -647,6 +683,9 @@ def gather_image_info(image_name):
 
 
 def list_docker_images(ctx, selected_action):
+    from .api import insert_remote_image_info
+    from .containers import get_docker_client, start_container, get_docker_namespace
+
     remotes = []
 
     if (
@@ -654,7 +693,7 @@ def list_docker_images(ctx, selected_action):
         or selected_action == option_docker_run_gpu
         or selected_action == option_docker_publish
     ):
-        client = docker.from_env()
+        client = get_docker_client()
         images = client.images.list()
         # Extract the tags of the images, but only include images with tags
         image_tags = [tag for image in images if image.tags for tag in image.tags]
@@ -688,8 +727,7 @@ def list_docker_images(ctx, selected_action):
         clear_screen()
 
         if selected_docker_image.remote_name == option_menu:
-            menu(ctx)
-            return
+            return menu
 
         if (
             selected_action == option_docker_run_cpu
@@ -705,17 +743,17 @@ def list_docker_images(ctx, selected_action):
                 use_gpu,
             )
 
-            menu(ctx)
+            return menu
         elif selected_action == option_docker_publish:
             access_token = get_access_token()
             if not access_token:
                 click.echo("Please sign before publishing image as a rune.")
-                menu(ctx)
+                return menu
 
             token_valid = verify_access_token(access_token)
             if not token_valid:
                 click.echo("Please sign in before publishing image as a rune.")
-                menu(ctx)
+                return menu
 
             if check_and_login_to_docker():
                 if publish_docker_image(selected_docker_image.remote_name, "latest"):
@@ -737,34 +775,29 @@ def list_docker_images(ctx, selected_action):
                         clear_screen()
                         print("Failed to register image information.")
 
-                    menu(ctx)
+                    return menu
                 else:
                     clear_screen()
                     print("Docker image publish failed.")
 
-                menu(ctx)
+                return menu
             else:
                 clear_screen()
                 print("DID NOT SUCCESSFULLY LOGIN TO DOCKER HUB")
 
-    menu(ctx)
+    return menu
 
 
 def list_remotes(ctx, selected_category):
+    from questionary import Separator
+    from .api import get_remote_images, delete_remote_image
+    from .containers import reconcile_container_states
+
     remotes = []
 
     if selected_category == option_remote_running:
-        db_containers = get_container_states(status=1)
-        for db_container in db_containers:
-            # print(f"CONTAINER: {db_container}")
-            if is_container_running(db_container.container_id):
-                # print(f"PID: {db_container.pid}")
-                # print(f"TOKEN: {db_container.associated_token}")
-                remotes.append(db_container)
-            else:
-                stop_container(
-                    db_container.container_id
-                )  # Sync the database with the actual state
+        # Sync the database with the actual state
+        remotes = reconcile_container_states()
 
         # Append 'menu' option to the remotes list
         remotes.append(RemoteContainer(0, 0, 0, option_menu, ""))
@@ -787,12 +820,12 @@ def list_remotes(ctx, selected_category):
         access_token = get_access_token()
         if not access_token:
             click.echo("Please sign before deleting a published rune.")
-            menu(ctx)
+            return menu
 
         token_valid = verify_access_token(access_token)
         if not token_valid:
             click.echo("Please sign in before deleting a published rune.")
-            menu(ctx)
+            return menu
 
         remotes = get_remote_images()
 
@@ -815,10 +848,10 @@ def list_remotes(ctx, selected_category):
 
         if selected_remote.remote_name == "menu":
             clear_screen()
-            menu(ctx)
+            return menu
         else:
             delete_remote_image(selected_remote.id)
-            menu(ctx)
+            return menu
 
     else:
         remotes = get_remote_images()
@@ -857,13 +890,20 @@ def list_remotes(ctx, selected_category):
 
     if selected_remote:
         if selected_remote.remote_name == option_menu:
-            menu(ctx)
+            return menu
         else:
-            manage_remote(ctx, selected_remote, selected_category)
+            return partial(
+                manage_remote,
+                selected_remote=selected_remote,
+                selected_category=selected_category,
+            )
 
 
 def login_to_docker_hub(username, password):
-    client = docker.from_env()
+    import docker
+    from .containers import get_docker_client
+
+    client = get_docker_client()
     try:
         login_response = client.login(
             username=username, password=password, registry="https://index.docker.io/v1/"
@@ -900,6 +940,8 @@ def check_and_login_to_docker():
 
 
 def publish_docker_image(image_name, tag):
+    from .containers import get_docker_client, get_docker_namespace
+
     if not check_and_login_to_docker():
         print("Cannot publish the image without logging in.")
         return False
@@ -908,7 +950,7 @@ def publish_docker_image(image_name, tag):
 
     dockerhub_namespace = get_docker_namespace(username)
 
-    client = docker.from_env()
+    client = get_docker_client()
     repository_name = (
         f"{dockerhub_namespace}/{image_name}"  # Use the Docker Hub username
     )
@@ -963,6 +1005,8 @@ def manage_remote(ctx, selected_remote, selected_category):
     action_stop = "stop (the running remote)"
     action_menu = "menu"
 
+    from .containers import start_container, stop_container, tail_logs
+
     actions = []
     if selected_category == option_remote_running:
         actions = [action_stop, action_logs, action_menu]
@@ -977,7 +1021,7 @@ def manage_remote(ctx, selected_remote, selected_category):
     clear_screen()
 
     if selected_action == option_menu:
-        remote_menu(ctx)  # Modify to return to the category selection
+        return remote_menu  # Modify to return to the category selection
     elif selected_action == action_run_cpu or selected_action == action_run_gpu:
         use_gpu = True if selected_action == action_run_gpu else False
 
@@ -988,14 +1032,14 @@ def manage_remote(ctx, selected_remote, selected_category):
             read_token_from_db(),
             use_gpu,
         )
-        menu(ctx)
+        return menu
     elif selected_action == action_stop:
         # print("F'n STOP")
         stop_container(selected_remote.container_id)
-        menu(ctx)
+        return menu
     elif selected_action == action_logs:
         tail_logs(selected_remote.container_id)
-        menu(ctx)
+        return menu
     # elif selected_action == 'install':
     #     print("INSTALLL BITCH")
     #     formatted_name = format_image_name(selected_remote.remote_name)
@@ -1007,20 +1051,834 @@ def manage_remote(ctx, selected_remote, selected_category):
         )
 
 
-def main():
-    clear_screen()
+# BATCH COMMANDS ###############################
+# Non-interactive subcommands for automation. List output is written as
+# NDJSON, one object per line as soon as it is available, e.g.
+#   runes ps | jq -r .container_id | xargs runes stop
 
-    success = docker_check()
-    if not success:
-        click.echo(
-            "Error: Unable to connect to Docker. Please ensure Docker is RUNNING and on the system PATH."
+
+def echo_ndjson(record):
+    click.echo(json.dumps(record))
+
+
+def agent_or_local(op, **args):
+    """
+    Sends the request to a running `runesd` agent, or runs it in this process
+    when no agent is listening.
+    """
+    from . import agent, batch
+
+    records = agent.request(op, **args)
+    if records is None:
+        if op != "catalog":
+            require_docker()
+        return getattr(batch, agent.OPERATIONS[op])(**args)
+    return relay_agent_records(records)
+
+
+def relay_agent_records(records):
+    """
+    Yields the agent's reply records. An error reply or a dropped connection
+    ends the command with its message; running the request again in this
+    process could repeat what the agent already did.
+    """
+    from .agent import AgentError
+
+    try:
+        yield from records
+    except (AgentError, OSError) as e:
+        raise click.ClickException(f"runesd: {e}")
+
+
+@cli.command()
+@click.option(
+    "--all", "show_all", is_flag=True, help="Include stopped runes, without syncing."
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Restore runes missing from the local database from their Docker labels.",
+)
+def ps(show_all, rebuild):
+    """List runes started from this machine."""
+    for record in agent_or_local("ps", show_all=show_all, rebuild=rebuild):
+        echo_ndjson(record)
+
+
+@cli.command()
+@click.argument("images", nargs=-1, required=True)
+@click.option("--gpu", is_flag=True, help="Run the runes with gpu support.")
+@click.option("--name", "remote_name", help="Rune name, defaults to the image name.")
+@click.option("--description", "remote_description", default="")
+@click.option(
+    "--replicas",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of containers to start per IMAGE.",
+)
+@click.option(
+    "--unique-tokens",
+    is_flag=True,
+    help="Give every replica its own generated connection token.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Maximum number of containers started at once.",
+)
+@click.option(
+    "--cpus",
+    type=click.FloatRange(min=0, min_open=True),
+    help="CPUs per rune. Pinned to that many dedicated cores unless --no-pin.",
+)
+@click.option("--memory", help="Memory limit per rune, e.g. 4g.")
+@click.option("--pids", type=click.IntRange(min=1), help="Process limit per rune.")
+@click.option(
+    "--pin/--no-pin",
+    default=True,
+    help="Give each rune a disjoint set of cores, or only a CPU quota.",
+)
+@click.option("--host", help="Docker host to start on, see `runes hosts`.")
+@click.option(
+    "--placement",
+    type=click.Choice(["least-loaded", "pack", "spread"]),
+    help="How replicas are spread over the hosts (default least-loaded).",
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Wait for the runes to be ready and record their time to ready.",
+)
+@click.option("--timeout", type=int, help="Seconds --wait waits (default 900).")
+@click.option(
+    "--ready-pattern",
+    help="Regular expression of the log line that marks a rune ready.",
+)
+@click.pass_context
+def run(
+    ctx,
+    images,
+    gpu,
+    remote_name,
+    remote_description,
+    replicas,
+    unique_tokens,
+    workers,
+    cpus,
+    memory,
+    pids,
+    pin,
+    host,
+    placement,
+    wait,
+    timeout,
+    ready_pattern,
+):
+    """Start the runes of every IMAGE, printing each replica's start latency."""
+    import time
+    from .batch import wait_for_replicas
+
+    args = dict(
+        gpu=gpu,
+        remote_name=remote_name,
+        remote_description=remote_description,
+        replicas=replicas,
+        unique_tokens=unique_tokens,
+        workers=workers,
+        cpus=cpus,
+        memory=memory,
+        pids=pids,
+        pin=pin,
+        host=host,
+        placement=placement,
+    )
+    if wait:
+        # Started one image at a time (through the agent if running), the
+        # wait itself happens here so it never holds up the agent
+        batches = []
+        for image_name in images:
+            requested_ns = time.time_ns()
+            records = list(agent_or_local("run", images=[image_name], **args))
+            wait_for_replicas(image_name, records, requested_ns, timeout, ready_pattern)
+            batches.append(records)
+        records = [record for batch in batches for record in batch]
+    else:
+        records = agent_or_local("run", images=list(images), **args)
+
+    failed = False
+    for record in records:
+        failed = failed or not record["started"] or record.get("ready") is False
+        echo_ndjson(record)
+
+    if failed:
+        ctx.exit(1)
+
+
+def rune_selection_options(command):
+    options = [
+        click.argument("container_ids", nargs=-1),
+        click.option("--all", "all_runes", is_flag=True, help="Every running rune."),
+        click.option("--name", help="Runes with this rune name."),
+        click.option("--image", "image_name", help="Runes of this image."),
+        click.option(
+            "--grace",
+            type=click.IntRange(min=0),
+            help="Seconds to wait for a rune to exit before it is killed (default 10).",
+        ),
+        click.option(
+            "--no-force",
+            "force",
+            is_flag=True,
+            flag_value=False,
+            default=True,
+            help="Don't kill runes whose stop request fails.",
+        ),
+        click.option(
+            "--workers",
+            type=click.IntRange(min=1),
+            help="Maximum number of runes handled at once.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def stop_or_restart(ctx, op, container_ids, all_runes, name, image_name, **args):
+    if not (container_ids or all_runes or name or image_name):
+        raise click.UsageError("Give CONTAINER_IDS, --all, --name or --image.")
+
+    failed = False
+    for record in agent_or_local(
+        op,
+        container_ids=list(container_ids),
+        all=all_runes,
+        name=name,
+        image_name=image_name,
+        **args,
+    ):
+        failed = failed or not record["ok"]
+        echo_ndjson(record)
+
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command()
+@rune_selection_options
+@click.pass_context
+def stop(ctx, **args):
+    """Stop runes concurrently, by CONTAINER_IDS or filter."""
+    stop_or_restart(ctx, "stop", **args)
+
+
+@cli.command()
+@rune_selection_options
+@click.pass_context
+def restart(ctx, **args):
+    """Restart runes concurrently, by CONTAINER_IDS or filter."""
+    stop_or_restart(ctx, "restart", **args)
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    A group that runs its default command when the first argument is not one
+    of its subcommands, so `runes logs -f ID` is `runes logs follow -f ID`.
+    """
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] != "--help":
+            args = [self.default_command] + args
+        return super().parse_args(ctx, args)
+
+
+@cli.group(cls=DefaultCommandGroup, default_command="follow")
+def logs():
+    """Show, archive and search rune logs."""
+
+
+@logs.command("follow")
+@click.argument("container_ids", nargs=-1)
+@click.option("--all", "all_runes", is_flag=True, help="Every running rune.")
+@click.option("--name", help="Runes with this rune name.")
+@click.option("--image", "image_name", help="Runes of this image.")
+@click.option("-f", "--follow", is_flag=True, help="Keep following new output.")
+@click.option("--tail", default="all", help="Lines to show from the end of each log.")
+@click.pass_context
+def logs_follow(ctx, container_ids, all_runes, name, image_name, follow, tail):
+    """Print (or follow) the logs of many runes at once, prefixed per rune."""
+    from .batch import select_runes
+    from .logs import follow_logs
+
+    if not (container_ids or all_runes or name or image_name):
+        raise click.UsageError("Give CONTAINER_IDS, --all, --name or --image.")
+
+    require_docker()
+    targets, errors = select_runes(container_ids, all_runes, name, image_name)
+    for error in errors.values():
+        click.echo(error, err=True)
+    if not targets:
+        if errors:
+            ctx.exit(1)
+        return
+
+    try:
+        ok = follow_logs(targets, follow=follow, tail=tail)
+    except KeyboardInterrupt:
+        ok = True
+    except Exception as e:
+        raise click.ClickException(str(e))
+
+    if errors or not ok:
+        ctx.exit(1)
+
+
+@logs.command("archive")
+@click.argument("container_ids", nargs=-1)
+@click.option(
+    "--all",
+    "all_runes",
+    is_flag=True,
+    help="Every rune in the local database whose container still exists.",
+)
+@click.pass_context
+def logs_archive(ctx, container_ids, all_runes):
+    """Append the new log lines of runes to their compressed archives."""
+    import docker
+    from .archive import archive_logs
+    from .containers import get_docker_client
+
+    if not (container_ids or all_runes):
+        raise click.UsageError("Give CONTAINER_IDS or --all.")
+
+    require_docker()
+    hosts = {
+        container.container_id: container.host
+        for container in iter_container_states()
+        if container.container_id
+    }
+    if all_runes:
+        container_ids = list(hosts)
+
+    failed = False
+    for container_id in container_ids:
+        try:
+            client = get_docker_client(hosts.get(container_id))
+            echo_ndjson(archive_logs(container_id, client))
+        except docker.errors.NotFound:
+            if not all_runes:
+                failed = True
+                click.echo(f"Container not found: {container_id}", err=True)
+        except Exception as e:
+            failed = True
+            click.echo(f"Error archiving {container_id}: {e}", err=True)
+
+    if failed:
+        ctx.exit(1)
+
+
+@logs.command("index")
+@click.argument("container_ids", nargs=-1)
+@click.option(
+    "--all",
+    "all_runes",
+    is_flag=True,
+    help="Every rune in the local database whose container still exists.",
+)
+@click.option(
+    "--keep",
+    help="Then drop indexed lines older than this, e.g. 30d. Alone, only prunes.",
+)
+@click.pass_context
+def logs_index(ctx, container_ids, all_runes, keep):
+    """Add the new log lines of runes to the local search index."""
+    import docker
+    from .containers import get_docker_client
+    from .logindex import index_container_logs, parse_duration, prune_logs
+
+    if not (container_ids or all_runes or keep):
+        raise click.UsageError("Give CONTAINER_IDS, --all or --keep.")
+    if keep:
+        try:
+            parse_duration(keep)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--keep")
+    if not (container_ids or all_runes):
+        echo_ndjson(prune_logs(keep))
+        return
+
+    require_docker()
+    targets = [
+        container
+        for container in iter_container_states()
+        if container.container_id
+        and (
+            all_runes
+            or any(container.container_id.startswith(i) for i in container_ids)
         )
-        sys.exit(1)  # Exit with error code 1 if Docker is not accessible
+    ]
+    if not targets:
+        raise click.ClickException("No matching runes in the local database.")
+
+    failed = False
+    for container in targets:
+        try:
+            client = get_docker_client(container.host)
+            echo_ndjson(index_container_logs(container, client))
+        except docker.errors.NotFound:
+            if not all_runes:
+                failed = True
+                click.echo(f"Container not found: {container.container_id}", err=True)
+        except Exception as e:
+            failed = True
+            click.echo(f"Error indexing {container.container_id}: {e}", err=True)
+
+    if keep:
+        echo_ndjson(prune_logs(keep))
+    if failed:
+        ctx.exit(1)
+
+
+@logs.command("search")
+@click.argument("query")
+@click.option("--since", help="Only lines newer than this, e.g. 30m, 24h, 7d.")
+@click.option("--until", help="Only lines older than this, e.g. 1h.")
+@click.option("--limit", default=100, show_default=True, help="Most lines to show.")
+@click.option("--raw", is_flag=True, help="Pass QUERY to SQLite FTS5 unchanged.")
+def logs_search(query, since, until, limit, raw):
+    """Search the indexed logs of every rune this host has run, newest first."""
+    import sqlite3
+    from .logindex import search_logs
+
+    try:
+        for record in search_logs(query, since, until, limit, raw):
+            echo_ndjson(record)
+    except (ValueError, sqlite3.OperationalError) as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@click.option(
+    "--interval", default=2.0, show_default=True, help="Seconds between refreshes."
+)
+@click.option(
+    "--window",
+    default=60,
+    show_default=True,
+    help="Seconds of history the percentiles cover.",
+)
+@click.option(
+    "--persist", is_flag=True, help="Also store every sample in the local database."
+)
+@click.option("--iterations", type=int, help="Stop after this many refreshes.")
+@click.option(
+    "--json", "as_json", is_flag=True, help="Print NDJSON snapshots instead of a table."
+)
+def top(interval, window, persist, iterations, as_json):
+    """Show the CPU, memory, network and block I/O of running runes."""
+    import time
+    from .stats import StatsSampler, format_table
+
+    require_docker()
+    sampler = StatsSampler(persist=persist)
+    sampler.start()
+    refreshes = 0
+    try:
+        while iterations is None or refreshes < iterations:
+            time.sleep(interval)
+            refreshes += 1
+            rows = sampler.snapshot(window)
+            if persist:
+                sampler.save()
+            if as_json:
+                for row in rows:
+                    echo_ndjson(row)
+            else:
+                click.clear()
+                click.echo(format_table(rows, window))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop()
+
+
+@cli.command()
+@click.option("--image", "image_name", help="Only this image.")
+@click.option("--since", help="Only starts newer than this, e.g. 24h, 7d.")
+def starts(image_name, since):
+    """Show the p50/p95 time to ready of runes started with --wait, per image."""
+    from .logindex import parse_duration
+    from .readiness import start_latency_report
+
+    try:
+        since_seconds = parse_duration(since) if since else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--since")
+    for record in start_latency_report(image_name, since_seconds):
+        echo_ndjson(record)
+
+
+@cli.command()
+@click.argument("images", nargs=-1, required=True)
+@click.option("--replicas", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option(
+    "--timeout", type=int, help="Seconds to wait for readiness (default 900)."
+)
+@click.option("--ready-pattern", help="Log line that marks a rune ready.")
+@click.option(
+    "--settle",
+    type=float,
+    default=5.0,
+    show_default=True,
+    help="Seconds after ready before memory is sampled.",
+)
+def bench(images, replicas, timeout, ready_pattern, settle):
+    """Measure the time to ready and memory of fresh runes of each IMAGE, then stop them.
+
+    Build one notebook with both runtimes to compare them, e.g.
+    `runes build nb.ipynb nb` and `runes build nb.ipynb nb-headless --runtime
+    headless`, then `runes bench nb nb-headless`.
+    """
+    from .readiness import bench_images
+
+    require_docker()
+    for record in bench_images(images, replicas, timeout, ready_pattern, settle):
+        echo_ndjson(record)
+
+
+def batch_build_jobs(source, manifest, published, prefix, runtime):
+    """
+    The builds of a batch: every notebook in the SOURCE directory, the
+    entries of a JSON manifest ([{"source", "image_name", "runtime"?}]) or
+    every published source. Image names are derived from the file or rune
+    name unless given, and must be unique.
+    """
+    jobs = []
+    if manifest:
+        with open(manifest) as f:
+            entries = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        for entry in entries:
+            entry_source = entry["source"]
+            if urlparse(entry_source).scheme not in ["http", "https"]:
+                entry_source = os.path.join(base_dir, entry_source)
+            jobs.append(
+                {
+                    "source": entry_source,
+                    "image_name": entry["image_name"],
+                    "runtime": entry.get("runtime", runtime),
+                }
+            )
+    elif published:
+        from .api import get_remote_sources
+
+        for remote_source in get_remote_sources():
+            jobs.append(
+                {
+                    "source": remote_source.source_url,
+                    "image_name": reformat_and_truncate_name(
+                        prefix + remote_source.remote_name
+                    ),
+                    "runtime": runtime,
+                }
+            )
+    else:
+        for file_name in sorted(os.listdir(source)):
+            if file_name.endswith(".ipynb"):
+                jobs.append(
+                    {
+                        "source": os.path.join(source, file_name),
+                        "image_name": reformat_and_truncate_name(
+                            prefix + file_name[: -len(".ipynb")]
+                        ),
+                        "runtime": runtime,
+                    }
+                )
+
+    # Builds of one image name would overwrite each other's tag and log file
+    sources = {}
+    for job in jobs:
+        sources.setdefault(job["image_name"], []).append(job["source"])
+    clashes = [
+        f"{image_name}: {', '.join(paths)}"
+        for image_name, paths in sources.items()
+        if len(paths) > 1
+    ]
+    if clashes:
+        raise click.ClickException(
+            "Several builds share an image name:\n" + "\n".join(clashes)
+        )
+    return jobs
+
+
+@cli.command()
+@click.argument("source", required=False)
+@click.argument("image_name", required=False)
+@click.option(
+    "--force", is_flag=True, help="Rebuild even if the sources are unchanged."
+)
+@click.option(
+    "--runtime",
+    type=click.Choice(["notebook", "headless"]),
+    default="notebook",
+    show_default=True,
+    help="Serve the executed notebook with Jupyter, or run it as a plain script.",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    help='JSON list of {"source", "image_name", "runtime"} to build.',
+)
+@click.option("--published", is_flag=True, help="Every published rune source.")
+@click.option("--prefix", default="", help="Prepended to derived image names.")
+@click.option("--workers", type=click.IntRange(min=1), help="Concurrent builds.")
+@click.option("--log-dir", help="Directory of the per-build logs of a batch.")
+@click.pass_context
+def build(
+    ctx,
+    source,
+    image_name,
+    force,
+    runtime,
+    manifest,
+    published,
+    prefix,
+    workers,
+    log_dir,
+):
+    """Build a rune image from a notebook SOURCE (a path or URL).
+
+    Building unchanged sources again only re-tags the image built from them.
+    With a directory SOURCE, --manifest or --published many images are built
+    concurrently, each logging to its own file, followed by a summary.
+    """
+    from .builder import DockerImageBuilder, build_report
+
+    batch = manifest or published or (source and os.path.isdir(source))
+    if not batch:
+        if not (source and image_name):
+            raise click.UsageError(
+                "Give SOURCE and IMAGE_NAME, a directory, --manifest or --published."
+            )
+        if not validate_notebook_source(source):
+            raise click.BadParameter(
+                "Not a URL or an existing .ipynb file.", param_hint="SOURCE"
+            )
+        if not is_valid_docker_image_name(image_name):
+            raise click.BadParameter(
+                "Not a valid Docker image name.", param_hint="IMAGE_NAME"
+            )
+
+    require_docker()
+    try:
+        builder = DockerImageBuilder()
+        if not batch:
+            echo_ndjson(builder.build_docker_image(source, image_name, force, runtime))
+            return
+
+        jobs = batch_build_jobs(source, manifest, published, prefix, runtime)
+        if not jobs:
+            raise click.ClickException("Nothing to build.")
+        summaries = []
+        for summary in builder.build_many(jobs, workers, log_dir, force):
+            summaries.append(summary)
+            echo_ndjson(summary)
+    except click.ClickException:
+        raise
+    except Exception as e:
+        raise click.ClickException(f"Error building the docker image: {e}")
+
+    report = build_report(summaries)
+    echo_ndjson(report)
+    if report["failed"]:
+        ctx.exit(1)
+
+
+@cli.command()
+@click.argument("images", nargs=-1)
+@click.option(
+    "--category",
+    "categories",
+    multiple=True,
+    help="Every catalog rune of this category (repeatable).",
+)
+@click.option("--recent", type=int, help="The N most recently run images.")
+@click.option("--workers", type=int, help="Maximum concurrent pulls.")
+@click.pass_context
+def prefetch(ctx, images, categories, recent, workers):
+    """Pull rune images ahead of time so starting them doesn't wait on the network.
+
+    Without arguments the configured policy (DN_CLI_PREFETCH_CATEGORIES,
+    DN_CLI_PREFETCH_RECENT) is applied.
+    """
+    from .prefetch import configured_images, prefetch_images, select_images
+
+    require_docker()
+    if images or categories or recent:
+        image_names = select_images(images, categories, recent)
+    else:
+        image_names = configured_images()
+    if not image_names:
+        raise click.UsageError(
+            "Give IMAGES, --category or --recent, or configure a prefetch policy."
+        )
+
+    ok = True
+    for record in prefetch_images(image_names, max_workers=workers):
+        ok = ok and "error" not in record
+        echo_ndjson(record)
+    if not ok:
+        ctx.exit(1)
+
+
+@cli.group()
+def pool():
+    """Keep pre-created containers of often used runes ready to start."""
+
+
+@pool.command("set")
+@click.argument("image_name")
+@click.option("--size", type=int, required=True, help="Containers to keep ready.")
+@click.option(
+    "--mode",
+    type=click.Choice(["created", "paused"]),
+    default="created",
+    show_default=True,
+    help="Keep containers created, or started and paused.",
+)
+@click.option("--gpu", is_flag=True, help="Pool containers for GPU starts.")
+@click.option("--name", "remote_name", help="Rune name of the pooled containers.")
+@click.option("--description", "remote_description", default="")
+def pool_set(image_name, size, mode, gpu, remote_name, remote_description):
+    """Set the warm pool size of an image and fill it."""
+    from .persistence import get_pool_target, set_pool_target
+    from .pool import discard_pooled, fill_pool, pooled_containers
+
+    require_docker()
+    if read_token_from_db() is None:
+        set_or_update_token(token=generate_uuid())
+
+    previous = get_pool_target(image_name)
+    if previous is not None and previous["mode"] != mode:
+        # Parked containers can't change mode, start over
+        from .containers import get_docker_client
+
+        discard_pooled(get_docker_client(), pooled_containers(image_name))
+
+    set_pool_target(
+        image_name, remote_name or image_name, remote_description, gpu, mode, size
+    )
+    echo_ndjson(fill_pool(get_pool_target(image_name)))
+
+
+@pool.command("ls")
+def pool_ls():
+    """List the warm pools with their hit rate and mean handoff latency."""
+    from .pool import pool_report
+
+    for record in pool_report():
+        echo_ndjson(record)
+
+
+@pool.command("fill")
+def pool_fill():
+    """Bring every warm pool to its size (runesd does this continuously)."""
+    from .pool import fill_pools
 
-    token = read_token_from_db()
-    if token is None:
-        print(set_or_update_token(token=generate_uuid()))
+    require_docker()
+    for record in fill_pools():
+        echo_ndjson(record)
 
+
+@pool.command("drain")
+@click.argument("image_name")
+def pool_drain(image_name):
+    """Remove the warm pool of an image and its containers."""
+    from .pool import drain_pool
+
+    require_docker()
+    echo_ndjson(drain_pool(image_name))
+
+
+@cli.group()
+def hosts():
+    """Manage the Docker hosts runes are placed on."""
+
+
+@hosts.command("add")
+@click.argument("name")
+@click.argument("url")
+def hosts_add(name, url):
+    """Add (or change) a host: a tcp://, ssh:// or unix:// url or a docker context."""
+    from .persistence import save_docker_host
+
+    save_docker_host(name, url)
+    echo_ndjson({"host": name, "url": url})
+
+
+@hosts.command("ls")
+def hosts_ls():
+    """List the hosts with their cores and running runes."""
+    from .hosts import for_each_host, get_host_url, host_load
+
+    for host, load, error in for_each_host(host_load):
+        record = {"host": host, "url": get_host_url(host), "reachable": error is None}
+        if error is None:
+            record.update(ncpu=load["ncpu"], running=load["running"])
+        else:
+            record["error"] = str(error)
+        echo_ndjson(record)
+
+
+@hosts.command("info")
+@click.argument("name", required=False)
+@click.option("--refresh", is_flag=True, help="Probe the daemon even if cached.")
+def hosts_info(name, refresh):
+    """Show the cached capabilities of a host (the local one by default)."""
+    from .capabilities import get_host_capabilities
+    from .containers import get_docker_client
+    from .hosts import LOCAL_HOST, get_host_url
+
+    name = name or LOCAL_HOST
+    try:
+        docker_host = get_host_url(name)
+        # Without a client the probe falls back to the local daemon
+        client = None
+        if refresh or name != LOCAL_HOST:
+            client = get_docker_client(name)
+            if client is None:
+                raise Exception("Unable to connect to Docker.")
+        record = get_host_capabilities(client, docker_host=docker_host, refresh=refresh)
+    except Exception as e:
+        raise click.ClickException(str(e))
+    echo_ndjson(dict(record, host=name))
+
+
+@hosts.command("rm")
+@click.argument("name")
+@click.pass_context
+def hosts_rm(ctx, name):
+    """Remove a host from the inventory."""
+    from .persistence import delete_docker_host
+
+    if not delete_docker_host(name):
+        click.echo(f"Unknown host: {name}", err=True)
+        ctx.exit(1)
+
+
+@cli.command()
+@click.option("--category", help="Only list runes of this category.")
+def catalog(category):
+    """List the published runes available to run."""
+    for record in agent_or_local("catalog", category=category):
+        echo_ndjson(record)
+
+
+def main():
     cli()
 
 
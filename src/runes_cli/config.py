@@ -2,3 +2,58 @@ import os
 
 URL_API = os.getenv("DN_CLI_API", "https://signalsandsorceryapi.com")
 URL_AUTH = os.getenv("DN_CLI_AUTH", "https://signalsandsorceryapi.com")
+
+# runesd agent: control socket (defaults to the cli data directory) and how
+# long, in seconds, it keeps the published runes catalog before re-fetching
+AGENT_SOCKET = os.getenv("DN_CLI_AGENT_SOCKET")
+CATALOG_TTL = int(os.getenv("DN_CLI_CATALOG_TTL", "300"))
+
+# Size of the connection pool shared by every Docker API call in a process
+DOCKER_POOL_SIZE = int(os.getenv("DN_CLI_DOCKER_POOL_SIZE", "32"))
+
+# Maximum number of rune containers started or stopped concurrently
+DOCKER_WORKERS = int(os.getenv("DN_CLI_DOCKER_WORKERS", "8"))
+
+# Rune log archives: compression ("zstd" needs the zstandard package, the
+# default falls back to "gzip" without it) and the size at which a compressed
+# segment is rotated
+LOG_COMPRESSION = os.getenv("DN_CLI_LOG_COMPRESSION")
+LOG_SEGMENT_BYTES = int(os.getenv("DN_CLI_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+
+# Resource samples kept in memory per rune by `runes top` (one per second)
+STATS_HISTORY = int(os.getenv("DN_CLI_STATS_HISTORY", "300"))
+
+# Image prefetching: concurrent pulls, and the policy runesd applies every
+# DN_CLI_PREFETCH_INTERVAL seconds (comma separated catalog categories to
+# keep pulled, and how many of the most recently run images)
+PULL_WORKERS = int(os.getenv("DN_CLI_PULL_WORKERS", "3"))
+PREFETCH_CATEGORIES = [
+    category.strip()
+    for category in os.getenv("DN_CLI_PREFETCH_CATEGORIES", "").split(",")
+    if category.strip()
+]
+PREFETCH_RECENT = int(os.getenv("DN_CLI_PREFETCH_RECENT", "0"))
+PREFETCH_INTERVAL = int(os.getenv("DN_CLI_PREFETCH_INTERVAL", "3600"))
+
+# Rune readiness: a regular expression matched against container log lines
+# (for images without a Docker healthcheck), by default the dawnet client
+# registering with the server, and how many seconds `--wait` waits for it
+READY_PATTERN = os.getenv(
+    "DN_CLI_READY_PATTERN",
+    r"Sent contract for registration|Created a temporary directory",
+)
+READY_TIMEOUT = int(os.getenv("DN_CLI_READY_TIMEOUT", "900"))
+
+# Docker hosts runes are placed on ("name=url,name=url", a url without a
+# scheme names a docker context; `runes hosts add` otherwise) and how a host
+# is chosen for a new rune: least-loaded, pack or spread
+DOCKER_HOSTS = os.getenv("DN_CLI_DOCKER_HOSTS")
+PLACEMENT_POLICY = os.getenv("DN_CLI_PLACEMENT", "least-loaded")
+
+# Build rune images with BuildKit through the docker CLI when it is
+# installed, for apt / pip cache mounts ("0" always uses the legacy builder
+# of the Docker API)
+BUILDKIT = os.getenv("DN_CLI_BUILDKIT", "1") != "0"
+
+# Rune images built concurrently by a batch `runes build`
+BUILD_WORKERS = int(os.getenv("DN_CLI_BUILD_WORKERS", "4"))
@@ -1,35 +1,72 @@
 import click
 import docker
 from docker.models.containers import Container
-from .persistence import save_container_state, update_container_state
+from .config import DOCKER_WORKERS
+from .capabilities import get_host_capabilities
+from .models import RemoteContainer
+from .persistence import (
+    STATUS_RUNNING,
+    STATUS_STOPPED,
+    delete_container_state,
+    finish_container_starts,
+    generate_uuid,
+    get_container_states,
+    iter_container_states,
+    record_container_started,
+    release_cpusets,
+    reserve_container_state,
+    reserve_container_states,
+    restore_container_states,
+    update_container_state,
+    update_container_states,
+)
 import warnings
-import subprocess
 import json
 import os
 import base64
+import codecs
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
+# Seconds a successful ping of the shared Docker client is trusted for
+DOCKER_PING_INTERVAL = 5.0
 
-def check_nvidia_docker_installed():
-    try:
-        # Run 'docker info' and capture the output
-        result = subprocess.run(
-            ["docker", "info", "--format", "{{json .}}"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+# host -> [client, checked_at, lock]; None is the local host
+_docker_clients = {}
+_docker_client_lock = threading.Lock()
 
-        if result.returncode == 0:
-            docker_info = json.loads(result.stdout)
+# Seconds a rune is given to exit on stop before Docker kills it
+DEFAULT_STOP_GRACE = 10
 
-            # Check for 'nvidia' in Runtimes
-            if "Runtimes" in docker_info and "nvidia" in docker_info["Runtimes"]:
-                return True
-            else:
-                return False
+# Labels stamped on every rune container. They let the running runes be
+# listed with one filtered query, and the database be rebuilt if it is lost.
+LABEL_MANAGED = "app.runes.managed"
+LABEL_NAME = "app.runes.name"
+LABEL_DESCRIPTION = "app.runes.description"
+LABEL_TOKEN = "app.runes.token"
+LABEL_DB_ID = "app.runes.db_id"
+LABEL_CPUSET = "app.runes.cpuset"
+
+
+def check_nvidia_docker_installed(host=None):
+    try:
+        if host is None:
+            client, docker_host = None, None
         else:
-            print(f"Error running 'docker info': {result.stderr}")
-            return False
+            from .hosts import get_host_url
+
+            client, docker_host = get_docker_client(host), get_host_url(host)
+        # Cached probe of the daemon, only re-run when the daemon has changed
+        capabilities = get_host_capabilities(client, docker_host=docker_host)
+        if "nvidia" in capabilities["runtimes"]:
+            return True
+        # The fingerprint can miss a daemon restart (e.g. under systemd socket
+        # activation), so probe again before refusing a GPU start
+        capabilities = get_host_capabilities(
+            client, docker_host=docker_host, refresh=True
+        )
+        return "nvidia" in capabilities["runtimes"]
     except Exception as e:
         print(f"Exception occurred: {e}")
         return False
@@ -91,18 +128,42 @@ def format_image_name(input_str: str) -> str:
     return formatted_str
 
 
-def get_docker_client():
-    try:
-        client = docker.from_env()
-        client.ping()  # This method checks if Docker daemon is accessible
-        return client
-    # except docker.errors.DockerException as e:
-    #     click.echo(f"Failed to connect to Docker: {e}", err=True)
-    #     click.get_current_context().exit(1)
-    except Exception:
-        # click.echo(f"An error occurred: {e}", err=True)
-        # click.get_current_context().exit(1)
-        return None
+def get_docker_client(host=None):
+    """
+    Returns the process-wide Docker client of a host (see `hosts`, None is
+    the local one), or None if its daemon is not reachable. All callers share
+    its connection pool, and the daemon is only pinged again once the last
+    successful check is older than DOCKER_PING_INTERVAL.
+    """
+    from .hosts import LOCAL_HOST, connect
+
+    if host == LOCAL_HOST:
+        host = None
+    with _docker_client_lock:
+        entry = _docker_clients.setdefault(host, [None, 0.0, threading.Lock()])
+
+    # One lock per host, so a slow remote daemon doesn't hold up the others
+    with entry[2]:
+        client, checked_at, _ = entry
+        now = time.monotonic()
+        if client is not None and now - checked_at < DOCKER_PING_INTERVAL:
+            return client
+
+        try:
+            if client is None:
+                client = connect(host)
+            client.ping()  # This method checks if Docker daemon is accessible
+            entry[0], entry[1] = client, now
+            return client
+        # except docker.errors.DockerException as e:
+        #     click.echo(f"Failed to connect to Docker: {e}", err=True)
+        #     click.get_current_context().exit(1)
+        except Exception:
+            # Drop the client so the next call reconnects from scratch
+            if client is not None:
+                client.close()
+            entry[0] = None
+            return None
 
 
 # click.echo(f"Failed to connect to Docker: {e}", err=True)
@@ -125,62 +186,384 @@ def start_container(
     gpu: bool = False,
     command=None,
     name=None,
+    resources=None,
 ) -> Container:
+    from .resources import allocate_cpusets
+
+    prepared = prepare_start(gpu)
+    if prepared is None:
+        return None
+    client, device_requests = prepared
+
+    # Pooled containers are created without resource limits
+    if command is None and name is None and resources is None:
+        from .pool import take_from_pool
+
+        handed_off = take_from_pool(
+            client, image_name, remote_name, remote_description, token, gpu
+        )
+        if handed_off:
+            container, handoff_ms = handed_off[0]
+            click.echo(
+                f"Container handed off from the warm pool in {handoff_ms:.0f} ms with Token: {token}",
+                err=True,
+            )
+            return container
+
+    (cpuset,), reservation = allocate_cpusets(resources, 1, client)
+
+    # Reserve the database row first, its id is one of the container labels
+    row_id = reserve_container_state(remote_name, remote_description, token, image_name)
+
+    # Run the container
+    try:
+        container = run_rune_container(
+            client,
+            row_id,
+            image_name,
+            remote_name,
+            remote_description,
+            token,
+            device_requests,
+            command=command,
+            name=name,
+            resources=resources,
+            cpuset=cpuset,
+        )
+    except Exception:
+        delete_container_state(row_id)
+        raise
+    finally:
+        # The container's label holds its cores from here on
+        release_cpusets(reservation)
+
+    pid = container.attrs["State"]["Pid"]
+
+    click.echo(f"Container started with Token: {token}", err=True)
+
+    # Persist PID in SQLite database
+    record_container_started(row_id, pid, container.id)
+
+    # Fetch and print container logs
+    # print("Fetching container logs...")
+    # logs = container.logs(stream=True)
+    # for log in logs:
+    #     print(log.decode("utf-8"))
+
+    # Fetch and print initial container logs (without streaming)
+    # print("Fetching initial container logs...")
+    # logs = container.logs()
+    # print(logs.decode("utf-8"))
+
+    return container
+
+
+def prepare_start(gpu, host=None):
+    """
+    Returns the Docker client and GPU device requests for starting runes, or
+    None (after reporting why) if they can't be started.
+    """
     # Check for GPU support if required
-    if gpu and not check_nvidia_docker_installed():
+    if gpu and not check_nvidia_docker_installed(host):
         click.echo(
-            "Error: GPU requested but the `nvidia-docker` extension was not found on this machine. Please follow Nvidia's install instructions: https://docs.nvidia.com/datacenter/cloud-native/container-toolkit/latest/install-guide.html"
+            "Error: GPU requested but the `nvidia-docker` extension was not found on this machine. Please follow Nvidia's install instructions: https://docs.nvidia.com/datacenter/cloud-native/container-toolkit/latest/install-guide.html",
+            err=True,
         )
         return None
 
     # Get Docker client
-    client = docker.from_env()
+    client = get_docker_client(host)
+    if client is None:
+        click.echo("Error: Unable to connect to Docker.", err=True)
+        return None
 
     # Device requests for GPU
     device_requests = None
     if gpu:
         device_requests = [docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])]
 
-    # Run the container
-    container = client.containers.run(
+    return client, device_requests
+
+
+def run_rune_container(
+    client,
+    row_id,
+    image_name,
+    remote_name,
+    remote_description,
+    token,
+    device_requests=None,
+    command=None,
+    name=None,
+    create_only=False,
+    resources=None,
+    cpuset=None,
+):
+    """
+    Runs a rune container, or with create_only just creates it (for the warm
+    pool). resources is a ResourceSpec and cpuset the cores allocated to it.
+    Returns the container with its attributes loaded.
+    """
+    from .resources import container_options
+
+    options, environment = container_options(resources, cpuset)
+    labels = rune_labels(row_id, remote_name, remote_description, token)
+    if cpuset is not None:
+        labels[LABEL_CPUSET] = cpuset
+
+    run_or_create = client.containers.create if create_only else client.containers.run
+    container = run_or_create(
         image_name,
         command=command,
         name=name,
         detach=True,
-        environment={"DN_CLIENT_TOKEN": token},
+        environment=dict(environment, DN_CLIENT_TOKEN=token),
         # environment={"DN_CLIENT_TOKEN": token, "PYDEVD_DISABLE_FILE_VALIDATION": 1},
         device_requests=device_requests,  # Add device requests here
+        labels=labels,
+        **options,
     )
 
     # Get PID of the running container
     container.reload()  # Reload to update attributes
-    pid = container.attrs["State"]["Pid"]
+    return container
 
-    print(f"Container started with Token: {token}")
 
-    # Persist PID in SQLite database
-    save_container_state(
+def start_replicas(
+    image_name: str,
+    remote_name: str,
+    remote_description: str,
+    token: str,
+    replicas: int = 1,
+    gpu: bool = False,
+    unique_tokens: bool = False,
+    max_workers: int = None,
+    resources=None,
+    host: str = None,
+    use_pool: bool = True,
+) -> list:
+    """
+    Starts `replicas` containers of an image concurrently on a bounded worker
+    pool. With unique_tokens each replica gets its own generated token.
+    The rows are reserved, and afterwards recorded, in one transaction each.
+    Replicas sharing the token, without resource limits, are taken from the
+    warm pool first unless use_pool is False. Pinned replicas (see ResourceSpec) get disjoint cores.
+    host is the Docker host (see `hosts`) to start them on, None the local one.
+    Returns one result dict per replica, including its start latency.
+    """
+    from .hosts import LOCAL_HOST
+    from .pool import take_from_pool
+    from .resources import allocate_cpusets
+
+    if host == LOCAL_HOST:
+        host = None
+    prepared = prepare_start(gpu, host)
+    if prepared is None:
+        return [
+            {"replica": replica, "started": False, "error": "Unable to start"}
+            for replica in range(replicas)
+        ]
+    client, device_requests = prepared
+
+    results = []
+    # The warm pool is kept on the local host only
+    if use_pool and not unique_tokens and resources is None and host is None:
+        handed_off = take_from_pool(
+            client, image_name, remote_name, remote_description, token, gpu, replicas
+        )
+        for container, handoff_ms in handed_off:
+            results.append(
+                {
+                    "replica": len(results),
+                    "associated_token": token,
+                    "started": True,
+                    "container_id": container.id,
+                    "pid": container.attrs["State"]["Pid"],
+                    "start_ms": round(handoff_ms, 1),
+                    "pooled": True,
+                }
+            )
+        replicas -= len(results)
+        if not replicas:
+            return results
+
+    try:
+        cpusets, reservation = allocate_cpusets(resources, replicas, client, host)
+    except Exception as e:
+        return results + [
+            {"replica": replica, "started": False, "error": str(e)}
+            for replica in range(len(results), len(results) + replicas)
+        ]
+
+    tokens = [generate_uuid() if unique_tokens else token for _ in range(replicas)]
+    row_ids = reserve_container_states(
+        [(remote_name, remote_description, t, image_name) for t in tokens],
+        host=host,
+    )
+
+    def launch(row_id, replica_token, cpuset):
+        started_at = time.monotonic()
+        container = run_rune_container(
+            client,
+            row_id,
+            image_name,
+            remote_name,
+            remote_description,
+            replica_token,
+            device_requests,
+            resources=resources,
+            cpuset=cpuset,
+        )
+        return container, (time.monotonic() - started_at) * 1000
+
+    started, failed = [], []
+    workers = min(replicas, max_workers or DOCKER_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(launch, row_id, replica_token, cpuset)
+            for row_id, replica_token, cpuset in zip(row_ids, tokens, cpusets)
+        ]
+        # Every container exists (or failed to) once its future is done
+        wait(futures)
+        release_cpusets(reservation)
+        for replica, (row_id, replica_token, cpuset, future) in enumerate(
+            zip(row_ids, tokens, cpusets, futures), start=len(results)
+        ):
+            result = {"replica": replica, "associated_token": replica_token}
+            if cpuset is not None:
+                result["cpuset"] = cpuset
+            try:
+                container, start_ms = future.result()
+            except Exception as e:
+                failed.append(row_id)
+                result.update(started=False, error=str(e))
+            else:
+                pid = container.attrs["State"]["Pid"]
+                started.append((row_id, pid, container.id))
+                result.update(
+                    started=True,
+                    container_id=container.id,
+                    pid=pid,
+                    start_ms=round(start_ms, 1),
+                )
+            results.append(result)
+
+    finish_container_starts(started, failed)
+    if host is not None:
+        for result in results:
+            result["host"] = host
+    return results
+
+
+def rune_labels(row_id, remote_name, remote_description, token):
+    return {
+        LABEL_MANAGED: "true",
+        LABEL_NAME: remote_name or "",
+        LABEL_DESCRIPTION: remote_description or "",
+        LABEL_TOKEN: token or "",
+        LABEL_DB_ID: str(row_id),
+    }
+
+
+def list_rune_containers(all=False, client=None):
+    """
+    Lists rune containers with a single API call. Returns the raw summaries
+    (Id, Image, Labels, State, ...) rather than inspecting every container.
+    """
+    client = client or get_docker_client()
+    return client.api.containers(all=all, filters={"label": LABEL_MANAGED})
+
+
+def container_from_labels(container_id, labels, image_name, pid, status, host=None):
+    db_id = labels.get(LABEL_DB_ID, "")
+    return RemoteContainer(
+        id=int(db_id) if db_id.isdigit() else None,
         pid=pid,
-        container_id=container.id,
-        remote_name=remote_name,
-        remote_description=remote_description,
-        associated_token=token,
-        status=1,
+        container_id=container_id,
+        remote_name=labels.get(LABEL_NAME, ""),
+        remote_description=labels.get(LABEL_DESCRIPTION, ""),
+        associated_token=labels.get(LABEL_TOKEN) or None,
+        status=status,
+        image_name=image_name,
+        host=host,
     )
-    # save_container_state(pid, container.id, remote_name, token, 1)
 
-    # Fetch and print container logs
-    # print("Fetching container logs...")
-    # logs = container.logs(stream=True)
-    # for log in logs:
-    #     print(log.decode("utf-8"))
 
-    # Fetch and print initial container logs (without streaming)
-    # print("Fetching initial container logs...")
-    # logs = container.logs()
-    # print(logs.decode("utf-8"))
+def reconcile_container_states(client=None, host=None):
+    """
+    Syncs the stored state of the host's running runes with Docker using one
+    filtered container list. Rows whose container is gone or stopped are
+    marked stopped in one batched update. Returns the rows still running.
+    """
+    from .hosts import LOCAL_HOST
 
-    return container
+    client = client or get_docker_client(host)
+    running_ids = {summary["Id"] for summary in list_rune_containers(client=client)}
+
+    running, unlisted = [], []
+    for container in get_container_states(status=STATUS_RUNNING):
+        if (container.host or LOCAL_HOST) != (host or LOCAL_HOST):
+            continue
+        if container.container_id in running_ids:
+            running.append(container)
+        else:
+            unlisted.append(container)
+
+    if unlisted:
+        # Runes started before containers were labelled don't match the label
+        # filter: look their ids up (in one more call) before calling them gone
+        still_running = {
+            summary["Id"]
+            for summary in client.api.containers(
+                filters={"id": [container.container_id for container in unlisted]}
+            )
+        }
+        stale = []
+        for container in unlisted:
+            if container.container_id in still_running:
+                running.append(container)
+            else:
+                stale.append(container.container_id)
+        if stale:
+            update_container_states(stale, STATUS_STOPPED)
+
+    return running
+
+
+def rebuild_container_states(client=None, host=None):
+    """
+    Recreates the database rows of rune containers that are missing from it,
+    using only the containers' labels. Returns the restored rows.
+    """
+    from .hosts import LOCAL_HOST
+
+    if host == LOCAL_HOST:
+        host = None
+    client = client or get_docker_client(host)
+    known = {container.container_id for container in iter_container_states()}
+
+    restored = []
+    for summary in list_rune_containers(all=True, client=client):
+        if summary["Id"] in known:
+            continue
+
+        running = summary.get("State") == "running"
+        pid = 0
+        if running:
+            pid = client.api.inspect_container(summary["Id"])["State"]["Pid"]
+        restored.append(
+            container_from_labels(
+                summary["Id"],
+                summary.get("Labels") or {},
+                summary.get("Image"),
+                pid,
+                STATUS_RUNNING if running else STATUS_STOPPED,
+                host,
+            )
+        )
+
+    restore_container_states(restored)
+    return restored
 
 
 def is_container_running(container_id):
@@ -200,7 +583,7 @@ def stop_container(container_id):
         # print(f"Error Stopping container: {container_id}")
         return
 
-    print(f"Stopped container {container_id} successfully.")
+    click.echo(f"Stopped container {container_id} successfully.", err=True)
 
     status = 0  # STOPPED
     update_container_state(container_id, status)
@@ -208,6 +591,75 @@ def stop_container(container_id):
     return container
 
 
+def stop_containers(
+    container_ids,
+    grace: int = DEFAULT_STOP_GRACE,
+    force: bool = True,
+    restart: bool = False,
+    max_workers: int = None,
+    host: str = None,
+) -> list:
+    """
+    Stops (or restarts) many containers of one host concurrently. Each one
+    gets `grace` seconds to exit before Docker kills it. If the stop itself
+    fails, the container is force-killed unless force is False; a failed
+    restart is reported, leaving the container's state as it was. Stored
+    statuses are updated in one batch at the end. Returns one result dict per
+    container.
+    """
+    container_ids = list(container_ids)
+    if not container_ids:
+        return []
+
+    client = get_docker_client(host)
+    if client is None:
+        raise Exception("Unable to connect to Docker.")
+
+    def stop_one(container_id):
+        started_at = time.monotonic()
+        try:
+            if restart:
+                client.api.restart(container_id, timeout=grace)
+                outcome = "restarted"
+            else:
+                client.api.stop(container_id, timeout=grace)
+                outcome = "stopped"
+        except docker.errors.NotFound:
+            outcome = "missing"
+        except Exception:
+            # A failed restart is reported as such: killing the rune would
+            # leave it down after a restart was asked for
+            if restart or not force:
+                raise
+            client.api.kill(container_id)
+            outcome = "killed"
+        return outcome, (time.monotonic() - started_at) * 1000
+
+    results, stopped, restarted = [], [], []
+    workers = min(len(container_ids), max_workers or DOCKER_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(stop_one, container_id) for container_id in container_ids
+        ]
+        for container_id, future in zip(container_ids, futures):
+            result = {"container_id": container_id}
+            try:
+                outcome, elapsed_ms = future.result()
+            except Exception as e:
+                result.update(ok=False, error=str(e))
+            else:
+                result.update(ok=True, outcome=outcome, ms=round(elapsed_ms, 1))
+                if outcome == "restarted":
+                    restarted.append(container_id)
+                else:
+                    stopped.append(container_id)
+            results.append(result)
+
+    update_container_states(stopped, STATUS_STOPPED)
+    update_container_states(restarted, STATUS_RUNNING)
+    return results
+
+
 def build_image(image_name: str, path_to_dockerfile: str):
     """
     Build a Docker image from a Dockerfile.
@@ -243,20 +695,13 @@ def build_image(image_name: str, path_to_dockerfile: str):
     return None
 
 
-def capture_logs(container_id, log_file_path):
-    # Capture container's stdout/stderr to a file
-    container = get_docker_client().containers.get(container_id)
-    logs = container.logs(stream=True)
-
-    with open(log_file_path, "wb") as log_file:
-        for chunk in logs:
-            log_file.write(chunk)
-
-
 def tail_logs(container_id):
     # Tail container's stdout/stderr to the terminal
     container = get_docker_client().containers.get(container_id)
     logs = container.logs(stream=True, follow=True)
 
+    # Chunks can end in the middle of a multibyte character
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
     for chunk in logs:
-        print(chunk.decode("utf-8"), end="")
+        print(decoder.decode(chunk), end="")
+    print(decoder.decode(b"", final=True), end="")
@@ -0,0 +1,159 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import DOCKER_HOSTS, DOCKER_POOL_SIZE, PLACEMENT_POLICY
+from .capabilities import DEFAULT_DOCKER_HOST
+from .persistence import get_docker_hosts
+
+# Inventory of the Docker daemons runes are placed on. Hosts come from
+# DN_CLI_DOCKER_HOSTS ("name=url,name=url") or else from `runes hosts add`;
+# a url without a scheme is the name of a docker context. Without an
+# inventory there is the one `local` host (DOCKER_HOST or the local socket),
+# which is also what rows without a host refer to.
+
+LOCAL_HOST = "local"
+
+PLACEMENT_POLICIES = ["least-loaded", "pack", "spread"]
+
+
+def get_inventory():
+    """
+    Returns {host name: url} for every configured host.
+    """
+    if DOCKER_HOSTS:
+        inventory = {}
+        for entry in DOCKER_HOSTS.split(","):
+            name, _, url = entry.strip().rpartition("=")
+            if url:
+                inventory[name or url] = url
+        return inventory
+    return dict(get_docker_hosts())
+
+
+def get_hosts():
+    return list(get_inventory()) or [LOCAL_HOST]
+
+
+def get_host_url(name):
+    url = get_inventory().get(name or LOCAL_HOST)
+    if url is None:
+        if name not in (None, LOCAL_HOST):
+            raise Exception(f"Unknown Docker host: {name}")
+        url = os.getenv("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+    return url
+
+
+def connect(name):
+    """
+    Creates a Docker client for a host of the inventory.
+    """
+    import docker
+
+    if name in (None, LOCAL_HOST) and LOCAL_HOST not in get_inventory():
+        return docker.from_env(max_pool_size=DOCKER_POOL_SIZE)
+
+    url = get_host_url(name)
+    if "://" in url:
+        return docker.DockerClient(base_url=url, max_pool_size=DOCKER_POOL_SIZE)
+
+    from docker.context import ContextAPI
+
+    context = ContextAPI.get_context(url)
+    if context is None:
+        raise Exception(f"Unknown docker context: {url}")
+    return docker.DockerClient(
+        base_url=context.Host, tls=context.TLSConfig, max_pool_size=DOCKER_POOL_SIZE
+    )
+
+
+def for_each_host(fn, hosts=None):
+    """
+    Calls fn(host, client) for every host concurrently. Returns a list of
+    (host, result, error) in inventory order; unreachable hosts get an error.
+    """
+    from .containers import get_docker_client
+
+    hosts = hosts or get_hosts()
+
+    def call(host):
+        client = get_docker_client(host)
+        if client is None:
+            raise Exception(f"Unable to connect to Docker on {host}.")
+        return fn(host, client)
+
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        futures = [pool.submit(call, host) for host in hosts]
+        results = []
+        for host, future in zip(hosts, futures):
+            try:
+                results.append((host, future.result(), None))
+            except Exception as e:
+                results.append((host, None, e))
+        return results
+
+
+def host_load(host, client, image_name=None):
+    """
+    Returns the cores of a host and its running runes (of the image, too),
+    from one filtered container list.
+    """
+    from .containers import list_rune_containers
+    from .capabilities import get_host_capabilities
+
+    summaries = list_rune_containers(client=client)
+    capabilities = get_host_capabilities(client, docker_host=get_host_url(host))
+    return {
+        "host": host,
+        "ncpu": capabilities["ncpu"] or 1,
+        "running": len(summaries),
+        "image_running": sum(
+            1 for summary in summaries if summary.get("Image") == image_name
+        ),
+    }
+
+
+def host_loads(image_name=None, hosts=None):
+    """
+    Returns the load of every reachable host.
+    """
+    results = for_each_host(
+        lambda host, client: host_load(host, client, image_name), hosts
+    )
+    return [load for _, load, error in results if error is None]
+
+
+def place_replicas(count, image_name=None, policy=None, hosts=None):
+    """
+    Chooses a host for each of `count` replicas of an image:
+
+    - least-loaded: the host with the fewest runes per core
+    - pack: the busiest host that still has fewer runes than cores
+    - spread: the host with the fewest runes of this image
+    """
+    policy = policy or PLACEMENT_POLICY
+    if policy not in PLACEMENT_POLICIES:
+        raise Exception(f"Unknown placement policy: {policy}")
+
+    loads = host_loads(image_name, hosts)
+    if not loads:
+        raise Exception("No Docker host is reachable.")
+
+    def per_core(load):
+        return load["running"] / load["ncpu"]
+
+    placed = []
+    for _ in range(count):
+        if policy == "spread":
+            load = min(loads, key=lambda load: (load["image_running"], per_core(load)))
+        elif policy == "pack":
+            open_hosts = [load for load in loads if load["running"] < load["ncpu"]]
+            if open_hosts:
+                load = max(open_hosts, key=lambda load: load["running"])
+            else:
+                load = min(loads, key=per_core)
+        else:
+            load = min(loads, key=per_core)
+        load["running"] += 1
+        load["image_running"] += 1
+        placed.append(load["host"])
+    return placed
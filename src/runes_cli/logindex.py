@@ -0,0 +1,105 @@
+import time
+from datetime import datetime, timezone
+
+from .persistence import (
+    add_log_entries,
+    get_log_cursor,
+    prune_log_entries,
+    search_log_entries,
+)
+
+# A local full-text index of rune logs, stored in the SQLite database as
+# log_entries (one row per line, keyed by the container_pids row) plus an
+# FTS5 index over the lines. Indexing is incremental through the `index` log
+# cursor, so lines of stopped runes stay searchable once they were indexed,
+# until they are pruned (`logs index --keep 30d`).
+
+CURSOR_CONSUMER = "index"
+
+# Lines stored per transaction while indexing
+BATCH_LINES = 5000
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def index_container_logs(container, client=None):
+    """
+    Adds the log lines a rune has written since it was last indexed.
+    Returns a summary of what was indexed.
+    """
+    from .logs import iter_new_log_lines
+
+    since_ns = get_log_cursor(container.container_id, CURSOR_CONSUMER)
+    lines = 0
+    batch = []
+    for entry in iter_new_log_lines(container.container_id, since_ns, client):
+        batch.append(entry)
+        if len(batch) >= BATCH_LINES:
+            add_log_entries(
+                container.id, container.container_id, CURSOR_CONSUMER, batch
+            )
+            lines += len(batch)
+            batch = []
+    add_log_entries(container.id, container.container_id, CURSOR_CONSUMER, batch)
+    lines += len(batch)
+
+    return {"id": container.id, "container_id": container.container_id, "lines": lines}
+
+
+def prune_logs(keep):
+    """
+    Removes the indexed lines older than the `keep` duration ("30d").
+    Returns a summary of what was pruned.
+    """
+    before_ns = time.time_ns() - int(parse_duration(keep) * 1e9)
+    return {
+        "pruned": prune_log_entries(before_ns, BATCH_LINES),
+        "before": format_timestamp_ns(before_ns),
+    }
+
+
+def parse_duration(text):
+    """
+    Converts a duration such as "90s", "30m", "24h" or "7d" to seconds.
+    """
+    value = text.strip().lower()
+    unit = DURATION_UNITS.get(value[-1:], None)
+    try:
+        if unit is None:
+            return float(value)
+        return float(value[:-1]) * unit
+    except ValueError:
+        raise ValueError(f"Invalid duration: {text}")
+
+
+def to_match_query(query):
+    # Every word is quoted so punctuation in log text ("out-of-memory",
+    # "cuda:0") can't be read as FTS5 syntax; the words are ANDed
+    words = query.split()
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def format_timestamp_ns(ts_ns):
+    moment = datetime.fromtimestamp(ts_ns // 1_000_000_000, timezone.utc)
+    return f"{moment:%Y-%m-%dT%H:%M:%S}.{ts_ns % 1_000_000_000:09d}Z"
+
+
+def search_logs(query, since=None, until=None, limit=100, raw=False):
+    """
+    Searches the indexed log lines of every rune, newest first. since and
+    until are durations before now ("24h"); raw passes the query to FTS5
+    unchanged.
+    """
+    now_ns = time.time_ns()
+    since_ns = now_ns - int(parse_duration(since) * 1e9) if since else None
+    until_ns = now_ns - int(parse_duration(until) * 1e9) if until else None
+
+    match = query if raw else to_match_query(query)
+    for ts_ns, line, container in search_log_entries(match, since_ns, until_ns, limit):
+        yield {
+            "timestamp": format_timestamp_ns(ts_ns),
+            "container_id": container.container_id if container else None,
+            "remote_name": container.remote_name if container else None,
+            "image_name": container.image_name if container else None,
+            "line": line,
+        }
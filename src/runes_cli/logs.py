@@ -0,0 +1,341 @@
+import asyncio
+import codecs
+import os
+import struct
+import threading
+
+import click
+
+from .capabilities import DEFAULT_DOCKER_HOST
+
+# Follows the logs of many runes at once on one asyncio event loop, talking
+# to the Docker API directly through aiohttp. Output is decoded incrementally
+# per stream, split into whole lines, prefixed per container and written to
+# stdout in batches.
+
+# Seconds / bytes of buffered output before it is written to stdout
+FLUSH_INTERVAL = 0.05
+FLUSH_BYTES = 64 * 1024
+
+PREFIX_COLORS = ["cyan", "green", "yellow", "magenta", "blue", "red"]
+
+
+class LineSplitter:
+    """
+    Incrementally decodes a byte stream into complete lines. A multibyte
+    character or a line split across chunks is held back until it is whole.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial = ""
+
+    def feed(self, data, final=False):
+        lines = (self.partial + self.decoder.decode(data, final)).split("\n")
+        self.partial = lines.pop()
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = ""
+        return lines
+
+
+class Output:
+    """
+    Collects prefixed lines and writes them in batches, either when the
+    buffer is full or every FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.size = 0
+
+    def write_lines(self, prefix, lines):
+        for line in lines:
+            line = line.rstrip("\r")
+            entry = f"{prefix}{line}\n"
+            self.pending.append(entry)
+            self.size += len(entry)
+        if self.size >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            click.echo("".join(self.pending), nl=False)
+            self.pending = []
+            self.size = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+
+def docker_connection(docker_host=None):
+    """
+    Returns an aiohttp connector and base url for the Docker API at
+    docker_host (default DOCKER_HOST), or None for daemons aiohttp can't
+    reach directly (ssh://, TLS, docker contexts).
+    """
+    import aiohttp
+
+    docker_host = docker_host or os.getenv("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+    if docker_host.startswith("unix://"):
+        return (
+            aiohttp.UnixConnector(path=docker_host[len("unix://") :]),
+            "http://docker",
+        )
+    if docker_host.startswith("tcp://") and not os.getenv("DOCKER_TLS_VERIFY"):
+        return aiohttp.TCPConnector(), f"http://{docker_host[len('tcp://'):]}"
+    return None
+
+
+def in_thread(fn):
+    """
+    Runs a blocking call on a daemon thread (a followed log never ends, so it
+    must not hold up interpreter exit) and returns an awaitable of its result.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(setter, value):
+        if not future.done():
+            setter(value)
+
+    def run():
+        try:
+            result = fn()
+        except Exception as e:
+            callback = (settle, future.set_exception, e)
+        else:
+            callback = (settle, future.set_result, result)
+        try:
+            loop.call_soon_threadsafe(*callback)
+        except RuntimeError:
+            pass  # The loop is already closed
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+async def follow_container_client(client, info, prefix, output, follow, tail):
+    """
+    Follows a container through its docker-py client, for daemons without an
+    aiohttp connection. docker-py strips the stream of each frame, so stdout
+    and stderr are followed separately, each with its own line splitter, and
+    their lines are handed to the event loop's output.
+    """
+    loop = asyncio.get_running_loop()
+
+    def pump(stream_name):
+        stream = client.api.logs(
+            info["Id"],
+            stdout=stream_name == "stdout",
+            stderr=stream_name == "stderr",
+            stream=True,
+            follow=follow,
+            tail=tail if tail == "all" else int(tail),
+        )
+        splitter = LineSplitter()
+        for chunk in stream:
+            loop.call_soon_threadsafe(output.write_lines, prefix, splitter.feed(chunk))
+        loop.call_soon_threadsafe(
+            output.write_lines, prefix, splitter.feed(b"", final=True)
+        )
+
+    await asyncio.gather(
+        in_thread(lambda: pump("stdout")), in_thread(lambda: pump("stderr"))
+    )
+
+
+async def inspect_container(session, base_url, container_id):
+    async with session.get(f"{base_url}/containers/{container_id}/json") as response:
+        if response.status != 200:
+            raise Exception(f"{container_id}: {await response.text()}")
+        return await response.json()
+
+
+def make_prefixes(infos):
+    from .containers import LABEL_NAME
+
+    names = []
+    for info in infos:
+        labels = info["Config"].get("Labels") or {}
+        name = labels.get(LABEL_NAME) or info["Name"].lstrip("/")
+        names.append(f"{info['Id'][:12]} {name}")
+
+    width = max(len(name) for name in names)
+    return [
+        click.style(f"{name:<{width}} | ", fg=PREFIX_COLORS[i % len(PREFIX_COLORS)])
+        for i, name in enumerate(names)
+    ]
+
+
+async def follow_container(session, base_url, info, prefix, output, follow, tail):
+    params = {
+        "stdout": "1",
+        "stderr": "1",
+        "follow": "1" if follow else "0",
+        "tail": str(tail),
+    }
+    url = f"{base_url}/containers/{info['Id']}/logs"
+    async with session.get(url, params=params) as response:
+        if response.status != 200:
+            raise Exception(f"{info['Id'][:12]}: {await response.text()}")
+
+        if info["Config"].get("Tty"):
+            # Raw stream
+            splitter = LineSplitter()
+            async for chunk in response.content.iter_any():
+                output.write_lines(prefix, splitter.feed(chunk))
+            output.write_lines(prefix, splitter.feed(b"", final=True))
+            return
+
+        # Multiplexed stream: frames with an 8 byte header (stream, 0, 0, 0,
+        # big endian payload size), one line splitter per stream
+        splitters = {}
+        while True:
+            try:
+                header = await response.content.readexactly(8)
+            except asyncio.IncompleteReadError:
+                break
+            (size,) = struct.unpack(">I", header[4:])
+            payload = await response.content.readexactly(size)
+            splitter = splitters.setdefault(header[0], LineSplitter())
+            output.write_lines(prefix, splitter.feed(payload))
+
+        for splitter in splitters.values():
+            output.write_lines(prefix, splitter.feed(b"", final=True))
+
+
+async def follow_containers(targets, follow=True, tail="all"):
+    """
+    Follows (container_id, host) targets, with one aiohttp session per
+    Docker host, or its docker-py client where aiohttp can't connect.
+    """
+    import aiohttp
+    from .containers import get_docker_client
+    from .hosts import get_host_url
+
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    output = Output()
+    connections = {}
+    try:
+        for _, host in targets:
+            if host in connections:
+                continue
+            connection = docker_connection(
+                get_host_url(host) if host is not None else None
+            )
+            if connection is None:
+                client = get_docker_client(host)
+                if client is None:
+                    raise Exception(f"Unable to connect to Docker on {host}.")
+                connections[host] = (None, client)
+            else:
+                connector, base_url = connection
+                session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+                connections[host] = (session, base_url)
+
+        def inspect(container_id, host):
+            session, target = connections[host]
+            if session is None:
+                return in_thread(lambda: target.api.inspect_container(container_id))
+            return inspect_container(session, target, container_id)
+
+        def follow_one(host, info, prefix):
+            session, target = connections[host]
+            if session is None:
+                return follow_container_client(
+                    target, info, prefix, output, follow, tail
+                )
+            return follow_container(session, target, info, prefix, output, follow, tail)
+
+        infos = await asyncio.gather(*(inspect(*target) for target in targets))
+        prefixes = make_prefixes(infos) if len(infos) > 1 else [""]
+
+        flusher = asyncio.create_task(output.run())
+        try:
+            results = await asyncio.gather(
+                *(
+                    follow_one(host, info, prefix)
+                    for (_, host), info, prefix in zip(targets, infos, prefixes)
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            flusher.cancel()
+            output.flush()
+    finally:
+        for session, _ in connections.values():
+            if session is not None:
+                await session.close()
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        click.echo(f"Error following logs: {error}", err=True)
+    return not errors
+
+
+def follow_logs(targets, follow=True, tail="all"):
+    """
+    Prints the logs of the given (container_id, host) targets, following them
+    until they all stop when follow is set. Returns False if any of them
+    failed.
+    """
+    return asyncio.run(follow_containers(list(targets), follow, tail))
+
+
+def parse_timestamp_ns(timestamp):
+    """
+    Converts a Docker RFC 3339 log timestamp ("2024-05-01T10:00:00.123456789Z")
+    to integer nanoseconds since the epoch.
+    """
+    from datetime import datetime, timezone
+
+    seconds, _, fraction = timestamp.rstrip("Z").partition(".")
+    moment = datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S")
+    whole = int(moment.replace(tzinfo=timezone.utc).timestamp())
+    return whole * 1_000_000_000 + int(fraction.ljust(9, "0")[:9] or 0)
+
+
+def iter_new_log_lines(container_id, since_ns=None, client=None):
+    """
+    Yields (timestamp_ns, line) for the container's log lines written after
+    since_ns, fetching only those from Docker rather than the whole history.
+    """
+    from .containers import get_docker_client
+
+    client = client or get_docker_client()
+    since = None
+    if since_ns is not None:
+        # Docker's `since` is inclusive and in (fractional) seconds, the exact
+        # cut is made on the line timestamps below
+        since = max(since_ns / 1e9 - 1e-6, 1e-6)
+
+    stream = client.api.logs(
+        container_id, stream=True, follow=False, timestamps=True, since=since
+    )
+    splitter = LineSplitter()
+    try:
+        for chunk in stream:
+            for line in splitter.feed(chunk):
+                entry = parse_log_line(line, since_ns)
+                if entry is not None:
+                    yield entry
+        for line in splitter.feed(b"", final=True):
+            entry = parse_log_line(line, since_ns)
+            if entry is not None:
+                yield entry
+    finally:
+        stream.close()
+
+
+def parse_log_line(line, since_ns):
+    timestamp, _, text = line.rstrip("\r").partition(" ")
+    try:
+        timestamp_ns = parse_timestamp_ns(timestamp)
+    except ValueError:
+        return None
+    if since_ns is not None and timestamp_ns <= since_ns:
+        return None
+    return timestamp_ns, text
@@ -11,6 +11,8 @@ class RemoteContainer:
         author: str = "none",
         category: str = "none",
         processor: str = "none",
+        image_name: str = None,
+        host: str = None,
     ):
         self.id = id
         self.pid = pid
@@ -23,10 +25,25 @@ class RemoteContainer:
         self.author = author
         self.category = category
         self.processor = processor
+        self.image_name = image_name
+        self.host = host
 
     def __repr__(self):
         return f"RemoteContainer(id={self.id}, pid={self.pid}, container_id={self.container_id}, remote_name='{self.remote_name}, remote_description={self.remote_description}, associated_token='{self.associated_token}', status='{self.status}')"
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "pid": self.pid,
+            "container_id": self.container_id,
+            "remote_name": self.remote_name,
+            "remote_description": self.remote_description,
+            "associated_token": self.associated_token,
+            "status": self.status,
+            "image_name": self.image_name,
+            "host": self.host,
+        }
+
 
 class RemoteImage:
     def __init__(
@@ -49,6 +66,18 @@ class RemoteImage:
         self.category = category
         self.processor = processor
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "remote_name": self.remote_name,
+            "remote_description": self.remote_description,
+            "image_name": self.image_name,
+            "remote_version": self.remote_version,
+            "author": self.author,
+            "category": self.category,
+            "processor": self.processor,
+        }
+
 
 class RemoteSource:
     def __init__(
@@ -64,3 +93,40 @@ class RemoteSource:
         self.remote_description = remote_description
         self.source_url = source_url
         self.remote_version = remote_version
+
+
+class ResourceSpec:
+    """
+    Resource limits of one rune container. With pin, the rune gets a
+    dedicated slice of `cpus` whole cores instead of a CPU quota.
+    """
+
+    def __init__(
+        self,
+        cpus: float = None,
+        memory: str = None,
+        pids: int = None,
+        pin: bool = True,
+    ):
+        self.cpus = cpus
+        self.memory = memory
+        self.pids = pids
+        self.pin = pin
+
+    def __repr__(self):
+        return f"ResourceSpec(cpus={self.cpus}, memory={self.memory}, pids={self.pids}, pin={self.pin})"
+
+    @property
+    def cores(self):
+        """Whole cores of a pinned slice, or None if the rune isn't pinned."""
+        if not self.pin or not self.cpus:
+            return None
+        return max(int(-(-self.cpus // 1)), 1)
+
+    def to_dict(self):
+        return {
+            "cpus": self.cpus,
+            "memory": self.memory,
+            "pids": self.pids,
+            "pin": self.pin,
+        }
@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import shlex
+
+# Rune notebooks install their dependencies in their own cells
+# ("!pip install ...", "!apt-get install -y ..."), which the runtime would
+# otherwise run again on every container start. At build time those lines
+# are taken out of the notebook and installed as image layers instead. A
+# line is only moved when it is a plain, top-level install command: anything
+# indented (conditional installs), using Python variables ({...}, $...),
+# shell chaining or continuation lines stays in the notebook and runs as
+# before.
+#
+# For the headless runtime the notebook is also converted to a script at
+# build time, so a rune runs it with plain `ipython` rather than executing
+# the notebook through nbconvert and then serving Jupyter.
+
+PIP_INSTALL = re.compile(r"^[!%](?:python3? -m )?pip3? install\s+(?P<args>.+)$")
+APT_INSTALL = re.compile(r"^!(?:sudo )?apt(?:-get)? install\s+(?P<args>.+)$")
+APT_UPDATE = re.compile(r"^!(?:sudo )?apt(?:-get)? update(?:\s+-\w+)*$")
+
+# pip options whose argument is a local file or directory
+PIP_FILE_OPTIONS = ["-r", "--requirement", "-c", "--constraint", "-e", "--editable"]
+
+# IPython expands these even inside quotes
+EXPANSION_CHARS = set("{}$`\\")
+
+# Replaces a moved line in the notebook, keeping the cell's line numbers
+BAKED_PREFIX = "# Installed at build time: "
+
+
+def read_notebook(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_notebook(notebook, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(notebook, f, indent=1, ensure_ascii=False)
+        f.write("\n")
+
+
+def cell_lines(cell):
+    source = cell.get("source", "")
+    if isinstance(source, list):
+        source = "".join(source)
+    return source.splitlines(keepends=True)
+
+
+def is_simple_command(line):
+    """
+    True unless the line expands variables or chains, pipes or redirects
+    (outside of quotes, so "numpy<2" is fine).
+    """
+    if EXPANSION_CHARS & set(line):
+        return False
+    lexer = shlex.shlex(line, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return False
+    return not any(
+        token and set(token) <= set(lexer.punctuation_chars) for token in tokens
+    )
+
+
+def uses_local_files(pip_args):
+    """
+    True if a pip install reads files of the notebook's working directory:
+    requirements / constraints files, editable installs or local paths, none
+    of which exist in the image at build time.
+    """
+    for arg in shlex.split(pip_args):
+        for option in PIP_FILE_OPTIONS:
+            if arg == option or arg.startswith(option + "="):
+                return True
+            if not option.startswith("--") and arg.startswith(option):
+                return True  # -rrequirements.txt
+        if "://" in arg:
+            continue
+        if arg.startswith((".", "/", "~")) or "/" in arg or os.sep in arg:
+            return True
+    return False
+
+
+def parse_install_line(line):
+    """
+    Returns ("pip", args) or ("apt", packages) for an install line that can
+    run at build time, ("apt-update", None) for an apt update, else None.
+    """
+    line = line.strip()
+    if not is_simple_command(line):
+        return None
+
+    match = PIP_INSTALL.match(line)
+    if match:
+        args = match.group("args").strip()
+        return None if uses_local_files(args) else ("pip", args)
+
+    match = APT_INSTALL.match(line)
+    if match:
+        packages = [
+            arg for arg in shlex.split(match.group("args")) if not arg.startswith("-")
+        ]
+        return ("apt", packages) if packages else None
+
+    if APT_UPDATE.match(line):
+        return "apt-update", None
+    return None
+
+
+def extract_install_commands(path):
+    """
+    Moves the install lines out of the code cells of the notebook at path,
+    rewriting it in place. Returns the apt packages and pip install argument
+    strings found, in notebook order and without duplicates.
+    """
+    notebook = read_notebook(path)
+    apt_packages, pip_installs = [], []
+    changed = False
+    for cell in notebook.get("cells", []):
+        if cell.get("cell_type") != "code":
+            continue
+
+        lines = cell_lines(cell)
+        for i, line in enumerate(lines):
+            if line[:1].isspace():
+                # Inside a block, e.g. an install in `except ImportError:`
+                continue
+            parsed = parse_install_line(line)
+            if parsed is None:
+                continue
+            kind, args = parsed
+            if kind == "pip":
+                pip_installs.append(args)
+            elif kind == "apt":
+                apt_packages += args
+            ending = "\n" if line.endswith("\n") else ""
+            lines[i] = f"{BAKED_PREFIX}{line.strip()}{ending}"
+            changed = True
+        cell["source"] = lines
+
+    if changed:
+        write_notebook(notebook, path)
+    return list(dict.fromkeys(apt_packages)), list(dict.fromkeys(pip_installs))
+
+
+def notebook_to_script(path, script_path):
+    """
+    Writes the code cells of the notebook at path as an IPython script
+    (.ipy), which `ipython` runs directly: shell (!) and magic (%) lines keep
+    working, without a kernel or a notebook server.
+    """
+    notebook = read_notebook(path)
+    with open(script_path, "w", encoding="utf-8") as f:
+        for number, cell in enumerate(notebook.get("cells", []), start=1):
+            if cell.get("cell_type") != "code":
+                continue
+            source = "".join(cell_lines(cell)).rstrip()
+            if source:
+                f.write(f"# In[{number}]:\n{source}\n\n")
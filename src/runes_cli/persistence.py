@@ -1,4 +1,6 @@
 import sqlite3
+import threading
+import time
 import uuid
 import click
 import os
@@ -13,63 +15,212 @@ appauthor = "Steve Hiehn"
 # Determine platform-specific user data directory
 data_dir = user_data_dir(appname, appauthor)
 
-# Ensure the directory exists
-os.makedirs(data_dir, exist_ok=True)
-
 # Path to the SQLite database within the data directory
 db_path = os.path.join(data_dir, "runes_cli.db")
 
-# print("db_path: ", db_path)
-# exit(0)
-
-# Connect to the SQLite database
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-# CONTAINER STATUS ###############################
-
-# Create table for storing container PIDs
-# Update the container_pids table schema
-cursor.execute(
+# Schema migrations, applied in order. The index of a migration + 1 is the
+# `PRAGMA user_version` the database is at once it has been applied.
+MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS container_pids
+        (id INTEGER PRIMARY KEY,
+         pid INTEGER,
+         container_id TEXT,
+         remote_name TEXT,
+         remote_description TEXT,
+         associated_token TEXT,
+         status INTEGER)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS docker_hub_credentials
+        (id INTEGER PRIMARY KEY, username TEXT, encrypted_password TEXT)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS access_tokens (
+        id INTEGER PRIMARY KEY,
+        token TEXT,
+        saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS uuid_token
+        (id INTEGER PRIMARY KEY, token TEXT)
+        """,
+    ],
+    [
+        "ALTER TABLE container_pids ADD COLUMN image_name TEXT",
+        "CREATE INDEX container_pids_status ON container_pids (status)",
+        "CREATE INDEX container_pids_container_id ON container_pids (container_id)",
+    ],
+    [
+        """
+        CREATE TABLE log_cursors
+        (container_id TEXT,
+         consumer TEXT,
+         since_ns INTEGER,
+         PRIMARY KEY (container_id, consumer))
+        """,
+    ],
+    [
+        """
+        CREATE TABLE log_entries
+        (id INTEGER PRIMARY KEY,
+         container_row_id INTEGER NOT NULL,
+         ts_ns INTEGER NOT NULL,
+         line TEXT NOT NULL)
+        """,
+        "CREATE INDEX log_entries_ts ON log_entries (ts_ns)",
+        "CREATE INDEX log_entries_container ON log_entries (container_row_id, ts_ns)",
+        # External content full-text index over log_entries.line, kept in
+        # sync by the triggers below
+        """
+        CREATE VIRTUAL TABLE log_entries_fts USING fts5
+        (line, content='log_entries', content_rowid='id')
+        """,
+        """
+        CREATE TRIGGER log_entries_ai AFTER INSERT ON log_entries BEGIN
+          INSERT INTO log_entries_fts (rowid, line) VALUES (new.id, new.line);
+        END
+        """,
+        """
+        CREATE TRIGGER log_entries_ad AFTER DELETE ON log_entries BEGIN
+          INSERT INTO log_entries_fts (log_entries_fts, rowid, line)
+          VALUES ('delete', old.id, old.line);
+        END
+        """,
+    ],
+    [
+        """
+        CREATE TABLE container_stats
+        (container_id TEXT,
+         sampled_at REAL,
+         cpu_percent REAL,
+         memory INTEGER,
+         memory_limit INTEGER,
+         net_rx INTEGER,
+         net_tx INTEGER,
+         block_read INTEGER,
+         block_write INTEGER)
+        """,
+        "CREATE INDEX container_stats_container ON container_stats (container_id, sampled_at)",
+    ],
+    [
+        """
+        CREATE TABLE pool_targets
+        (image_name TEXT PRIMARY KEY,
+         remote_name TEXT,
+         remote_description TEXT,
+         gpu INTEGER,
+         mode TEXT,
+         size INTEGER,
+         hits INTEGER DEFAULT 0,
+         misses INTEGER DEFAULT 0,
+         handoff_ms REAL DEFAULT 0)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE rune_starts
+        (id INTEGER PRIMARY KEY,
+         image_name TEXT,
+         container_id TEXT,
+         requested_at REAL,
+         ready_ms REAL,
+         ready_method TEXT,
+         pooled INTEGER)
+        """,
+        "CREATE INDEX rune_starts_image ON rune_starts (image_name, requested_at)",
+    ],
+    [
+        # Docker host a rune runs on, NULL for the local one
+        "ALTER TABLE container_pids ADD COLUMN host TEXT",
+        """
+        CREATE TABLE docker_hosts
+        (name TEXT PRIMARY KEY, url TEXT)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE build_cache
+        (build_hash TEXT PRIMARY KEY,
+         image_id TEXT,
+         image_name TEXT,
+         built_at REAL)
+        """,
+    ],
+    [
+        # Cores allocated to runes whose containers don't exist yet
+        """
+        CREATE TABLE cpuset_reservations
+        (id INTEGER PRIMARY KEY,
+         host TEXT,
+         cpuset TEXT,
+         reserved_at REAL)
+        """,
+    ],
+]
+
+# container_pids.status values
+STATUS_STOPPED = 0
+STATUS_RUNNING = 1
+STATUS_STARTING = 2  # row reserved, the container is being created
+STATUS_POOLED = 3  # created (or started and paused) ahead of time, not handed out
+
+CONTAINER_COLUMNS = "id, pid, container_id, remote_name, remote_description, associated_token, status, image_name, host"
+
+# One connection per thread (the runesd agent writes from background threads),
+# the schema is migrated by whichever thread connects first
+_local = threading.local()
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def migrate(conn):
     """
-CREATE TABLE IF NOT EXISTS container_pids
-(id INTEGER PRIMARY KEY,
- pid INTEGER,
- container_id TEXT,
- remote_name TEXT,
- remote_description TEXT,
- associated_token TEXT,
- status INTEGER)
-"""
-)
-conn.commit()
-
-# Create table for storing Docker Hub credentials
-cursor.execute(
+    Brings the schema up to date. Pending migrations are applied in a single
+    write transaction, so an up to date database costs one pragma read.
     """
-CREATE TABLE IF NOT EXISTS docker_hub_credentials
-(id INTEGER PRIMARY KEY, username TEXT, encrypted_password TEXT)
-"""
-)
-conn.commit()
-
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
 
-# Create table for storing access tokens
-cursor.execute(
+    # Take the write lock before re-reading the version, so two processes
+    # starting at once don't both apply the same migrations
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for statements in MIGRATIONS[version:]:
+            for statement in statements:
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def get_connection():
     """
-    CREATE TABLE IF NOT EXISTS access_tokens (
-    id INTEGER PRIMARY KEY,
-    token TEXT,
-    saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
+    Returns this thread's SQLite connection, opening it on first use and
+    migrating the schema once per process.
     """
-)
-conn.commit()
-
-from cryptography.fernet import Fernet
+    global _migrated
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(data_dir, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30)
+        with _migrate_lock:
+            if not _migrated:
+                migrate(conn)
+                _migrated = True
+        _local.conn = conn
+    return conn
 
 
 def get_fernet_key():
+    from cryptography.fernet import Fernet
+
     key_file = os.path.join(data_dir, "fernet.key")
     if os.path.exists(key_file):
         with open(key_file, "rb") as file:
@@ -81,14 +232,24 @@ def get_fernet_key():
     return key
 
 
-# Generate or load the Fernet key
-key = get_fernet_key()
-cipher_suite = Fernet(key)
+_cipher_suite = None
+
+
+def get_cipher_suite():
+    # cryptography is only imported once credentials are actually used
+    global _cipher_suite
+    if _cipher_suite is None:
+        from cryptography.fernet import Fernet
+
+        _cipher_suite = Fernet(get_fernet_key())
+    return _cipher_suite
 
 
 def save_docker_credentials(username, password):
+    conn = get_connection()
+    cursor = conn.cursor()
     # Ideally, encrypt the password here
-    encrypted_password = cipher_suite.encrypt(password.encode())
+    encrypted_password = get_cipher_suite().encrypt(password.encode())
     # Clear the existing credentials before saving the new ones
     cursor.execute("DELETE FROM docker_hub_credentials")
     cursor.execute(
@@ -99,6 +260,8 @@ def save_docker_credentials(username, password):
 
 
 def get_docker_credentials():
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute(
         "SELECT username, encrypted_password FROM docker_hub_credentials LIMIT 1"
     )
@@ -106,7 +269,7 @@ def get_docker_credentials():
     if row:
         username, encrypted_password = row
         # Decrypt the password here
-        password = cipher_suite.decrypt(encrypted_password).decode()
+        password = get_cipher_suite().decrypt(encrypted_password).decode()
         return username, password
     return None, None
 
@@ -115,6 +278,8 @@ def get_docker_credentials():
 def save_container_state(
     pid, container_id, remote_name, remote_description, associated_token, status
 ):
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO container_pids (pid, container_id, remote_name, remote_description, associated_token, status) VALUES (?, ?, ?, ?, ?, ?)",
         (pid, container_id, remote_name, remote_description, associated_token, status),
@@ -123,40 +288,603 @@ def save_container_state(
     # print(f"associated_token: {associated_token}")
 
 
-# New update_status function
-def update_container_state(container_id, status):
+def reserve_container_state(
+    remote_name, remote_description, associated_token, image_name, host=None
+):
+    """
+    Inserts a row for a container that is about to be created and returns its
+    id, so the id can be stamped on the container as a label.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute(
-        "UPDATE container_pids SET status = ? WHERE container_id = ?",
-        (status, container_id),
+        "INSERT INTO container_pids (pid, container_id, remote_name, remote_description, associated_token, status, image_name, host) VALUES (0, NULL, ?, ?, ?, ?, ?, ?)",
+        (
+            remote_name,
+            remote_description,
+            associated_token,
+            STATUS_STARTING,
+            image_name,
+            host,
+        ),
     )
     conn.commit()
+    return cursor.lastrowid
 
 
-def get_container_states(status=None):
-    if status is None:
+def reserve_container_states(rows, status=STATUS_STARTING, host=None):
+    """
+    Reserves rows for many containers in one transaction. Each row is a
+    (remote_name, remote_description, associated_token, image_name) tuple.
+    Returns the row ids, in order.
+    """
+    conn = get_connection()
+    row_ids = []
+    with conn:
+        for remote_name, remote_description, associated_token, image_name in rows:
+            cursor = conn.execute(
+                "INSERT INTO container_pids (pid, container_id, remote_name, remote_description, associated_token, status, image_name, host) VALUES (0, NULL, ?, ?, ?, ?, ?, ?)",
+                (
+                    remote_name,
+                    remote_description,
+                    associated_token,
+                    status,
+                    image_name,
+                    host,
+                ),
+            )
+            row_ids.append(cursor.lastrowid)
+    return row_ids
+
+
+def finish_container_starts(started, failed, status=STATUS_RUNNING):
+    """
+    Records a batch of container starts in one transaction: `started` holds
+    (row_id, pid, container_id) tuples, the reserved rows in `failed` are
+    deleted.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "UPDATE container_pids SET pid = ?, container_id = ?, status = ? WHERE id = ?",
+            [
+                (pid, container_id, status, row_id)
+                for row_id, pid, container_id in started
+            ],
+        )
+        conn.executemany(
+            "DELETE FROM container_pids WHERE id = ?",
+            [(row_id,) for row_id in failed],
+        )
+
+
+def record_container_started(row_id, pid, container_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE container_pids SET pid = ?, container_id = ?, status = ? WHERE id = ?",
+        (pid, container_id, STATUS_RUNNING, row_id),
+    )
+    conn.commit()
+
+
+def delete_container_state(row_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM container_pids WHERE id = ?", (row_id,))
+    conn.commit()
+
+
+def delete_container_states(row_ids):
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "DELETE FROM container_pids WHERE id = ?", [(row_id,) for row_id in row_ids]
+        )
+
+
+def claim_pooled_containers(
+    image_name, remote_name, remote_description, associated_token, count
+):
+    """
+    Takes up to `count` pooled containers matching a start request out of the
+    pool, moving their rows to STATUS_STARTING so no other process can take
+    them. Returns the claimed rows.
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            f"""
+            SELECT {CONTAINER_COLUMNS} FROM container_pids
+            WHERE status = ? AND container_id IS NOT NULL AND image_name = ?
+              AND remote_name = ? AND remote_description = ? AND associated_token = ?
+            ORDER BY id LIMIT ?
+            """,
+            (
+                STATUS_POOLED,
+                image_name,
+                remote_name,
+                remote_description,
+                associated_token,
+                count,
+            ),
+        )
+        claimed = []
+        for container in [container_from_row(row) for row in cursor.fetchall()]:
+            cursor = conn.execute(
+                "UPDATE container_pids SET status = ? WHERE id = ? AND status = ?",
+                (STATUS_STARTING, container.id, STATUS_POOLED),
+            )
+            if cursor.rowcount:
+                container.status = STATUS_STARTING
+                claimed.append(container)
+    return claimed
+
+
+# New update_status function
+def update_container_state(container_id, status, pid=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    if pid is None:
+        cursor.execute(
+            "UPDATE container_pids SET status = ? WHERE container_id = ?",
+            (status, container_id),
+        )
+    else:
         cursor.execute(
-            "SELECT id, pid, container_id, remote_name, remote_description, associated_token, status FROM container_pids"
+            "UPDATE container_pids SET status = ?, pid = ? WHERE container_id = ?",
+            (status, pid, container_id),
         )
+    conn.commit()
+    return cursor.rowcount
+
+
+def update_container_states(container_ids, status):
+    """
+    Sets the status of many containers in a single transaction.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "UPDATE container_pids SET status = ? WHERE container_id = ?",
+            [(status, container_id) for container_id in container_ids],
+        )
+
+
+def get_container_state(row_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {CONTAINER_COLUMNS} FROM container_pids WHERE id = ?", (row_id,)
+    )
+    row = cursor.fetchone()
+    return container_from_row(row) if row else None
+
+
+def find_container_state(container_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {CONTAINER_COLUMNS} FROM container_pids WHERE container_id = ?",
+        (container_id,),
+    )
+    row = cursor.fetchone()
+    return container_from_row(row) if row else None
+
+
+def get_log_cursor(container_id, consumer):
+    """
+    Returns the timestamp (ns since the epoch) of the last log line `consumer`
+    has read from the container, or None if it hasn't read any yet.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT since_ns FROM log_cursors WHERE container_id = ? AND consumer = ?",
+        (container_id, consumer),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_log_cursor(container_id, consumer, since_ns):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO log_cursors (container_id, consumer, since_ns) VALUES (?, ?, ?)",
+        (container_id, consumer, since_ns),
+    )
+    conn.commit()
+
+
+def add_log_entries(container_row_id, container_id, consumer, entries):
+    """
+    Stores (timestamp_ns, line) log entries of a container_pids row and
+    advances the consumer's log cursor past them, in one transaction.
+    """
+    if not entries:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO log_entries (container_row_id, ts_ns, line) VALUES (?, ?, ?)",
+            [(container_row_id, ts_ns, line) for ts_ns, line in entries],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO log_cursors (container_id, consumer, since_ns) VALUES (?, ?, ?)",
+            (container_id, consumer, entries[-1][0]),
+        )
+
+
+def prune_log_entries(before_ns, batch_size=5000):
+    """
+    Deletes the indexed log lines older than before_ns, batch_size lines per
+    transaction so writers aren't locked out for long. Returns how many.
+    """
+    conn = get_connection()
+    pruned = 0
+    while True:
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM log_entries WHERE id IN (SELECT id FROM log_entries WHERE ts_ns < ? LIMIT ?)",
+                (before_ns, batch_size),
+            )
+        pruned += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return pruned
+
+
+def search_log_entries(match, since_ns=None, until_ns=None, limit=100):
+    """
+    Yields (timestamp_ns, line, container) for the indexed log lines matching
+    an FTS5 query, newest first. container is None when its row is gone.
+    """
+    conn = get_connection()
+    clauses = ["log_entries_fts MATCH ?"]
+    params = [match]
+    if since_ns is not None:
+        clauses.append("e.ts_ns >= ?")
+        params.append(since_ns)
+    if until_ns is not None:
+        clauses.append("e.ts_ns < ?")
+        params.append(until_ns)
+    columns = ", ".join(f"c.{column}" for column in CONTAINER_COLUMNS.split(", "))
+    cursor = conn.execute(
+        f"""
+        SELECT e.ts_ns, e.line, {columns}
+        FROM log_entries_fts
+        JOIN log_entries e ON e.id = log_entries_fts.rowid
+        LEFT JOIN container_pids c ON c.id = e.container_row_id
+        WHERE {" AND ".join(clauses)}
+        ORDER BY e.ts_ns DESC
+        LIMIT ?
+        """,
+        params + [limit],
+    )
+    for ts_ns, line, *row in cursor:
+        yield ts_ns, line, container_from_row(row) if row[0] is not None else None
+
+
+def add_container_stats(samples):
+    """
+    Stores (container_id, sample) resource samples in one transaction.
+    """
+    if not samples:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO container_stats (container_id, sampled_at, cpu_percent, memory, memory_limit, net_rx, net_tx, block_read, block_write) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    container_id,
+                    sample["time"],
+                    sample["cpu_percent"],
+                    sample["memory"],
+                    sample["memory_limit"],
+                    sample["net_rx"],
+                    sample["net_tx"],
+                    sample["block_read"],
+                    sample["block_write"],
+                )
+                for container_id, sample in samples
+            ],
+        )
+
+
+def container_from_row(row):
+    *fields, image_name, host = row
+    return RemoteContainer(*fields, image_name=image_name, host=host)
+
+
+def iter_container_states(status=None):
+    """
+    Yields the stored containers one row at a time, optionally filtered by status.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if status is None:
+        cursor.execute(f"SELECT {CONTAINER_COLUMNS} FROM container_pids")
     else:
         cursor.execute(
-            "SELECT id, pid, container_id, remote_name, remote_description, associated_token, status FROM container_pids WHERE status = ?",
+            f"SELECT {CONTAINER_COLUMNS} FROM container_pids WHERE status = ?",
             (status,),
         )
 
-    rows = cursor.fetchall()
-    containers = [RemoteContainer(*row) for row in rows]
-    return containers
+    for row in cursor:
+        yield container_from_row(row)
 
 
-# CONNECTION TOKEN ###############################
+def get_container_states(status=None):
+    return list(iter_container_states(status))
+
 
-# Extend the database schema to include a table for the UUID token
-cursor.execute(
+def add_rune_start(
+    image_name, container_id, requested_at, ready_ms, ready_method, pooled
+):
     """
-CREATE TABLE IF NOT EXISTS uuid_token
-(id INTEGER PRIMARY KEY, token TEXT)"""
-)
-conn.commit()
+    Records a measured rune start. ready_ms is None if it never became ready.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO rune_starts (image_name, container_id, requested_at, ready_ms, ready_method, pooled) VALUES (?, ?, ?, ?, ?, ?)",
+        (image_name, container_id, requested_at, ready_ms, ready_method, int(pooled)),
+    )
+    conn.commit()
+
+
+def iter_rune_starts(image_name=None, since=None):
+    """
+    Yields (image_name, ready_ms, pooled) for the measured rune starts,
+    optionally of one image and requested after `since` (epoch seconds).
+    """
+    conn = get_connection()
+    clauses, params = [], []
+    if image_name is not None:
+        clauses.append("image_name = ?")
+        params.append(image_name)
+    if since is not None:
+        clauses.append("requested_at >= ?")
+        params.append(since)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cursor = conn.execute(
+        f"SELECT image_name, ready_ms, pooled FROM rune_starts {where}", params
+    )
+    for image_name, ready_ms, pooled in cursor:
+        yield image_name, ready_ms, bool(pooled)
+
+
+def get_recent_image_names(limit):
+    """
+    Returns the images of the `limit` most recently started runes.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT image_name FROM container_pids
+        WHERE image_name IS NOT NULL AND status != ?
+        GROUP BY image_name ORDER BY MAX(id) DESC LIMIT ?
+        """,
+        (STATUS_POOLED, limit),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+# DOCKER HOSTS ###################################
+
+
+def get_docker_hosts():
+    """
+    Returns the (name, url) of every host added to the inventory.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, url FROM docker_hosts ORDER BY rowid")
+    return cursor.fetchall()
+
+
+def save_docker_host(name, url):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO docker_hosts (name, url) VALUES (?, ?)", (name, url)
+    )
+    conn.commit()
+
+
+def delete_docker_host(name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM docker_hosts WHERE name = ?", (name,))
+    conn.commit()
+    return cursor.rowcount
+
+
+# BUILD CACHE ####################################
+
+
+def get_cached_build(build_hash):
+    """
+    Returns the (image_id, image_name) last built from a build hash, or None.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT image_id, image_name FROM build_cache WHERE build_hash = ?",
+        (build_hash,),
+    )
+    return cursor.fetchone()
+
+
+def save_cached_build(build_hash, image_id, image_name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO build_cache (build_hash, image_id, image_name, built_at) VALUES (?, ?, ?, ?)",
+        (build_hash, image_id, image_name, time.time()),
+    )
+    conn.commit()
+
+
+def delete_cached_build(build_hash):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM build_cache WHERE build_hash = ?", (build_hash,))
+    conn.commit()
+
+
+# CPUSET RESERVATIONS ############################
+
+
+def reserve_cpusets(host, allocate, ttl):
+    """
+    Allocates and records cpusets on a host in one write transaction, so
+    concurrent starts (in this process or another) allocate one at a time.
+    allocate(reserved) gets the cpusets still reserved by other starts and
+    returns the new ones (None entries are not recorded). Reservations older
+    than ttl seconds, left by starts that died, are dropped first. Returns
+    (reservation ids, cpusets).
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        conn.execute(
+            "DELETE FROM cpuset_reservations WHERE reserved_at < ?", (now - ttl,)
+        )
+        cursor = conn.execute(
+            "SELECT cpuset FROM cpuset_reservations WHERE host IS ?", (host,)
+        )
+        cpusets = allocate([row[0] for row in cursor.fetchall()])
+        reservation_ids = [
+            conn.execute(
+                "INSERT INTO cpuset_reservations (host, cpuset, reserved_at) VALUES (?, ?, ?)",
+                (host, cpuset, now),
+            ).lastrowid
+            for cpuset in cpusets
+            if cpuset is not None
+        ]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return reservation_ids, cpusets
+
+
+def release_cpusets(reservation_ids):
+    if not reservation_ids:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "DELETE FROM cpuset_reservations WHERE id = ?",
+            [(reservation_id,) for reservation_id in reservation_ids],
+        )
+
+
+# WARM POOL ######################################
+
+POOL_TARGET_COLUMNS = [
+    "image_name",
+    "remote_name",
+    "remote_description",
+    "gpu",
+    "mode",
+    "size",
+    "hits",
+    "misses",
+    "handoff_ms",
+]
+
+
+def set_pool_target(image_name, remote_name, remote_description, gpu, mode, size):
+    """
+    Creates or updates the warm pool target of an image, keeping its counters.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO pool_targets (image_name, remote_name, remote_description, gpu, mode, size)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (image_name) DO UPDATE SET
+          remote_name = excluded.remote_name,
+          remote_description = excluded.remote_description,
+          gpu = excluded.gpu,
+          mode = excluded.mode,
+          size = excluded.size
+        """,
+        (image_name, remote_name, remote_description, int(gpu), mode, size),
+    )
+    conn.commit()
+
+
+def delete_pool_target(image_name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pool_targets WHERE image_name = ?", (image_name,))
+    conn.commit()
+
+
+def get_pool_targets():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(POOL_TARGET_COLUMNS)} FROM pool_targets")
+    return [dict(zip(POOL_TARGET_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def get_pool_target(image_name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(POOL_TARGET_COLUMNS)} FROM pool_targets WHERE image_name = ?",
+        (image_name,),
+    )
+    row = cursor.fetchone()
+    return dict(zip(POOL_TARGET_COLUMNS, row)) if row else None
+
+
+def record_pool_usage(image_name, hits, misses, handoff_ms):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE pool_targets SET hits = hits + ?, misses = misses + ?, handoff_ms = handoff_ms + ? WHERE image_name = ?",
+        (hits, misses, handoff_ms, image_name),
+    )
+    conn.commit()
+
+
+def restore_container_states(containers):
+    """
+    Inserts rows rebuilt from container labels in one transaction. A container
+    keeps its labelled row id unless that id is already taken.
+    """
+    conn = get_connection()
+    taken = {row[0] for row in conn.execute("SELECT id FROM container_pids")}
+    with conn:
+        for container in containers:
+            row_id = container.id if container.id not in taken else None
+            cursor = conn.execute(
+                "INSERT INTO container_pids (id, pid, container_id, remote_name, remote_description, associated_token, status, image_name, host) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    row_id,
+                    container.pid,
+                    container.container_id,
+                    container.remote_name,
+                    container.remote_description,
+                    container.associated_token,
+                    container.status,
+                    container.image_name,
+                    container.host,
+                ),
+            )
+            container.id = cursor.lastrowid
+            taken.add(container.id)
+
+
+# CONNECTION TOKEN ###############################
 
 
 def generate_uuid():
@@ -164,6 +892,8 @@ def generate_uuid():
 
 
 def save_token_to_db(token):
+    conn = get_connection()
+    cursor = conn.cursor()
     # Clear the existing token before saving the new one
     cursor.execute("DELETE FROM uuid_token")
     # Insert the new token
@@ -172,6 +902,8 @@ def save_token_to_db(token):
 
 
 def read_token_from_db():
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute("SELECT token FROM uuid_token LIMIT 1")
     row = cursor.fetchone()
     return row[0] if row else None
@@ -201,6 +933,8 @@ def save_access_token(token):
     """
     Saves the given access token to the database, removing any existing ones first.
     """
+    conn = get_connection()
+    cursor = conn.cursor()
     # Clear any existing tokens before saving the new one
     cursor.execute("DELETE FROM access_tokens")
     # Insert the new access token
@@ -213,6 +947,8 @@ def get_access_token():
     Retrieves the current access token from the database.
     Returns None if no token is found.
     """
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute("SELECT token FROM access_tokens ORDER BY id DESC LIMIT 1")
     row = cursor.fetchone()
     return row[0] if row else None
@@ -222,5 +958,7 @@ def delete_access_tokens():
     """
     Deletes all access tokens from the database, effectively signing out the user.
     """
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute("DELETE FROM access_tokens")
     conn.commit()
@@ -0,0 +1,245 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from .config import DOCKER_WORKERS
+from .persistence import (
+    STATUS_POOLED,
+    claim_pooled_containers,
+    delete_container_states,
+    delete_pool_target,
+    finish_container_starts,
+    get_pool_target,
+    get_pool_targets,
+    iter_container_states,
+    read_token_from_db,
+    record_container_started,
+    record_pool_usage,
+    reserve_container_states,
+)
+
+# Warm pool: for images with a pool target, containers are created ahead of
+# time ("created" mode) or started and paused ("paused" mode) as
+# STATUS_POOLED rows. Starting such a rune then hands one out with a single
+# start / unpause call instead of create + start, and the pool is refilled
+# in the background by runesd (or `runes pool fill`). Labels and environment
+# are fixed at creation, so only a start with the same name, description and
+# token as the pooled container can take it.
+
+POOL_MODES = ["created", "paused"]
+
+# Seconds between refills of the pools by runesd
+REFILL_INTERVAL = 5.0
+
+
+def pooled_containers(image_name):
+    return [
+        container
+        for container in iter_container_states(status=STATUS_POOLED)
+        if container.image_name == image_name
+    ]
+
+
+def take_from_pool(
+    client, image_name, remote_name, remote_description, token, gpu, count=1
+):
+    """
+    Hands out up to `count` pooled containers of an image. Returns
+    (container, handoff_ms) for each, and records pool hits and misses.
+    """
+    import docker
+
+    target = get_pool_target(image_name)
+    if target is None or bool(target["gpu"]) != bool(gpu):
+        return []
+
+    handed_off = []
+    for container in claim_pooled_containers(
+        image_name, remote_name, remote_description, token, count
+    ):
+        started_at = time.monotonic()
+        try:
+            if target["mode"] == "paused":
+                client.api.unpause(container.container_id)
+            else:
+                client.api.start(container.container_id)
+        except docker.errors.APIError as e:
+            # Removed behind our back, or parked in the other mode
+            click.echo(f"Discarding pooled {container.container_id}: {e}", err=True)
+            discard_pooled(client, [container])
+            continue
+        handoff_ms = (time.monotonic() - started_at) * 1000
+
+        attrs = client.api.inspect_container(container.container_id)
+        record_container_started(
+            container.id, attrs["State"]["Pid"], container.container_id
+        )
+        handed_off.append((client.containers.prepare_model(attrs), handoff_ms))
+
+    record_pool_usage(
+        image_name,
+        len(handed_off),
+        count - len(handed_off),
+        sum(handoff_ms for _, handoff_ms in handed_off),
+    )
+    return handed_off
+
+
+def discard_pooled(client, containers):
+    """
+    Removes pooled containers and their rows.
+    """
+    for container in containers:
+        if container.container_id:
+            try:
+                client.api.remove_container(container.container_id, force=True)
+            except Exception:
+                pass  # Already gone
+    delete_container_states([container.id for container in containers])
+
+
+def fill_pool(target, client=None, max_workers=None):
+    """
+    Brings the pool of one target to its size: pooled containers that no
+    longer match the target (or the current token) are removed, missing ones
+    are created concurrently. Returns a summary of what changed.
+    """
+    from .containers import get_docker_client, prepare_start, run_rune_container
+
+    client = client or get_docker_client()
+    token = read_token_from_db()
+    image_name = target["image_name"]
+
+    pooled, stale = [], []
+    for container in pooled_containers(image_name):
+        if (
+            container.associated_token == token
+            and container.remote_name == target["remote_name"]
+            and container.remote_description == target["remote_description"]
+        ):
+            pooled.append(container)
+        else:
+            stale.append(container)
+    stale += pooled[target["size"] :]
+    pooled = pooled[: target["size"]]
+    discard_pooled(client, stale)
+
+    summary = {"image_name": image_name, "removed": len(stale), "created": 0}
+    missing = target["size"] - len(pooled)
+    if missing <= 0 or token is None:
+        return dict(summary, pooled=len(pooled))
+
+    prepared = prepare_start(bool(target["gpu"]))
+    if prepared is None:
+        return dict(summary, pooled=len(pooled), error="Unable to start")
+    client, device_requests = prepared
+
+    row_ids = reserve_container_states(
+        [
+            (target["remote_name"], target["remote_description"], token, image_name)
+            for _ in range(missing)
+        ],
+        status=STATUS_POOLED,
+    )
+
+    def create(row_id):
+        container = run_rune_container(
+            client,
+            row_id,
+            image_name,
+            target["remote_name"],
+            target["remote_description"],
+            token,
+            device_requests,
+            create_only=target["mode"] != "paused",
+        )
+        if target["mode"] == "paused":
+            container.pause()
+        return container
+
+    started, failed, errors = [], [], []
+    with ThreadPoolExecutor(
+        max_workers=min(missing, max_workers or DOCKER_WORKERS)
+    ) as pool:
+        futures = [pool.submit(create, row_id) for row_id in row_ids]
+        for row_id, future in zip(row_ids, futures):
+            try:
+                container = future.result()
+            except Exception as e:
+                failed.append(row_id)
+                errors.append(str(e))
+            else:
+                started.append((row_id, container.attrs["State"]["Pid"], container.id))
+
+    finish_container_starts(started, failed, status=STATUS_POOLED)
+    summary.update(created=len(started), pooled=len(pooled) + len(started))
+    if errors:
+        summary["error"] = errors[0]
+    return summary
+
+
+def fill_pools(client=None):
+    for target in get_pool_targets():
+        yield fill_pool(target, client)
+
+
+def drain_pool(image_name, client=None):
+    """
+    Removes the pool target of an image and every container in its pool.
+    """
+    from .containers import get_docker_client
+
+    client = client or get_docker_client()
+    containers = pooled_containers(image_name)
+    discard_pooled(client, containers)
+    delete_pool_target(image_name)
+    return {"image_name": image_name, "removed": len(containers)}
+
+
+def pool_report():
+    """
+    Yields every pool target with its current size, hit rate and mean
+    handoff latency.
+    """
+    pooled = {}
+    for container in iter_container_states(status=STATUS_POOLED):
+        pooled[container.image_name] = pooled.get(container.image_name, 0) + 1
+
+    for target in get_pool_targets():
+        requests = target["hits"] + target["misses"]
+        yield dict(
+            target,
+            gpu=bool(target["gpu"]),
+            pooled=pooled.get(target["image_name"], 0),
+            hit_rate=round(target["hits"] / requests, 3) if requests else None,
+            handoff_ms=(
+                round(target["handoff_ms"] / target["hits"], 1)
+                if target["hits"]
+                else None
+            ),
+        )
+
+
+class PoolRefiller(threading.Thread):
+    """
+    Keeps every warm pool at its target size, for runesd.
+    """
+
+    def __init__(self):
+        super().__init__(name="runes-pool-refiller", daemon=True)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                for summary in fill_pools():
+                    if summary["created"] or summary["removed"]:
+                        click.echo(f"Refilled warm pool: {summary}", err=True)
+            except Exception as e:
+                click.echo(f"Warm pool refill failed: {e}", err=True)
+            self.stopped.wait(REFILL_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
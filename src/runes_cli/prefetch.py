@@ -0,0 +1,170 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from .config import (
+    PREFETCH_CATEGORIES,
+    PREFETCH_INTERVAL,
+    PREFETCH_RECENT,
+    PULL_WORKERS,
+)
+from .persistence import get_recent_image_names
+
+# Pulls rune images ahead of time so starting a rune doesn't wait on the
+# registry. Images are pulled concurrently on a bounded pool, but the tags of
+# one repository are pulled one after another: they usually share most of
+# their layers, and the later pulls then find them present instead of
+# downloading the same layers in parallel.
+
+
+def normalize_image_name(image_name):
+    from docker.utils import parse_repository_tag
+
+    repository, tag = parse_repository_tag(image_name)
+    if tag and tag.startswith("sha256:"):
+        return repository, f"{repository}@{tag}"
+    return repository, f"{repository}:{tag or 'latest'}"
+
+
+def local_image_names(client):
+    """
+    The tags and digests of every local image, from a single API call.
+    """
+    names = set()
+    for image in client.api.images():
+        names.update(image.get("RepoTags") or [])
+        names.update(image.get("RepoDigests") or [])
+    return names
+
+
+def select_images(images=(), categories=(), recent=None, remote_images=None):
+    """
+    Resolves a prefetch policy to image names, in order and without
+    duplicates: explicit images, then every catalog rune in `categories`,
+    then the `recent` most recently run images.
+    """
+    selected = list(images)
+    if categories:
+        if remote_images is None:
+            from .api import get_remote_images
+
+            remote_images = get_remote_images()
+        selected += [
+            remote_image.image_name
+            for remote_image in remote_images
+            if remote_image.category in categories
+        ]
+    if recent:
+        selected += get_recent_image_names(recent)
+    return list(dict.fromkeys(selected))
+
+
+def pull_image(client, image_name):
+    """
+    Pulls one image, following the progress stream. Returns a summary with
+    the number of layers downloaded and already present.
+    """
+    started_at = time.monotonic()
+    downloaded, present = set(), set()
+    for event in client.api.pull(image_name, stream=True, decode=True):
+        if "error" in event:
+            raise Exception(event["error"])
+        status = event.get("status", "")
+        if status == "Pull complete":
+            downloaded.add(event.get("id"))
+        elif status == "Already exists":
+            present.add(event.get("id"))
+    return {
+        "image_name": image_name,
+        "pulled": True,
+        "layers_downloaded": len(downloaded),
+        "layers_present": len(present),
+        "pull_ms": round((time.monotonic() - started_at) * 1000, 1),
+    }
+
+
+def pull_repository(client, image_names):
+    results = []
+    for image_name in image_names:
+        try:
+            result = pull_image(client, image_name)
+        except Exception as e:
+            result = {"image_name": image_name, "pulled": False, "error": str(e)}
+        if result["pulled"]:
+            click.echo(f"Prefetched {image_name}", err=True)
+        else:
+            click.echo(f"Error prefetching {image_name}: {result['error']}", err=True)
+        results.append(result)
+    return results
+
+
+def prefetch_images(image_names, client=None, max_workers=None):
+    """
+    Pulls the images that aren't present locally, one repository per worker.
+    Yields a summary per image.
+    """
+    from .containers import get_docker_client
+
+    client = client or get_docker_client()
+    if client is None:
+        raise Exception("Unable to connect to Docker.")
+
+    present = local_image_names(client)
+    repositories = {}
+    for image_name in image_names:
+        repository, name = normalize_image_name(image_name)
+        if name in present:
+            yield {"image_name": name, "pulled": False, "present": True}
+        else:
+            repositories.setdefault(repository, []).append(name)
+
+    if not repositories:
+        return
+
+    workers = min(len(repositories), max_workers or PULL_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(pull_repository, client, names)
+            for names in repositories.values()
+        ]
+        for future in futures:
+            yield from future.result()
+
+
+def configured_images(remote_images=None):
+    """
+    The images selected by the configured prefetch policy
+    (DN_CLI_PREFETCH_CATEGORIES and DN_CLI_PREFETCH_RECENT).
+    """
+    return select_images(
+        categories=PREFETCH_CATEGORIES,
+        recent=PREFETCH_RECENT,
+        remote_images=remote_images,
+    )
+
+
+class Prefetcher(threading.Thread):
+    """
+    Applies the configured prefetch policy every PREFETCH_INTERVAL seconds,
+    for runesd.
+    """
+
+    def __init__(self, get_catalog):
+        super().__init__(name="runes-prefetcher", daemon=True)
+        self.get_catalog = get_catalog
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                remote_images = self.get_catalog() if PREFETCH_CATEGORIES else None
+                for _ in prefetch_images(configured_images(remote_images)):
+                    pass
+            except Exception as e:
+                click.echo(f"Prefetch failed: {e}", err=True)
+            self.stopped.wait(PREFETCH_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+
+import click
+
+from .config import READY_PATTERN, READY_TIMEOUT
+from .persistence import add_rune_start, iter_rune_starts
+
+# A rune is ready once it is serving, not when Docker reports its PID: the
+# startup script first executes the notebook, which then connects and
+# registers with the server. Readiness comes from the image's Docker
+# healthcheck when it has one, otherwise from a line in the container log
+# matching READY_PATTERN. Times to ready are kept per image to follow cold
+# start latency over time.
+
+# Seconds between healthcheck polls
+HEALTH_POLL_INTERVAL = 0.5
+
+
+def wait_for_health(client, container_id, deadline):
+    while time.monotonic() < deadline:
+        state = client.api.inspect_container(container_id)["State"]
+        if not state.get("Running"):
+            return None, "container exited"
+        status = state["Health"]["Status"]
+        if status == "healthy":
+            return time.time_ns(), None
+        if status == "unhealthy":
+            return None, "container is unhealthy"
+        time.sleep(HEALTH_POLL_INTERVAL)
+    return None, "timed out"
+
+
+def wait_for_log(client, container_id, pattern, deadline):
+    """
+    Scans the container log (from its start) for a line matching pattern.
+    Returns the line's timestamp, so the time the scan starts doesn't matter.
+    """
+    from .logs import LineSplitter, parse_log_line
+
+    regex = re.compile(pattern)
+    stream = client.api.logs(container_id, stream=True, follow=True, timestamps=True)
+    found = {}
+
+    def scan():
+        splitter = LineSplitter()
+        for chunk in stream:
+            for line in splitter.feed(chunk):
+                entry = parse_log_line(line, None)
+                if entry is not None and regex.search(entry[1]):
+                    found["ts_ns"] = entry[0]
+                    return
+
+    scanner = threading.Thread(target=scan, daemon=True)
+    scanner.start()
+    scanner.join(max(deadline - time.monotonic(), 0))
+    stream.close()
+
+    if "ts_ns" in found:
+        return found["ts_ns"], None
+    if scanner.is_alive():
+        return None, "timed out"
+    return None, "container exited"
+
+
+def wait_until_ready(
+    container_id, requested_ns, timeout=None, pattern=None, client=None
+):
+    """
+    Waits for a rune to be ready, at most timeout seconds. requested_ns is
+    when its start was requested (time.time_ns()). Returns a dict with ready,
+    ready_ms (time from the request to ready), the method used and any error.
+    """
+    from .containers import get_docker_client
+
+    client = client or get_docker_client()
+    deadline = time.monotonic() + (timeout or READY_TIMEOUT)
+
+    state = client.api.inspect_container(container_id)["State"]
+    if state.get("Health"):
+        method = "healthcheck"
+        ready_ns, error = wait_for_health(client, container_id, deadline)
+    else:
+        method = "log"
+        ready_ns, error = wait_for_log(
+            client, container_id, pattern or READY_PATTERN, deadline
+        )
+
+    result = {"ready": ready_ns is not None, "ready_method": method}
+    if ready_ns is None:
+        result["ready_error"] = error
+    else:
+        result["ready_ms"] = round(max(ready_ns - requested_ns, 0) / 1e6, 1)
+    return result
+
+
+def record_start(image_name, container_id, requested_ns, result, pooled=False):
+    add_rune_start(
+        image_name,
+        container_id,
+        requested_ns / 1e9,
+        result.get("ready_ms"),
+        result["ready_method"],
+        pooled,
+    )
+
+
+def start_latency_report(image_name=None, since_seconds=None):
+    """
+    Yields, per image, the number of measured starts, how many became ready
+    and the p50/p95/max time to ready.
+    """
+    from .stats import percentile
+
+    since = time.time() - since_seconds if since_seconds else None
+    images = {}
+    for name, ready_ms, pooled in iter_rune_starts(image_name, since):
+        images.setdefault(name, []).append((ready_ms, pooled))
+
+    for name, starts in sorted(images.items()):
+        times = [ready_ms for ready_ms, _ in starts if ready_ms is not None]
+        record = {
+            "image_name": name,
+            "starts": len(starts),
+            "ready": len(times),
+            "pooled": sum(1 for _, pooled in starts if pooled),
+        }
+        if times:
+            record.update(
+                p50_ms=percentile(times, 50),
+                p95_ms=percentile(times, 95),
+                max_ms=max(times),
+            )
+        yield record
+
+
+def bench_images(images, replicas=1, timeout=None, pattern=None, settle=5.0):
+    """
+    Cold start benchmark: starts `replicas` runes of each image in turn,
+    bypassing the warm pool, waits for them to be ready (or the timeout),
+    samples their memory `settle` seconds later and removes them. Yields, per
+    image, the time to ready and the memory in use, e.g. to compare the
+    notebook and headless runtimes of one notebook.
+    """
+    from .batch import run_runes, wait_for_replicas
+    from .containers import get_docker_client
+    from .stats import make_sample, percentile
+
+    for image_name in images:
+        requested_ns = time.time_ns()
+        results = list(run_runes([image_name], replicas=replicas, use_pool=False))
+        wait_for_replicas(image_name, results, requested_ns, timeout, pattern)
+        started = [result for result in results if result["started"]]
+
+        # Sampled whether or not the replicas became ready: a runtime that
+        # never signals readiness still has a footprint to compare
+        memory = []
+        if started:
+            time.sleep(settle)
+        for result in started:
+            client = get_docker_client(result.get("host"))
+            try:
+                stats = client.api.stats(result["container_id"], stream=False)
+            except Exception as e:
+                click.echo(f"No stats for {result['container_id']}: {e}", err=True)
+                continue
+            if stats.get("memory_stats"):  # Empty once the container exited
+                memory.append(make_sample(stats)["memory"])
+
+        remove_runes(started)
+
+        times = [result["ready_ms"] for result in started if result.get("ready")]
+        record = {
+            "image_name": image_name,
+            "replicas": replicas,
+            "started": len(started),
+            "ready": len(times),
+        }
+        if times:
+            record.update(p50_ms=percentile(times, 50), max_ms=max(times))
+        if memory:
+            record.update(
+                memory_mean=round(sum(memory) / len(memory)), memory_max=max(memory)
+            )
+        yield record
+
+
+def remove_runes(results):
+    """
+    Force-removes the containers of started rune results and their rows.
+    """
+    from .containers import get_docker_client
+    from .persistence import delete_container_states, find_container_state
+
+    import docker
+
+    row_ids = []
+    for result in results:
+        client = get_docker_client(result.get("host"))
+        try:
+            client.api.remove_container(result["container_id"], force=True)
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            # Keep its row, `runes stop` can still find the rune
+            click.echo(f"Error removing {result['container_id']}: {e}", err=True)
+            continue
+        container = find_container_state(result["container_id"])
+        if container is not None:
+            row_ids.append(container.id)
+    delete_container_states(row_ids)
@@ -0,0 +1,143 @@
+# CPU placement of co-located runes. A pinned rune gets a disjoint set of
+# cores (cpuset_cpus), chosen from the host's cores minus those already
+# pinned by existing runes (read back from their app.runes.cpuset label) and
+# those reserved by starts whose containers are still being created,
+# preferring a contiguous block so its threads share caches. The BLAS /
+# OpenMP thread pools inside the rune are sized to its slice, otherwise every
+# rune starts one thread per host core and they oversubscribe the box.
+
+# Thread pool variables set to the number of cores a rune may use
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+# Container states that hold on to their cores
+PINNED_STATES = ["created", "running", "restarting", "paused"]
+
+# Seconds after which the reservation of a start that never released it
+# (the process died) no longer blocks its cores
+RESERVATION_TTL = 600
+
+
+def parse_cpuset(cpuset):
+    """
+    "0-3,8" -> {0, 1, 2, 3, 8}
+    """
+    cores = set()
+    for part in (cpuset or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cores.update(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def format_cpuset(cores):
+    """
+    [0, 1, 2, 3, 8] -> "0-3,8"
+    """
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def pick_cores(count, free):
+    """
+    Picks `count` of the free cores: the first contiguous block that fits,
+    else the lowest numbered free cores. Returns None if too few are free.
+    """
+    free = sorted(free)
+    if len(free) < count:
+        return None
+
+    run = []
+    for core in free:
+        run = run + [core] if run and core == run[-1] + 1 else [core]
+        if len(run) == count:
+            return run
+    return free[:count]
+
+
+def used_cores(client):
+    from .containers import LABEL_CPUSET, list_rune_containers
+
+    used = set()
+    for summary in list_rune_containers(all=True, client=client):
+        if summary.get("State") in PINNED_STATES:
+            used |= parse_cpuset((summary.get("Labels") or {}).get(LABEL_CPUSET))
+    return used
+
+
+def allocate_cpusets(spec, count, client, host=None):
+    """
+    Allocates a disjoint core slice for each of `count` runes with the given
+    resource spec on a host. Returns (cpusets, reservation): a list of cpuset
+    strings (None when not pinned), and the reservation that keeps them from
+    other starts until persistence.release_cpusets(reservation), once
+    the containers have been created (or failed to be).
+    """
+    from .capabilities import get_host_capabilities
+    from .hosts import get_host_url
+    from .persistence import reserve_cpusets
+
+    if spec is None or spec.cores is None:
+        return [None] * count, []
+
+    docker_host = get_host_url(host) if host is not None else None
+    ncpu = get_host_capabilities(client, docker_host=docker_host)["ncpu"]
+
+    def allocate(reserved):
+        free = set(range(ncpu)) - used_cores(client)
+        for cpuset in reserved:
+            free -= parse_cpuset(cpuset)
+        cpusets = []
+        for _ in range(count):
+            cores = pick_cores(spec.cores, free)
+            if cores is None:
+                raise Exception(
+                    f"Not enough free cores to pin {count} rune(s) to {spec.cores} "
+                    f"core(s) each: {len(free)} of {ncpu} free."
+                )
+            free -= set(cores)
+            cpusets.append(format_cpuset(cores))
+        return cpusets
+
+    reservation, cpusets = reserve_cpusets(host, allocate, RESERVATION_TTL)
+    return cpusets, reservation
+
+
+def container_options(spec, cpuset):
+    """
+    docker-py run/create options and environment for a rune with the given
+    resource spec and core slice.
+    """
+    options, environment = {}, {}
+    if spec is None:
+        return options, environment
+
+    if cpuset is not None:
+        options["cpuset_cpus"] = cpuset
+        threads = len(parse_cpuset(cpuset))
+    elif spec.cpus:
+        options["nano_cpus"] = int(spec.cpus * 1e9)
+        threads = max(int(spec.cpus), 1)
+    else:
+        threads = None
+    if spec.memory:
+        options["mem_limit"] = spec.memory
+    if spec.pids:
+        options["pids_limit"] = spec.pids
+
+    if threads is not None:
+        environment = {name: str(threads) for name in THREAD_ENV_VARS}
+    return options, environment
@@ -0,0 +1,314 @@
+import json
+import threading
+import time
+from collections import deque
+
+from .config import DOCKER_POOL_SIZE, STATS_HISTORY
+from .containers import LABEL_NAME, get_docker_client, list_rune_containers
+
+# Resource usage of running runes. One thread per rune container reads its
+# Docker stats stream (one sample a second, CPU usage is computed from the
+# deltas the daemon includes in every sample) into a fixed-size ring buffer,
+# so a view refreshing every few seconds costs no API calls at all. Every
+# stream holds a connection of the client's pool, so past MAX_STREAMS runes
+# the others are polled in turn by a single thread instead, their CPU usage
+# computed from consecutive polls.
+
+# Seconds between looking for runes that started or stopped
+DISCOVER_INTERVAL = 5.0
+
+# Stats streams open at once, leaving connections for the other API calls
+MAX_STREAMS = max(DOCKER_POOL_SIZE - 4, 1)
+
+# Seconds between two polls of the runes without a stream
+POLL_INTERVAL = 1.0
+
+
+def cpu_percent(stats):
+    cpu = stats.get("cpu_stats") or {}
+    precpu = stats.get("precpu_stats") or {}
+    if not precpu.get("system_cpu_usage"):
+        # First frame of a stream: nothing to compare against yet
+        return 0.0
+    cpu_delta = (cpu.get("cpu_usage") or {}).get("total_usage", 0) - (
+        precpu.get("cpu_usage") or {}
+    ).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    online_cpus = cpu.get("online_cpus") or len(
+        (cpu.get("cpu_usage") or {}).get("percpu_usage") or [None]
+    )
+    return cpu_delta / system_delta * online_cpus * 100.0
+
+
+def memory_usage(stats):
+    memory = stats.get("memory_stats") or {}
+    details = memory.get("stats") or {}
+    # Page cache is reclaimable, leave it out like `docker stats` does
+    # (cgroup v1 reports it as "cache", v2 as "inactive_file")
+    cache = details.get("inactive_file", details.get("cache", 0))
+    return max(memory.get("usage", 0) - cache, 0), memory.get("limit", 0)
+
+
+def block_io(stats):
+    read = write = 0
+    entries = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive")
+    for entry in entries or []:
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return read, write
+
+
+def make_sample(stats):
+    """
+    Reduces one Docker stats record to the values the sampler keeps.
+    """
+    memory, memory_limit = memory_usage(stats)
+    networks = (stats.get("networks") or {}).values()
+    block_read, block_write = block_io(stats)
+    return {
+        "time": time.time(),
+        "cpu_percent": cpu_percent(stats),
+        "memory": memory,
+        "memory_limit": memory_limit,
+        "net_rx": sum(network.get("rx_bytes", 0) for network in networks),
+        "net_tx": sum(network.get("tx_bytes", 0) for network in networks),
+        "block_read": block_read,
+        "block_write": block_write,
+    }
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a non-empty list of values.
+    """
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class StatsSampler:
+    """
+    Keeps the last `history` samples of every running rune container, adding
+    and dropping containers as runes start and stop.
+    """
+
+    def __init__(self, history=STATS_HISTORY, persist=False):
+        self.history = history
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.samples = {}  # container id -> deque of samples
+        self.names = {}
+        self.threads = {}  # container id -> thread reading its stream
+        self.responses = {}  # container id -> its open stream
+        self.polled = []  # container ids without a stream
+        self.last_cpu = {}  # polled container id -> cpu_stats of its last poll
+        self.unsaved = []
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(
+            target=self.discover_forever, name="runes-stats", daemon=True
+        ).start()
+        threading.Thread(
+            target=self.poll_forever, name="runes-stats-poll", daemon=True
+        ).start()
+
+    def stop(self):
+        self.stopped.set()
+        # Ends the stream readers now rather than at their next sample
+        with self.lock:
+            responses = list(self.responses.values())
+        for response in responses:
+            response.close()
+
+    def discover_forever(self):
+        while not self.stopped.is_set():
+            try:
+                self.discover()
+            except Exception:
+                pass  # Docker unavailable for now, try again later
+            self.stopped.wait(DISCOVER_INTERVAL)
+
+    def discover(self):
+        client = get_docker_client()
+        if client is None:
+            return
+        running = {
+            summary["Id"]: (summary.get("Labels") or {}).get(LABEL_NAME)
+            for summary in list_rune_containers(client=client)
+        }
+
+        with self.lock:
+            # A stream ends when its container stops (or the stream fails, a
+            # still running container is then picked up again below)
+            for container_id, thread in list(self.threads.items()):
+                if not thread.is_alive():
+                    self.forget(container_id)
+            for container_id in list(self.polled):
+                if container_id not in running:
+                    self.forget(container_id)
+
+            for container_id, name in running.items():
+                if container_id in self.threads:
+                    continue
+                if container_id not in self.samples:
+                    self.names[container_id] = name
+                    self.samples[container_id] = deque(maxlen=self.history)
+                if len(self.threads) >= MAX_STREAMS:
+                    if container_id not in self.polled:
+                        self.polled.append(container_id)
+                    continue
+
+                # Polled runes get a stream once there is room for one
+                if container_id in self.polled:
+                    self.polled.remove(container_id)
+                    self.last_cpu.pop(container_id, None)
+                thread = threading.Thread(
+                    target=self.read_stream,
+                    args=(client, container_id),
+                    name=f"runes-stats-{container_id[:12]}",
+                    daemon=True,
+                )
+                self.threads[container_id] = thread
+                thread.start()
+
+    def forget(self, container_id):
+        self.threads.pop(container_id, None)
+        self.samples.pop(container_id, None)
+        self.names.pop(container_id, None)
+        self.last_cpu.pop(container_id, None)
+        if container_id in self.polled:
+            self.polled.remove(container_id)
+
+    def add_sample(self, container_id, stats):
+        sample = make_sample(stats)
+        with self.lock:
+            samples = self.samples.get(container_id)
+            if samples is None:
+                return  # Dropped in the meantime
+            samples.append(sample)
+            if self.persist:
+                self.unsaved.append((container_id, sample))
+
+    def read_stream(self, client, container_id):
+        # Requested directly rather than through api.stats(), whose generator
+        # doesn't expose the response that stop() has to close
+        url = f"{client.api.base_url}/v{client.api.api_version}/containers/{container_id}/stats"
+        response = None
+        try:
+            response = client.api.get(url, params={"stream": True}, stream=True)
+            with self.lock:
+                self.responses[container_id] = response
+            if self.stopped.is_set() or response.status_code != 200:
+                return
+            for line in response.iter_lines():
+                if self.stopped.is_set():
+                    return
+                if line:
+                    self.add_sample(container_id, json.loads(line))
+        except Exception:
+            pass  # The container is gone (or stop() closed the stream)
+        finally:
+            with self.lock:
+                self.responses.pop(container_id, None)
+            if response is not None:
+                response.close()
+
+    def poll_forever(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                polled = list(self.polled)
+            client = get_docker_client() if polled else None
+            for container_id in polled if client is not None else []:
+                if self.stopped.is_set():
+                    return
+                try:
+                    self.poll(client, container_id)
+                except Exception:
+                    pass  # The container is gone, discover() drops it
+            self.stopped.wait(POLL_INTERVAL)
+
+    def poll(self, client, container_id):
+        from docker.utils import version_lt
+
+        if version_lt(client.api.api_version, "1.41"):
+            # No one-shot stats: the daemon waits for a second sample
+            stats = client.api.stats(container_id, stream=False)
+        else:
+            stats = client.api.stats(container_id, stream=False, one_shot=True)
+            with self.lock:
+                previous = self.last_cpu.get(container_id)
+                self.last_cpu[container_id] = stats.get("cpu_stats")
+            # One-shot stats come without the previous CPU sample, this
+            # rune's last poll stands in for it
+            stats["precpu_stats"] = previous or {}
+        self.add_sample(container_id, stats)
+
+    def save(self):
+        """
+        Writes the samples taken since the last save to the database.
+        """
+        from .persistence import add_container_stats
+
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, []
+        add_container_stats(unsaved)
+
+    def snapshot(self, window=60):
+        """
+        Returns, per container, the latest sample plus the p50/p95 CPU and
+        memory over the last `window` seconds.
+        """
+        cutoff = time.time() - window
+        rows = []
+        with self.lock:
+            for container_id, samples in self.samples.items():
+                if not samples:
+                    continue
+                recent = [sample for sample in samples if sample["time"] >= cutoff]
+                recent = recent or [samples[-1]]
+                cpu = [sample["cpu_percent"] for sample in recent]
+                memory = [sample["memory"] for sample in recent]
+                rows.append(
+                    dict(
+                        samples[-1],
+                        container_id=container_id,
+                        name=self.names.get(container_id),
+                        cpu_p50=percentile(cpu, 50),
+                        cpu_p95=percentile(cpu, 95),
+                        memory_p50=percentile(memory, 50),
+                        memory_p95=percentile(memory, 95),
+                    )
+                )
+        return sorted(rows, key=lambda row: row["cpu_percent"], reverse=True)
+
+
+def format_bytes(value):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(value) < 1024:
+            return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+        value /= 1024.0
+    return f"{value:.1f}TiB"
+
+
+def format_table(rows, window):
+    header = (
+        f"{'CONTAINER':<12}  {'NAME':<20}  {'CPU%':>6}  {'p50':>6}  {'p95':>6}  "
+        f"{'MEM':>9}  {'p95':>9}  {'NET RX/TX':>19}  {'BLOCK R/W':>19}"
+    )
+    lines = [f"{len(rows)} runes, percentiles over {window}s", header]
+    for row in rows:
+        net = f"{format_bytes(row['net_rx'])}/{format_bytes(row['net_tx'])}"
+        block = f"{format_bytes(row['block_read'])}/{format_bytes(row['block_write'])}"
+        lines.append(
+            f"{row['container_id'][:12]:<12}  {(row['name'] or '')[:20]:<20}  "
+            f"{row['cpu_percent']:>6.1f}  {row['cpu_p50']:>6.1f}  {row['cpu_p95']:>6.1f}  "
+            f"{format_bytes(row['memory']):>9}  {format_bytes(row['memory_p95']):>9}  "
+            f"{net:>19}  {block:>19}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,149 @@
+import threading
+
+import click
+
+from .containers import (
+    LABEL_DB_ID,
+    LABEL_MANAGED,
+    container_from_labels,
+    get_docker_client,
+    reconcile_container_states,
+)
+from .persistence import (
+    STATUS_POOLED,
+    STATUS_RUNNING,
+    STATUS_STOPPED,
+    find_container_state,
+    get_container_state,
+    record_container_started,
+    restore_container_states,
+    update_container_state,
+)
+
+# container_pids.status each Docker container event moves a rune to
+EVENT_STATUS = {
+    "start": STATUS_RUNNING,
+    "die": STATUS_STOPPED,
+    "oom": STATUS_STOPPED,
+    "destroy": STATUS_STOPPED,
+}
+
+# Seconds to wait before re-subscribing after the events stream drops
+RETRY_INTERVAL = 5.0
+
+
+def apply_event(event, client=None):
+    """
+    Applies one Docker container event for a rune to container_pids.
+    Returns the status the rune was moved to, or None if the event was ignored.
+    """
+    action = event.get("Action") or event.get("status")
+    status = EVENT_STATUS.get(action)
+    if status is None:
+        return None
+
+    actor = event.get("Actor") or {}
+    container_id = actor.get("ID") or event.get("id")
+    attributes = actor.get("Attributes") or {}
+
+    if status != STATUS_RUNNING:
+        update_container_state(container_id, status)
+        return status
+
+    # Containers of the warm pool in "paused" mode are started while filling
+    # the pool, they only become running runes once handed out
+    known = find_container_state(container_id)
+    if known is not None and known.status == STATUS_POOLED:
+        return None
+
+    client = client or get_docker_client()
+    pid = client.api.inspect_container(container_id)["State"]["Pid"]
+    if update_container_state(container_id, status, pid=pid):
+        return status
+
+    # Not known by container id yet: either start_container has reserved the
+    # row and not recorded the id, or the rune was started elsewhere
+    db_id = attributes.get(LABEL_DB_ID, "")
+    reserved = get_container_state(int(db_id)) if db_id.isdigit() else None
+    if reserved is not None and reserved.status == STATUS_POOLED:
+        return None
+    if reserved is not None and not reserved.container_id:
+        record_container_started(reserved.id, pid, container_id)
+    else:
+        restore_container_states(
+            [
+                container_from_labels(
+                    container_id,
+                    attributes,
+                    attributes.get("image") or event.get("from"),
+                    pid,
+                    status,
+                )
+            ]
+        )
+    return status
+
+
+def index_stopped_rune(event, client):
+    """
+    Adds the last log lines of a rune that just exited to the search index,
+    while its container (and so its log) still exists.
+    """
+    from .logindex import index_container_logs
+
+    container_id = (event.get("Actor") or {}).get("ID") or event.get("id")
+    container = find_container_state(container_id)
+    if container is None:
+        return
+    try:
+        index_container_logs(container, client)
+    except Exception as e:
+        click.echo(f"Unable to index the logs of {container_id}: {e}", err=True)
+
+
+class EventWatcher(threading.Thread):
+    """
+    Follows the Docker events stream for rune containers and keeps
+    container_pids current as they start and stop, so listing running runes
+    needs no round trip to the daemon.
+    """
+
+    def __init__(self):
+        super().__init__(name="runes-event-watcher", daemon=True)
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+        self.events = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.follow()
+            except Exception as e:
+                if not self.stopped.is_set():
+                    click.echo(f"Docker events stream failed: {e}", err=True)
+            finally:
+                self.connected.clear()
+            self.stopped.wait(RETRY_INTERVAL)
+
+    def follow(self):
+        client = get_docker_client()
+        if client is None:
+            return
+
+        # Subscribe before reconciling so nothing between the two is missed
+        self.events = client.events(
+            decode=True,
+            filters={"type": "container", "label": LABEL_MANAGED},
+        )
+        reconcile_container_states(client)
+        self.connected.set()
+
+        for event in self.events:
+            apply_event(event, client)
+            if (event.get("Action") or event.get("status")) == "die":
+                index_stopped_rune(event, client)
+
+    def stop(self):
+        self.stopped.set()
+        if self.events is not None:
+            self.events.close()
@@ -0,0 +1,203 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The cli keeps its database and caches in the user data directory, which is
+# resolved on import: point it at a scratch directory before runes_cli loads
+os.environ["XDG_DATA_HOME"] = tempfile.mkdtemp(prefix="runes-tests-")
+os.environ.pop("DN_CLI_DOCKER_HOSTS", None)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+class FakeAPI:
+    """
+    The slice of docker-py's low level API the cli uses, for one daemon.
+    """
+
+    def __init__(self, name, ncpu):
+        self.name = name
+        self.ncpu = ncpu
+        self.running = {}  # container id -> log bytes
+        self.stderr = {}  # container id -> stderr log bytes
+        self.unlabelled = set()  # started before runes were labelled
+        self.stopped = []
+        self.cpu_usage = 0  # ns of CPU time, one full core per stats call
+        self.removed = []
+        self.killed = []
+        self.dockerfiles = []  # one per build
+        self.build_options = []
+        self.images_by_id = {}  # image id -> labels
+        self.tags = {}  # name -> image id
+        self.created = {}  # container id -> create options
+        self.paused = []
+        self.unpaused = []
+        self.broken_images = set()  # images whose containers fail to run
+
+    def containers(self, all=False, filters=None):
+        filters = filters or {}
+        return [
+            {"Id": container_id, "Image": "img", "Labels": {}, "State": "running"}
+            for container_id in self.running
+            if not ("label" in filters and container_id in self.unlabelled)
+            and ("id" not in filters or container_id in filters["id"])
+        ]
+
+    def inspect_container(self, container_id):
+        return {
+            "Id": container_id,
+            "Name": f"/{container_id}",
+            "Config": {"Labels": {}, "Tty": False},
+            "State": {"Running": container_id in self.running, "Pid": 4242},
+        }
+
+    def logs(self, container_id, stream=False, stdout=True, stderr=True, **kwargs):
+        chunks = []
+        if stdout:
+            chunks.append(self.running[container_id])
+        if stderr:
+            chunks.append(self.stderr.get(container_id, b""))
+        return iter(chunks)
+
+    def stats(self, container_id, stream=False, **kwargs):
+        self.cpu_usage += 10**9
+        return {
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": self.cpu_usage},
+                "system_cpu_usage": self.cpu_usage * self.ncpu,
+                "online_cpus": self.ncpu,
+            },
+            "memory_stats": {"usage": 900, "limit": 4096},
+        }
+
+    def remove_container(self, container_id, force=False):
+        self.running.pop(container_id, None)
+        self.removed.append(container_id)
+
+    def restart(self, container_id, timeout=None):
+        raise Exception(f"{self.name} can't restart {container_id}")
+
+    def kill(self, container_id):
+        self.running.pop(container_id, None)
+        self.killed.append(container_id)
+
+    def build(self, path=None, tag=None, labels=None, **kwargs):
+        with open(os.path.join(path, "Dockerfile")) as f:
+            self.dockerfiles.append(f.read())
+        self.build_options.append(kwargs)
+        image_id = f"sha256:{len(self.dockerfiles):064x}"
+        self.images_by_id[image_id] = dict(labels or {})
+        self.tags[tag] = image_id
+        yield {"stream": "Step 1/1"}
+        yield {"aux": {"ID": image_id}}
+
+    def inspect_image(self, image):
+        import docker
+
+        image_id = self.tags.get(image, image)
+        if image_id not in self.images_by_id:
+            raise docker.errors.ImageNotFound(f"No such image: {image}")
+        return {"Id": image_id, "Config": {"Labels": self.images_by_id[image_id]}}
+
+    def images(self, filters=None):
+        name, _, value = filters["label"].partition("=")
+        return [
+            {"Id": image_id}
+            for image_id, labels in self.images_by_id.items()
+            if labels.get(name) == value
+        ]
+
+    def tag(self, image, repository, tag=None, force=False):
+        self.tags[f"{repository}:{tag}"] = image
+
+    def start(self, container_id):
+        self.running[container_id] = b""
+
+    def unpause(self, container_id):
+        self.unpaused.append(container_id)
+
+    def stop(self, container_id, timeout=None):
+        import docker
+
+        if container_id not in self.running:
+            raise docker.errors.NotFound("No such container")
+        del self.running[container_id]
+        self.stopped.append(container_id)
+
+
+class FakeContainer:
+    def __init__(self, api, container_id):
+        self.api = api
+        self.id = container_id
+        self.attrs = api.inspect_container(container_id)
+
+    def reload(self):
+        self.attrs = self.api.inspect_container(self.id)
+
+    def pause(self):
+        self.api.paused.append(self.id)
+
+
+class FakeContainers:
+    """
+    docker-py's high level containers collection: runs and creates
+    containers on the fake daemon.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.ids = itertools.count(1)
+
+    def create(self, image, **kwargs):
+        container_id = f"{self.api.name}-{next(self.ids)}"
+        self.api.created[container_id] = dict(kwargs, image=image)
+        return FakeContainer(self.api, container_id)
+
+    def run(self, image, **kwargs):
+        if image in self.api.broken_images:
+            raise Exception(f"{image} failed to start")
+        container = self.create(image, **kwargs)
+        self.api.start(container.id)
+        return container
+
+    def prepare_model(self, attrs):
+        return FakeContainer(self.api, attrs["Id"])
+
+
+class FakeDockerClient:
+    def __init__(self, name, ncpu=4, reachable=True):
+        self.api = FakeAPI(name, ncpu)
+        self.containers = FakeContainers(self.api)
+        self.reachable = reachable
+        self.pings = 0
+        self.closed = False
+
+    def ping(self):
+        self.pings += 1
+        if not self.reachable:
+            raise Exception(f"{self.api.name} is down")
+
+    def close(self):
+        self.closed = True
+
+    def info(self):
+        return {"ID": self.api.name, "NCPU": self.api.ncpu}
+
+
+@pytest.fixture
+def docker_hosts(monkeypatch):
+    """
+    Stand-ins for several Docker daemons. Returns {host name: client}; add
+    entries before use, their urls are ssh:// so nothing is dialed directly.
+    """
+    from runes_cli import containers, hosts
+
+    clients = {}
+    monkeypatch.setattr(containers, "_docker_clients", {})
+    monkeypatch.setattr(
+        hosts, "get_inventory", lambda: {name: f"ssh://{name}" for name in clients}
+    )
+    monkeypatch.setattr(hosts, "connect", lambda name: clients[name])
+    return clients
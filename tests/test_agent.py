@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from runes_cli import agent
+
+
+class EchoAgent:
+    def handle(self, op, args):
+        return [{"op": op}]
+
+
+def test_idle_client_does_not_block_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "REQUEST_TIMEOUT", 2)
+    path = os.path.join(tmp_path, "runesd.sock")
+    server = agent.AgentServer(path, EchoAgent())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(path)  # never sends its request line
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1)  # well before the idle client times out
+            sock.connect(path)
+            sock.sendall(b'{"op": "ps"}\n')
+            assert json.loads(sock.makefile().readline()) == {"op": "ps"}
+
+        # The idle connection is dropped after the request timeout
+        idle.settimeout(5)
+        assert idle.recv(1) == b""
+        idle.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_agent_errors_end_the_command(monkeypatch):
+    from click.testing import CliRunner
+
+    from runes_cli.cli import cli
+
+    def request(op, **args):
+        yield {"id": 1}
+        raise agent.AgentError("Unknown operation: ps")
+
+    monkeypatch.setattr(agent, "request", request)
+    result = CliRunner().invoke(cli, ["ps"])
+    assert result.exit_code == 1
+    assert "runesd: Unknown operation: ps" in result.output
+    assert not isinstance(result.exception, agent.AgentError)
+
+
+def test_operations_are_dispatched_to_batch(monkeypatch):
+    from runes_cli import api, batch, hosts
+
+    calls = []
+    monkeypatch.setattr(
+        batch, "list_runes", lambda **args: calls.append(("ps", args)) or []
+    )
+    monkeypatch.setattr(
+        batch, "stop_runes", lambda **args: calls.append(("stop", args)) or []
+    )
+    monkeypatch.setattr(hosts, "get_hosts", lambda: [hosts.LOCAL_HOST])
+    fetches = []
+    monkeypatch.setattr(
+        api, "get_remote_images", lambda: fetches.append(1) or ["catalog"]
+    )
+
+    handler = agent.Agent()
+    handler.handle("stop", {"container_ids": ["a"]})
+    handler.handle("ps", {"show_all": False})
+    # While the events watcher is connected `ps` skips reconciling
+    handler.watcher.connected.set()
+    handler.handle("ps", {"show_all": False})
+    assert calls == [
+        ("stop", {"container_ids": ["a"]}),
+        ("ps", {"show_all": False}),
+        ("ps", {"show_all": False, "reconcile": False}),
+    ]
+
+    # The catalog is fetched once and handed to every catalog request
+    monkeypatch.setattr(
+        batch, "list_catalog", lambda **args: calls.append(("catalog", args)) or []
+    )
+    handler.handle("catalog", {})
+    handler.handle("catalog", {"category": "audio"})
+    assert calls[-2:] == [
+        ("catalog", {"remote_images": ["catalog"]}),
+        ("catalog", {"category": "audio", "remote_images": ["catalog"]}),
+    ]
+    assert fetches == [1]
+
+    with pytest.raises(agent.AgentError, match="Unknown operation: rm"):
+        handler.handle("rm", {})
@@ -0,0 +1,59 @@
+import gzip
+import os
+
+from runes_cli import archive, persistence
+from runes_cli.logs import parse_timestamp_ns
+
+
+class LogAPI:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def logs(self, container_id, stream=False, since=None, **kwargs):
+        for timestamp, text in self.lines:
+            yield f"{timestamp} {text}\n".encode()
+
+
+class LogClient:
+    def __init__(self, lines):
+        self.api = LogAPI(lines)
+
+
+def stamp(second):
+    return f"2026-10-18T10:00:{second:02d}.000000000Z"
+
+
+def test_archive_writes_chunks_and_rotates(monkeypatch, tmp_path):
+    monkeypatch.setattr(archive, "archive_dir", str(tmp_path))
+    monkeypatch.setattr(archive, "get_compression", lambda: "gzip")
+    monkeypatch.setattr(archive, "CHUNK_BYTES", 100)
+    monkeypatch.setattr(archive, "LOG_SEGMENT_BYTES", 1)
+    cursors = []
+    monkeypatch.setattr(
+        archive,
+        "set_log_cursor",
+        lambda *args: (cursors.append(args[2]), persistence.set_log_cursor(*args)),
+    )
+
+    # Two lines share a timestamp and must not be split across chunks
+    lines = [(stamp(i), "x" * 40) for i in range(6)] + [(stamp(5), "same second")]
+    client = LogClient(lines)
+    summary = archive.archive_logs("archived", client)
+
+    assert summary["lines"] == 7
+    assert len(cursors) == 3 and cursors == sorted(cursors)
+    segments = sorted(os.listdir(tmp_path / "archived"))
+    assert len(segments) == 3  # every chunk filled a segment
+    text = b"".join(
+        gzip.decompress((tmp_path / "archived" / name).read_bytes())
+        for name in segments
+    ).decode()
+    assert text.count("\n") == 7
+    # Both lines of the shared timestamp ended up in the last chunk
+    last = gzip.decompress((tmp_path / "archived" / segments[-1]).read_bytes())
+    assert [line.split()[0] for line in last.decode().splitlines()][-2:] == [
+        str(parse_timestamp_ns(stamp(5)))
+    ] * 2
+
+    # Nothing new since the cursor
+    assert archive.archive_logs("archived", client)["lines"] == 0
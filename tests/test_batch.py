@@ -0,0 +1,50 @@
+import json
+
+from click.testing import CliRunner
+from conftest import FakeDockerClient
+from test_hosts import add_rune
+
+from runes_cli import agent, batch, cli, persistence
+
+
+def run_ps(monkeypatch, *args):
+    monkeypatch.setattr(agent, "request", lambda op, **args: None)
+    monkeypatch.setattr(cli, "require_docker", lambda: None)
+    result = CliRunner().invoke(cli.cli, ["ps", *args])
+    return result, [json.loads(line) for line in result.output.splitlines()]
+
+
+def test_ps_lists_running_runes_as_ndjson(docker_hosts, monkeypatch):
+    docker_hosts["one"] = FakeDockerClient("one")
+    add_rune(docker_hosts, "one", "ps-up")
+    add_rune(docker_hosts, "one", "ps-gone")
+    del docker_hosts["one"].api.running["ps-gone"]
+
+    result, records = run_ps(monkeypatch)
+    assert result.exit_code == 0
+    ids = {record["container_id"] for record in records}
+    assert "ps-up" in ids and "ps-gone" not in ids
+
+    # The rune that went away was marked stopped, and `--all` still lists it
+    statuses = {
+        container.container_id: container.status
+        for container in persistence.iter_container_states()
+    }
+    assert statuses["ps-gone"] == persistence.STATUS_STOPPED
+    result, records = run_ps(monkeypatch, "--all")
+    assert {"ps-up", "ps-gone"} <= {record["container_id"] for record in records}
+
+
+def test_ps_streams_records_as_they_come(monkeypatch):
+    def list_runes(**args):
+        yield {"container_id": "first"}
+        raise RuntimeError("daemon went away")
+
+    monkeypatch.setattr(batch, "list_runes", list_runes)
+    monkeypatch.setattr(agent, "request", lambda op, **args: None)
+    monkeypatch.setattr(cli, "require_docker", lambda: None)
+    result = CliRunner().invoke(cli.cli, ["ps"])
+
+    # The first record was written before the listing failed
+    assert isinstance(result.exception, RuntimeError)
+    assert json.loads(result.output) == {"container_id": "first"}
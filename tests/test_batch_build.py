@@ -0,0 +1,81 @@
+import json
+
+import click
+import pytest
+
+from runes_cli import api
+from runes_cli.cli import batch_build_jobs
+from runes_cli.models import RemoteSource
+
+
+def notebooks(directory, *names):
+    directory.mkdir(exist_ok=True)
+    for name in names:
+        (directory / f"{name}.ipynb").write_text("{}")
+    return str(directory)
+
+
+def image_names(jobs):
+    return [job["image_name"] for job in jobs]
+
+
+def test_directory_names(tmp_path):
+    source = notebooks(tmp_path / "nb", "Speech", "music gen")
+    (tmp_path / "nb" / "notes.txt").write_text("")
+    jobs = batch_build_jobs(source, None, False, "me/", "headless")
+    assert image_names(jobs) == ["me/speech", "me/music-gen"]  # file name order
+    assert {job["runtime"] for job in jobs} == {"headless"}
+
+
+def test_directory_names_that_clash(tmp_path):
+    source = notebooks(tmp_path / "nb", "My Rune", "my-rune", "other")
+    with pytest.raises(click.ClickException, match="my-rune: .*My Rune.ipynb, "):
+        batch_build_jobs(source, None, False, "", "notebook")
+
+
+def test_prefix_truncation_clash(tmp_path):
+    # Names are cut to 50 characters, after the prefix
+    source = notebooks(tmp_path / "nb", "model-a", "model-b")
+    with pytest.raises(click.ClickException, match="share an image name"):
+        batch_build_jobs(source, None, False, "x" * 45 + "/", "notebook")
+
+
+def test_manifest(tmp_path):
+    manifest = tmp_path / "builds.json"
+    entries = [
+        {"source": "a.ipynb", "image_name": "me/a"},
+        {
+            "source": "https://example.com/b.ipynb",
+            "image_name": "me/b",
+            "runtime": "headless",
+        },
+    ]
+    manifest.write_text(json.dumps(entries))
+    jobs = batch_build_jobs(None, str(manifest), False, "", "notebook")
+    assert jobs == [
+        {
+            "source": str(tmp_path / "a.ipynb"),
+            "image_name": "me/a",
+            "runtime": "notebook",
+        },
+        {
+            "source": "https://example.com/b.ipynb",
+            "image_name": "me/b",
+            "runtime": "headless",
+        },
+    ]
+
+    entries[1]["image_name"] = "me/a"
+    manifest.write_text(json.dumps(entries))
+    with pytest.raises(click.ClickException, match="me/a: "):
+        batch_build_jobs(None, str(manifest), False, "", "notebook")
+
+
+def test_published_sources_that_clash(monkeypatch):
+    sources = [
+        RemoteSource("Voice Clone", "", "https://example.com/1.ipynb", "1"),
+        RemoteSource("voice clone", "", "https://example.com/2.ipynb", "1"),
+    ]
+    monkeypatch.setattr(api, "get_remote_sources", lambda: sources)
+    with pytest.raises(click.ClickException, match="voice-clone"):
+        batch_build_jobs(None, None, True, "", "notebook")
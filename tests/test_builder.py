@@ -0,0 +1,160 @@
+import json
+import os
+import uuid
+
+import pytest
+from conftest import FakeDockerClient
+
+from runes_cli import builder
+
+
+@pytest.fixture
+def build(monkeypatch, tmp_path):
+    """
+    Builds a notebook with the legacy API builder of a fake daemon. Returns
+    (build function, client); every test gets a notebook of its own, so
+    build hashes recorded by other tests never match.
+    """
+    client = FakeDockerClient("local")
+    monkeypatch.setattr(builder, "get_docker_client", lambda: client)
+    monkeypatch.setattr(builder, "buildkit_available", lambda: False)
+
+    notebook = tmp_path / "rune.ipynb"
+    cell = {"cell_type": "code", "source": f"print('{uuid.uuid4()}')"}
+    notebook.write_text(json.dumps({"cells": [cell]}))
+
+    def build_image(image_name, **kwargs):
+        return builder.DockerImageBuilder().build_docker_image(
+            str(notebook), image_name, **kwargs
+        )
+
+    return build_image, client
+
+
+def test_unchanged_sources_retag_the_cached_image(build):
+    build_image, client = build
+    first = build_image("me/first")
+    second = build_image("me/second")
+
+    assert not first["cached"] and second["cached"]
+    assert second["image_id"] == first["image_id"]
+    assert second["build_hash"] == first["build_hash"]
+    assert client.api.tags["me/second:latest"] == first["image_id"]
+    assert len(client.api.dockerfiles) == 1
+
+
+def test_changed_startup_script_misses_the_cache(build, monkeypatch):
+    build_image, client = build
+    first = build_image("me/rune")
+    monkeypatch.setitem(
+        builder.STARTUP_SCRIPTS, "notebook", builder.STARTUP_SCRIPTS["notebook"] + "\n"
+    )
+    second = build_image("me/rune")
+
+    assert not second["cached"]
+    assert second["build_hash"] != first["build_hash"]
+    assert len(client.api.dockerfiles) == 2
+
+
+def test_changed_dockerfile_misses_the_cache(build, monkeypatch):
+    build_image, client = build
+    first = build_image("me/rune")
+    make_dockerfile = builder.make_dockerfile
+    monkeypatch.setattr(
+        builder,
+        "make_dockerfile",
+        lambda *args: make_dockerfile(*args) + "ENV CHANGED=1\n",
+    )
+    second = build_image("me/rune")
+
+    assert not second["cached"]
+    assert second["build_hash"] != first["build_hash"]
+    assert client.api.dockerfiles[1].endswith("ENV CHANGED=1\n")
+
+
+def test_runtime_and_force_rebuild(build):
+    build_image, client = build
+    notebook = build_image("me/rune")
+    headless = build_image("me/rune-headless", runtime="headless")
+    forced = build_image("me/rune", force=True)
+
+    assert not headless["cached"] and headless["build_hash"] != notebook["build_hash"]
+    assert not forced["cached"] and forced["build_hash"] == notebook["build_hash"]
+    assert len(client.api.dockerfiles) == 3
+
+
+def test_deleted_image_is_rebuilt(build):
+    build_image, client = build
+    first = build_image("me/rune")
+    del client.api.images_by_id[first["image_id"]]
+
+    second = build_image("me/rune")
+    assert not second["cached"]
+    assert second["image_id"] != first["image_id"]
+
+
+def test_dockerfile_layers_from_stable_to_notebook():
+    dockerfile = builder.make_dockerfile(
+        False, apt_packages=["sox"], pip_installs=["torch"]
+    )
+    order = [
+        "FROM jupyter/base-notebook",
+        "apt-get install -y ffmpeg",
+        "pip install --no-cache-dir nbconvert dawnet-client",
+        "apt-get install -y sox",
+        "pip install --no-cache-dir torch",
+        "COPY --chown=jovyan:users startup.sh",
+        "COPY --chown=jovyan:users source.ipynb",
+    ]
+    positions = [dockerfile.index(step) for step in order]
+    assert positions == sorted(positions)
+    assert "--mount" not in dockerfile
+    # The notebook is the last layer
+    assert "COPY" not in dockerfile[positions[-1] + 1 :]
+
+
+def test_buildkit_dockerfile_uses_cache_mounts():
+    dockerfile = builder.make_dockerfile(True, pip_installs=["torch"])
+    assert dockerfile.startswith("# syntax=docker/dockerfile:1\n")
+    assert dockerfile.count("--mount=type=cache,target=/var/cache/apt") == 1
+    # Both the tooling and the notebook's installs share the pip cache
+    assert dockerfile.count("--mount=type=cache,target=/home/jovyan/.cache/pip") == 2
+    assert "--no-cache-dir" not in dockerfile
+    assert "rm -rf /var/lib/apt/lists" not in dockerfile
+
+
+def test_builds_use_the_layer_cache_unless_forced(build):
+    build_image, client = build
+    build_image("me/layers")
+    build_image("me/layers", force=True)
+    assert [options["nocache"] for options in client.api.build_options] == [
+        False,
+        True,
+    ]
+
+
+def test_headless_image_runs_the_script(build, monkeypatch):
+    build_image, client = build
+    contexts = []
+    api_build = client.api.build
+
+    def build_context(path=None, **kwargs):
+        contexts.append(sorted(os.listdir(path)))
+        with open(os.path.join(path, "startup.sh")) as f:
+            contexts.append(f.read())
+        return api_build(path=path, **kwargs)
+
+    monkeypatch.setattr(client.api, "build", build_context)
+    summary = build_image("me/headless", runtime="headless")
+    assert summary["runtime"] == "headless"
+
+    files, startup = contexts
+    assert "rune.ipy" in files
+    assert "exec ipython --colors=NoColor /usr/src/app/rune.ipy" in startup
+    assert "start-notebook.sh" not in startup
+    dockerfile = client.api.dockerfiles[-1]
+    assert "COPY --chown=jovyan:users rune.ipy /usr/src/app/" in dockerfile
+    assert "source.ipynb" not in dockerfile and "EXPOSE" not in dockerfile
+
+    image_id = client.api.tags["me/headless"]
+    assert client.api.images_by_id[image_id][builder.LABEL_RUNTIME] == "headless"
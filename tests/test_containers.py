@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+from conftest import FakeDockerClient
+
+from runes_cli import containers, hosts, persistence
+
+
+def test_docker_client_is_shared_and_pinged_sparingly(docker_hosts, monkeypatch):
+    connects = []
+
+    def connect(name):
+        connects.append(name)
+        return docker_hosts[name]
+
+    monkeypatch.setattr(hosts, "connect", connect)
+    monkeypatch.setattr(containers.time, "monotonic", lambda: now)
+    docker_hosts["one"] = FakeDockerClient("one")
+    docker_hosts["two"] = FakeDockerClient("two")
+
+    now = 100.0
+    client = containers.get_docker_client("one")
+    assert client is docker_hosts["one"]
+    assert containers.get_docker_client("two") is docker_hosts["two"]
+
+    # Within the ping interval the client is handed out without a round trip
+    now += containers.DOCKER_PING_INTERVAL / 2
+    assert containers.get_docker_client("one") is client
+    assert client.pings == 1
+
+    now += containers.DOCKER_PING_INTERVAL
+    assert containers.get_docker_client("one") is client
+    assert client.pings == 2
+    assert connects == ["one", "two"]
+
+
+def test_unreachable_docker_client_is_dropped(docker_hosts, monkeypatch):
+    monkeypatch.setattr(containers, "DOCKER_PING_INTERVAL", 0)
+    down = docker_hosts["one"] = FakeDockerClient("one", reachable=False)
+    assert containers.get_docker_client("one") is None
+    assert down.closed
+
+    # The next call reconnects rather than reusing the failed client
+    up = docker_hosts["one"] = FakeDockerClient("one")
+    assert containers.get_docker_client("one") is up
+
+
+@pytest.fixture
+def local_client(monkeypatch):
+    client = FakeDockerClient("fan")
+    monkeypatch.setattr(containers, "get_docker_client", lambda host=None: client)
+    return client
+
+
+def test_replicas_are_launched_concurrently(local_client, monkeypatch):
+    # Every launch waits for the others: a serial fan-out would time out
+    barrier = threading.Barrier(3, timeout=5)
+    run = local_client.containers.run
+
+    def run_together(image, **kwargs):
+        barrier.wait()
+        return run(image, **kwargs)
+
+    monkeypatch.setattr(local_client.containers, "run", run_together)
+    results = containers.start_replicas(
+        "img", "fan", "", "token", replicas=3, unique_tokens=True, use_pool=False
+    )
+
+    assert [result["replica"] for result in results] == [0, 1, 2]
+    assert all(result["started"] for result in results)
+    assert len({result["associated_token"] for result in results}) == 3
+    stored = {
+        container.container_id: container
+        for container in persistence.iter_container_states()
+    }
+    for result in results:
+        container = stored[result["container_id"]]
+        assert container.status == persistence.STATUS_RUNNING
+        assert container.associated_token == result["associated_token"]
+        options = local_client.api.created[result["container_id"]]
+        assert options["environment"]["DN_CLIENT_TOKEN"] == result["associated_token"]
+        assert options["labels"][containers.LABEL_DB_ID] == str(container.id)
+
+
+def test_failed_replicas_are_reported_and_unreserved(local_client):
+    local_client.api.broken_images.add("broken")
+    before = len(persistence.get_container_states())
+
+    results = containers.start_replicas(
+        "broken", "fan", "", "token", replicas=2, use_pool=False
+    )
+    assert [result["started"] for result in results] == [False, False]
+    assert "broken failed to start" in results[0]["error"]
+    assert len(persistence.get_container_states()) == before
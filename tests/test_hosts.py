@@ -0,0 +1,143 @@
+from conftest import FakeDockerClient
+
+from runes_cli import batch, hosts, persistence
+from runes_cli.logs import follow_logs
+
+
+def add_rune(clients, host, container_id, log=b""):
+    clients[host].api.running[container_id] = log
+    (row_id,) = persistence.reserve_container_states(
+        [("rune", "", None, "img")], status=persistence.STATUS_STARTING, host=host
+    )
+    persistence.finish_container_starts([(row_id, 1, container_id)], [])
+
+
+def test_placement_policies(docker_hosts):
+    docker_hosts["small"] = FakeDockerClient("small", ncpu=2)
+    docker_hosts["big"] = FakeDockerClient("big", ncpu=8)
+    docker_hosts["big"].api.running = {"a": b"", "b": b""}
+
+    # 0/2 vs 2/8 runes per core, then 1/2 vs 2/8, ...
+    assert hosts.place_replicas(3, "img", "least-loaded") == ["small", "big", "big"]
+    # The busiest host with room first
+    assert hosts.place_replicas(3, "img", "pack") == ["big", "big", "big"]
+    # Fewest runes of the image first
+    assert hosts.place_replicas(4, "img", "spread") == [
+        "small",
+        "small",
+        "big",
+        "small",
+    ]
+
+
+def test_unreachable_host_is_reported(docker_hosts):
+    docker_hosts["up"] = FakeDockerClient("up")
+    docker_hosts["down"] = FakeDockerClient("down", reachable=False)
+
+    results = {host: error for host, _, error in hosts.for_each_host(hosts.host_load)}
+    assert results["up"] is None
+    assert results["down"] is not None
+    assert [load["host"] for load in hosts.host_loads()] == ["up"]
+
+
+def test_stop_fans_out_per_host(docker_hosts):
+    docker_hosts["one"] = FakeDockerClient("one")
+    docker_hosts["two"] = FakeDockerClient("two")
+    add_rune(docker_hosts, "one", "c1")
+    add_rune(docker_hosts, "two", "c2")
+
+    results = list(batch.stop_runes(["c1", "c2"]))
+    assert {(result["container_id"], result["host"]) for result in results} == {
+        ("c1", "one"),
+        ("c2", "two"),
+    }
+    assert docker_hosts["one"].api.stopped == ["c1"]
+    assert docker_hosts["two"].api.stopped == ["c2"]
+
+
+def test_follow_logs_through_clients(docker_hosts, capsys):
+    docker_hosts["one"] = FakeDockerClient("one")
+    docker_hosts["two"] = FakeDockerClient("two")
+    docker_hosts["one"].api.running["l1"] = b"hello from one\n"
+    docker_hosts["two"].api.running["l2"] = b"hello from two"
+
+    assert follow_logs([("l1", "one"), ("l2", "two")], follow=False)
+    out = capsys.readouterr().out
+    assert "hello from one" in out
+    assert "hello from two" in out
+
+
+def test_gpu_check_reprobes_stale_capabilities(monkeypatch):
+    from runes_cli import containers
+
+    probes = []
+
+    def get_host_capabilities(client=None, docker_host=None, refresh=False):
+        probes.append(refresh)
+        # The cached probe predates the nvidia runtime being installed
+        return {"runtimes": ["runc", "nvidia"] if refresh else ["runc"]}
+
+    monkeypatch.setattr(containers, "get_host_capabilities", get_host_capabilities)
+    assert containers.check_nvidia_docker_installed()
+    assert probes == [False, True]
+
+
+def test_ambiguous_and_unknown_ids_fail(docker_hosts):
+    docker_hosts["one"] = FakeDockerClient("one")
+    add_rune(docker_hosts, "one", "abc1")
+    add_rune(docker_hosts, "one", "abc2")
+
+    results = {
+        result["container_id"]: result
+        for result in batch.stop_runes(["abc", "abc2", "zzz"])
+    }
+    assert not results["abc"]["ok"]
+    assert "prefix" in results["abc"]["error"]
+    assert results["abc2"]["ok"]
+    assert not results["zzz"]["ok"]
+    assert docker_hosts["one"].api.stopped == ["abc2"]
+
+
+def test_unlabelled_running_runes_are_kept(docker_hosts):
+    from runes_cli.containers import reconcile_container_states
+
+    docker_hosts["one"] = client = FakeDockerClient("one")
+    add_rune(docker_hosts, "one", "old")
+    add_rune(docker_hosts, "one", "gone")
+    client.api.unlabelled.add("old")
+    del client.api.running["gone"]
+
+    running = reconcile_container_states(client, "one")
+    assert [container.container_id for container in running] == ["old"]
+    assert persistence.find_container_state("gone").status == persistence.STATUS_STOPPED
+
+
+def test_failed_restart_is_not_a_kill(docker_hosts):
+    docker_hosts["one"] = client = FakeDockerClient("one")
+    add_rune(docker_hosts, "one", "r1")
+
+    (result,) = batch.restart_runes(container_ids=["r1"])
+    assert not result["ok"]
+    assert "can't restart" in result["error"]
+    assert client.api.killed == []
+    assert persistence.find_container_state("r1").status == persistence.STATUS_RUNNING
+
+
+def test_hosts_info_probes_the_named_host(docker_hosts):
+    import json
+
+    from click.testing import CliRunner
+
+    from runes_cli.cli import cli
+
+    docker_hosts["one"] = FakeDockerClient("one", ncpu=6)
+    docker_hosts["two"] = FakeDockerClient("two", ncpu=2)
+
+    result = CliRunner().invoke(cli, ["hosts", "info", "two", "--refresh"])
+    assert result.exit_code == 0, result.output
+    record = json.loads(result.output)
+    assert (record["host"], record["daemon_id"], record["ncpu"]) == ("two", "two", 2)
+
+    result = CliRunner().invoke(cli, ["hosts", "info", "three"])
+    assert result.exit_code == 1
+    assert "Unknown Docker host: three" in result.output
@@ -0,0 +1,89 @@
+import sqlite3
+import time
+
+import pytest
+
+from runes_cli import logindex, persistence
+
+
+@pytest.mark.parametrize(
+    "text, seconds",
+    [("90s", 90), ("30m", 1800), ("24H", 86400), (" 7d ", 604800), ("2w", 1209600)],
+)
+def test_parse_duration(text, seconds):
+    assert logindex.parse_duration(text) == seconds
+
+
+def test_parse_duration_without_unit_is_seconds():
+    assert logindex.parse_duration("1.5") == 1.5
+
+
+@pytest.mark.parametrize("text", ["", "d", "soon", "5y"])
+def test_parse_duration_rejects(text):
+    with pytest.raises(ValueError):
+        logindex.parse_duration(text)
+
+
+def test_match_query_quotes_every_word():
+    assert logindex.to_match_query("CUDA out-of-memory") == '"CUDA" "out-of-memory"'
+    assert logindex.to_match_query('say "hi"') == '"say" """hi"""'
+
+
+@pytest.fixture
+def indexed():
+    now_ns = time.time_ns()
+    day_ns = 86400 * 10**9
+    lines = [
+        (now_ns - 40 * day_ns, "old: CUDA out-of-memory"),
+        (now_ns - day_ns, 'recent: cuda:0 said "OOM" AND NOT NEAR(x)'),
+        (now_ns, "new: all good"),
+    ]
+    persistence.add_log_entries(0, "indexed", logindex.CURSOR_CONSUMER, lines)
+    yield
+    conn = persistence.get_connection()
+    with conn:
+        conn.execute("DELETE FROM log_entries")
+
+
+def search(query, **kwargs):
+    return [record["line"] for record in logindex.search_logs(query, **kwargs)]
+
+
+def test_search_treats_operators_and_quotes_as_text(indexed):
+    assert search("out-of-memory") == ["old: CUDA out-of-memory"]
+    assert search("cuda:0") == ['recent: cuda:0 said "OOM" AND NOT NEAR(x)']
+    assert search('"OOM" AND NOT') == ['recent: cuda:0 said "OOM" AND NOT NEAR(x)']
+    assert search("NEAR(x)") == ['recent: cuda:0 said "OOM" AND NOT NEAR(x)']
+    # Raw queries are FTS5 syntax
+    assert search("cuda NOT good", raw=True) == [
+        'recent: cuda:0 said "OOM" AND NOT NEAR(x)',
+        "old: CUDA out-of-memory",
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        search("NEAR(", raw=True)
+
+
+def test_search_time_window(indexed):
+    assert search("cuda", since="7d") == ['recent: cuda:0 said "OOM" AND NOT NEAR(x)']
+    assert search("cuda", until="30d") == ["old: CUDA out-of-memory"]
+
+
+def test_prune_keeps_recent_lines(indexed):
+    assert logindex.prune_logs("30d")["pruned"] == 1
+    assert search("cuda") == ['recent: cuda:0 said "OOM" AND NOT NEAR(x)']
+    assert logindex.prune_logs("30d")["pruned"] == 0
+
+
+def test_index_command_prunes_alone(indexed):
+    import json
+
+    from click.testing import CliRunner
+
+    from runes_cli.cli import cli
+
+    result = CliRunner().invoke(cli, ["logs", "index", "--keep", "30d"])
+    assert result.exit_code == 0
+    assert json.loads(result.output)["pruned"] == 1
+
+    result = CliRunner().invoke(cli, ["logs", "index", "--keep", "soon"])
+    assert result.exit_code == 2
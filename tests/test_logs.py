@@ -0,0 +1,45 @@
+from conftest import FakeDockerClient
+
+from runes_cli.logs import LineSplitter, Output, follow_logs
+
+
+def test_splitter_holds_back_partial_lines():
+    splitter = LineSplitter()
+    assert splitter.feed(b"one\ntw") == ["one"]
+    assert splitter.feed(b"o\nthree") == ["two"]
+    assert splitter.feed(b"", final=True) == ["three"]
+    assert splitter.feed(b"", final=True) == []
+
+
+def test_splitter_joins_multibyte_characters_across_chunks():
+    data = "héllo wörld ✓\n".encode("utf-8")
+    splitter = LineSplitter()
+    lines = []
+    for i in range(len(data)):  # one byte at a time
+        lines += splitter.feed(data[i : i + 1])
+    assert lines == ["héllo wörld ✓"]
+
+
+def test_splitter_replaces_invalid_bytes():
+    assert LineSplitter().feed(b"bad \xff byte\n") == ["bad � byte"]
+
+
+def test_output_batches_lines(capsys, monkeypatch):
+    output = Output()
+    output.write_lines("p | ", ["a", "b\r"])
+    assert capsys.readouterr().out == ""  # held until flushed
+
+    monkeypatch.setattr("runes_cli.logs.FLUSH_BYTES", 10)
+    output.write_lines("p | ", ["c"])
+    assert capsys.readouterr().out == "p | a\np | b\np | c\n"
+
+
+def test_client_streams_are_split_separately(docker_hosts, capsys):
+    docker_hosts["one"] = client = FakeDockerClient("one")
+    client.api.running["c1"] = b"partial stdout"
+    client.api.stderr["c1"] = b"stderr line\n"
+
+    assert follow_logs([("c1", "one")], follow=False)
+    # Not "partial stdoutstderr line": the streams don't share a splitter
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == ["partial stdout", "stderr line"]
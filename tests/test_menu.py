@@ -0,0 +1,58 @@
+import itertools
+import sys
+import tracemalloc
+
+from runes_cli import cli
+
+STEPS = 5000
+
+# main menu -> tokens -> back -> account -> back -> ...
+ANSWERS = [
+    "tokens (set or update your connection token)",
+    cli.option_menu,
+    "account (sign up/in/out)",
+    cli.option_menu,
+]
+
+
+def stack_depth():
+    frame, depth = sys._getframe(1), 0
+    while frame is not None:
+        frame, depth = frame.f_back, depth + 1
+    return depth
+
+
+class Prompt:
+    def __init__(self, answer):
+        self.answer = answer
+
+    def ask(self):
+        return self.answer
+
+
+def test_menu_navigation_stays_flat(monkeypatch):
+    answers = itertools.islice(itertools.cycle(ANSWERS), STEPS)
+    depths, memory = set(), []
+    steps = itertools.count(1)
+
+    def select(title, choices):
+        depths.add(stack_depth())
+        if next(steps) == STEPS // 10:
+            memory.append(tracemalloc.get_traced_memory()[0])
+        # None after the last step: the menu exits on an unexpected selection
+        return Prompt(next(answers, None))
+
+    monkeypatch.setattr(cli, "select", select)
+    monkeypatch.setattr(cli, "clear_screen", lambda: None)
+
+    tracemalloc.start()
+    try:
+        cli.run_menu(None)
+        memory.append(tracemalloc.get_traced_memory()[0])
+    finally:
+        tracemalloc.stop()
+
+    assert next(steps) == STEPS + 2
+    assert len(depths) == 1
+    # Nothing accumulates per step once warmed up
+    assert memory[1] - memory[0] < 16 * 1024
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from runes_cli import notebooks
+
+
+@pytest.mark.parametrize(
+    "line, parsed",
+    [
+        ("!pip install numpy pandas", ("pip", "numpy pandas")),
+        ("%pip install -q torch", ("pip", "-q torch")),
+        ("!python -m pip install requests", ("pip", "requests")),
+        ("!pip install 'numpy<2'", ("pip", "'numpy<2'")),
+        (
+            "!pip install git+https://example.com/a/b.git",
+            ("pip", "git+https://example.com/a/b.git"),
+        ),
+        ("!apt-get install -y ffmpeg", ("apt", ["ffmpeg"])),
+        ("!sudo apt install -y -q libsndfile1 sox", ("apt", ["libsndfile1", "sox"])),
+        ("!apt-get update -q", ("apt-update", None)),
+    ],
+)
+def test_install_lines_moved_to_the_build(line, parsed):
+    assert notebooks.parse_install_line(line) == parsed
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        # Python variables and shell expansion
+        "!pip install {package}",
+        "!pip install $PACKAGE",
+        "!pip install `cat reqs`",
+        # Chaining, pipes, redirects
+        "!pip install numpy && echo done",
+        "!pip install numpy > /dev/null",
+        # Files of the notebook's working directory
+        "!pip install -r requirements.txt",
+        "!pip install --requirement=requirements.txt",
+        "!pip install -rrequirements.txt",
+        "!pip install -c constraints.txt numpy",
+        "!pip install -e .",
+        "!pip install ./wheels/model.whl",
+        "!pip install /opt/pkg",
+        # Not an install
+        "import numpy",
+        "!apt-get install -y",
+    ],
+)
+def test_lines_left_in_the_notebook(line):
+    assert notebooks.parse_install_line(line) is None
+
+
+def write_notebook(path, *sources):
+    cells = [{"cell_type": "code", "source": source} for source in sources]
+    cells.append({"cell_type": "markdown", "source": "!pip install not-code"})
+    path.write_text(json.dumps({"cells": cells}))
+
+
+def test_extract_install_commands(tmp_path):
+    path = tmp_path / "rune.ipynb"
+    write_notebook(
+        path,
+        ["!pip install numpy\n", "!apt-get install -y ffmpeg\n", "import numpy\n"],
+        [
+            "try:\n",
+            "    import torch\n",
+            "except ImportError:\n",
+            "    !pip install torch\n",
+        ],
+        "!pip install numpy",  # again, installed once
+    )
+
+    apt_packages, pip_installs = notebooks.extract_install_commands(str(path))
+    assert apt_packages == ["ffmpeg"]
+    assert pip_installs == ["numpy"]
+
+    cells = notebooks.read_notebook(str(path))["cells"]
+    assert cells[0]["source"] == [
+        notebooks.BAKED_PREFIX + "!pip install numpy\n",
+        notebooks.BAKED_PREFIX + "!apt-get install -y ffmpeg\n",
+        "import numpy\n",
+    ]
+    # Indented (conditional) installs keep their place and indentation
+    assert cells[1]["source"][3] == "    !pip install torch\n"
+    assert cells[3]["source"] == "!pip install not-code"
+
+
+def test_notebook_without_installs_is_untouched(tmp_path):
+    path = tmp_path / "rune.ipynb"
+    write_notebook(path, "print('hi')")
+    before = path.read_text()
+    assert notebooks.extract_install_commands(str(path)) == ([], [])
+    assert path.read_text() == before
+
+
+def test_notebook_to_script(tmp_path):
+    path = tmp_path / "rune.ipynb"
+    write_notebook(path, ["import os\n", "!ls\n"], "", "%time print(os.getcwd())\n")
+    script = tmp_path / "rune.ipy"
+    notebooks.notebook_to_script(str(path), str(script))
+
+    # Code cells only, numbered as in the notebook; empty cells are dropped
+    assert script.read_text() == (
+        "# In[1]:\nimport os\n!ls\n\n# In[3]:\n%time print(os.getcwd())\n\n"
+    )
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+OPEN = f"""
+import sys
+sys.path.insert(0, {SRC!r})
+from runes_cli import persistence
+persistence.get_connection()
+"""
+
+
+def test_concurrent_first_runs_migrate_once(tmp_path):
+    env = dict(os.environ, XDG_DATA_HOME=str(tmp_path))
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", OPEN], env=env, stderr=subprocess.PIPE, text=True
+        )
+        for _ in range(8)
+    ]
+    for process in processes:
+        _, err = process.communicate(timeout=60)
+        assert process.returncode == 0, err
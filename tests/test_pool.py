@@ -0,0 +1,79 @@
+import pytest
+from conftest import FakeDockerClient
+
+from runes_cli import containers, persistence, pool
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeDockerClient("pool")
+    monkeypatch.setattr(containers, "get_docker_client", lambda host=None: client)
+    if persistence.read_token_from_db() is None:
+        persistence.set_or_update_token(token=persistence.generate_uuid())
+    return client
+
+
+def set_target(image_name, mode, size):
+    persistence.set_pool_target(image_name, "warm", "", False, mode, size)
+    return persistence.get_pool_target(image_name)
+
+
+def take(client, image_name, count, token=None):
+    token = token or persistence.read_token_from_db()
+    return pool.take_from_pool(client, image_name, "warm", "", token, False, count)
+
+
+def test_pool_is_filled_taken_from_and_refilled(client):
+    target = set_target("pool-created", "created", 2)
+    assert pool.fill_pool(target, client) == {
+        "image_name": "pool-created",
+        "removed": 0,
+        "created": 2,
+        "pooled": 2,
+    }
+    parked = [c.container_id for c in pool.pooled_containers("pool-created")]
+    assert len(parked) == 2
+    assert not set(parked) & set(client.api.running)
+
+    # A start with another token can't use the pooled containers
+    assert take(client, "pool-created", 1, token="someone-else") == []
+
+    ((container, _),) = take(client, "pool-created", 1)
+    assert container.id == parked[0]
+    assert container.id in client.api.running
+    (row,) = [
+        c for c in persistence.iter_container_states() if c.container_id == container.id
+    ]
+    assert row.status == persistence.STATUS_RUNNING
+
+    # Asking for more than is left hands out the rest and counts the misses
+    assert len(take(client, "pool-created", 2)) == 1
+    target = persistence.get_pool_target("pool-created")
+    assert (target["hits"], target["misses"]) == (2, 2)
+
+    assert pool.fill_pool(target, client)["created"] == 2
+
+
+def test_paused_pool_is_unpaused_on_handoff(client):
+    target = set_target("pool-paused", "paused", 1)
+    pool.fill_pool(target, client)
+    (parked,) = pool.pooled_containers("pool-paused")
+    assert client.api.paused == [parked.container_id]
+
+    take(client, "pool-paused", 1)
+    assert client.api.unpaused == [parked.container_id]
+
+
+def test_shrunk_pool_is_trimmed_and_drain_removes_it(client):
+    pool.fill_pool(set_target("pool-drain", "created", 3), client)
+    summary = pool.fill_pool(set_target("pool-drain", "created", 1), client)
+    assert (summary["removed"], summary["pooled"]) == (2, 1)
+
+    (left,) = pool.pooled_containers("pool-drain")
+    assert pool.drain_pool("pool-drain", client) == {
+        "image_name": "pool-drain",
+        "removed": 1,
+    }
+    assert left.container_id in client.api.removed
+    assert pool.pooled_containers("pool-drain") == []
+    assert persistence.get_pool_target("pool-drain") is None
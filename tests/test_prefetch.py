@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+from conftest import FakeDockerClient
+
+from runes_cli import prefetch
+
+
+def rune(image_name, category):
+    return SimpleNamespace(image_name=image_name, category=category)
+
+
+def test_select_images_in_policy_order_without_duplicates(monkeypatch):
+    catalog = [
+        rune("tts:1", "speech"),
+        rune("musicgen:2", "music"),
+        rune("whisper:3", "speech"),
+    ]
+    monkeypatch.setattr(
+        prefetch, "get_recent_image_names", lambda count: ["mine:1", "tts:1"][:count]
+    )
+
+    assert prefetch.select_images(
+        images=["whisper:3", "mine:0"],
+        categories=["speech"],
+        recent=2,
+        remote_images=catalog,
+    ) == ["whisper:3", "mine:0", "tts:1", "mine:1"]
+    assert prefetch.select_images(categories=["music"], remote_images=catalog) == [
+        "musicgen:2"
+    ]
+    assert prefetch.select_images(recent=0, remote_images=catalog) == []
+
+
+def test_prefetch_skips_present_images_and_pulls_tags_in_order(monkeypatch):
+    client = FakeDockerClient("registry")
+    pulls = []
+
+    def pull(image_name, stream=False, decode=False):
+        pulls.append(image_name)
+        if image_name.startswith("broken"):
+            return iter([{"error": "manifest unknown"}])
+        return iter(
+            [
+                {"status": "Already exists", "id": "base"},
+                {"status": "Pull complete", "id": image_name},
+            ]
+        )
+
+    client.api.images = lambda: [{"RepoTags": ["tts:latest"], "RepoDigests": []}]
+    client.api.pull = pull
+
+    results = {
+        result["image_name"]: result
+        for result in prefetch.prefetch_images(
+            ["tts", "musicgen:1", "musicgen:2", "broken:1"], client
+        )
+    }
+    assert results["tts:latest"] == {
+        "image_name": "tts:latest",
+        "pulled": False,
+        "present": True,
+    }
+    assert results["musicgen:1"]["layers_downloaded"] == 1
+    assert results["musicgen:1"]["layers_present"] == 1
+    assert results["broken:1"] == {
+        "image_name": "broken:1",
+        "pulled": False,
+        "error": "manifest unknown",
+    }
+    # The tags of one repository are pulled one after another
+    musicgen = [image_name for image_name in pulls if image_name.startswith("music")]
+    assert musicgen == ["musicgen:1", "musicgen:2"]
+    assert "tts:latest" not in pulls
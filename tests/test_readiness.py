@@ -0,0 +1,37 @@
+from conftest import FakeDockerClient
+
+from runes_cli import batch, persistence, readiness
+
+
+def test_bench_starts_cold_and_removes_its_runes(docker_hosts, monkeypatch):
+    docker_hosts["one"] = client = FakeDockerClient("one")
+    row_ids = persistence.reserve_container_states(
+        [("bench", "", None, "img")] * 2, host="one"
+    )
+    persistence.finish_container_starts(
+        [(row_ids[0], 1, "b1"), (row_ids[1], 2, "b2")], []
+    )
+    client.api.running = {"b1": b"", "b2": b""}
+
+    calls = []
+
+    def run_runes(images, replicas=1, use_pool=True):
+        calls.append(use_pool)
+        return [
+            {"started": True, "container_id": container_id, "host": "one"}
+            for container_id in ["b1", "b2"]
+        ]
+
+    def wait_for_replicas(image_name, results, requested_ns, timeout, pattern):
+        for result in results:
+            result.update(ready=True, ready_ms=100)
+
+    monkeypatch.setattr(batch, "run_runes", run_runes)
+    monkeypatch.setattr(batch, "wait_for_replicas", wait_for_replicas)
+
+    (record,) = readiness.bench_images(["img"], replicas=2, settle=0)
+    assert calls == [False]  # never handed warm pool containers
+    assert record["ready"] == 2 and record["memory_max"] > 0
+    assert client.api.removed == ["b1", "b2"]
+    assert persistence.find_container_state("b1") is None
+    assert persistence.find_container_state("b2") is None
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from conftest import FakeDockerClient
+
+from runes_cli import capabilities, persistence, resources
+from runes_cli.containers import LABEL_CPUSET
+from runes_cli.models import ResourceSpec
+
+
+def test_parse_and_format_cpuset():
+    assert resources.parse_cpuset("0-3,8") == {0, 1, 2, 3, 8}
+    assert resources.parse_cpuset(" 5 ,") == {5}
+    assert resources.parse_cpuset(None) == set()
+    assert resources.format_cpuset([8, 0, 2, 1, 3]) == "0-3,8"
+    assert resources.format_cpuset([4]) == "4"
+    assert resources.format_cpuset([]) == ""
+
+
+def test_pick_cores_prefers_a_contiguous_block():
+    assert resources.pick_cores(2, {0, 2, 3, 5}) == [2, 3]
+    # No block fits: the lowest free cores
+    assert resources.pick_cores(3, {0, 2, 5, 7}) == [0, 2, 5]
+    assert resources.pick_cores(3, {0, 1}) is None
+
+
+@pytest.fixture
+def eight_cores(monkeypatch):
+    client = FakeDockerClient("local", ncpu=8)
+    monkeypatch.setattr(
+        capabilities,
+        "get_host_capabilities",
+        lambda client, docker_host=None: {"ncpu": 8},
+    )
+    yield client
+    conn = persistence.get_connection()
+    with conn:
+        conn.execute("DELETE FROM cpuset_reservations")
+
+
+def test_created_and_running_runes_keep_their_cores(eight_cores, monkeypatch):
+    summaries = [
+        {"State": "running", "Labels": {LABEL_CPUSET: "0-1"}},
+        {"State": "created", "Labels": {LABEL_CPUSET: "2-3"}},
+        {"State": "exited", "Labels": {LABEL_CPUSET: "4-5"}},
+    ]
+    monkeypatch.setattr(
+        eight_cores.api, "containers", lambda all=False, filters=None: summaries
+    )
+    cpusets, _ = resources.allocate_cpusets(ResourceSpec(cpus=4), 1, eight_cores)
+    assert cpusets == ["4-7"]
+
+
+def test_concurrent_allocations_are_disjoint(eight_cores):
+    # Nothing is created, so only the reservations keep the slices apart
+    results, errors = [], []
+
+    def allocate():
+        try:
+            cpusets, _ = resources.allocate_cpusets(
+                ResourceSpec(cpus=1), 1, eight_cores
+            )
+            results.extend(cpusets)
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=allocate) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8 and len(set(results)) == 8
+    assert len(errors) == 2 and all("Not enough free cores" in e for e in errors)
+
+
+def test_released_cores_can_be_allocated_again(eight_cores):
+    spec = ResourceSpec(cpus=8)
+    cpusets, reservation = resources.allocate_cpusets(spec, 1, eight_cores)
+    with pytest.raises(Exception):
+        resources.allocate_cpusets(spec, 1, eight_cores)
+    persistence.release_cpusets(reservation)
+    assert resources.allocate_cpusets(spec, 1, eight_cores)[0] == cpusets
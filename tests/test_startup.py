@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+# Loaded only by the commands that need them, never on `runes --help`
+HEAVY_MODULES = [
+    "docker",
+    "requests",
+    "questionary",
+    "aiohttp",
+    "tkinter",
+    "cryptography",
+]
+
+# Seconds; importing docker, requests, questionary and aiohttp alone takes longer
+IMPORT_BUDGET = 0.25
+
+CHECK = f"""
+import json, sys, time
+sys.path.insert(0, {SRC!r})
+started = time.perf_counter()
+import runes_cli.cli
+elapsed = time.perf_counter() - started
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "loaded": loaded}}))
+"""
+
+
+HELP = f"""
+import json, sys
+sys.path.insert(0, {SRC!r})
+from click.testing import CliRunner
+from runes_cli.cli import cli
+result = CliRunner().invoke(cli, ["--help"])
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps({{"exit_code": result.exit_code, "loaded": loaded}}))
+"""
+
+
+def run_check(code):
+    # A fresh interpreter, as pytest and conftest already import plenty
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out)
+
+
+def test_cli_import_is_light():
+    result = run_check(CHECK)
+    assert result["loaded"] == []
+    assert result["elapsed"] < IMPORT_BUDGET
+
+
+def test_help_is_light():
+    result = run_check(HELP)
+    assert result["exit_code"] == 0
+    assert result["loaded"] == []
@@ -0,0 +1,102 @@
+import threading
+
+from conftest import FakeDockerClient
+
+from runes_cli import stats
+
+
+def test_percentile():
+    values = list(range(10, 0, -1))
+    assert stats.percentile(values, 50) == 5
+    assert stats.percentile(values, 95) == 10
+    assert stats.percentile(values, 0) == 1
+    assert stats.percentile([7], 99) == 7
+
+
+def test_cpu_percent():
+    sample = {
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": 300},
+            "system_cpu_usage": 2000,
+            "online_cpus": 4,
+        },
+        "precpu_stats": {"cpu_usage": {"total_usage": 100}, "system_cpu_usage": 1000},
+    }
+    # 200 of 1000 ns of system time on 4 cores: 80% of one core
+    assert stats.cpu_percent(sample) == 80.0
+
+    # Older daemons only report the per-cpu usage
+    del sample["cpu_stats"]["online_cpus"]
+    sample["cpu_stats"]["cpu_usage"]["percpu_usage"] = [0, 0]
+    assert stats.cpu_percent(sample) == 40.0
+
+    # First sample of a stream: no previous usage to compare with
+    assert stats.cpu_percent({"cpu_stats": sample["cpu_stats"]}) == 0.0
+    assert stats.cpu_percent({}) == 0.0
+
+
+def test_memory_usage_leaves_out_page_cache():
+    v1 = {"memory_stats": {"usage": 500, "limit": 1000, "stats": {"cache": 200}}}
+    v2 = {"memory_stats": {"usage": 500, "limit": 1000, "stats": {"inactive_file": 50}}}
+    assert stats.memory_usage(v1) == (300, 1000)
+    assert stats.memory_usage(v2) == (450, 1000)
+
+
+class Stream:
+    """A stats stream response that blocks until it is closed."""
+
+    status_code = 200
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def iter_lines(self):
+        yield b'{"memory_stats": {"usage": 100, "limit": 200}}'
+        self.closed.wait()
+        raise ConnectionError("closed")
+
+    def close(self):
+        self.closed.set()
+
+
+def test_sampler_bounds_streams_and_stop_closes_them(monkeypatch):
+    client = FakeDockerClient("local", ncpu=2)
+    client.api.running = {"c1": b"", "c2": b"", "c3": b""}
+    client.api.base_url = "http+docker://localhost"
+    client.api.api_version = "1.43"
+    streams = []
+
+    def get(url, params=None, stream=False):
+        streams.append(Stream())
+        return streams[-1]
+
+    client.api.get = get
+    monkeypatch.setattr(stats, "get_docker_client", lambda: client)
+    monkeypatch.setattr(stats, "MAX_STREAMS", 1)
+
+    sampler = stats.StatsSampler()
+    sampler.discover()
+    assert list(sampler.threads) == ["c1"]
+    assert sampler.polled == ["c2", "c3"]
+
+    # Two polls of a rune give it a CPU usage: one core of two
+    for _ in range(2):
+        for container_id in sampler.polled:
+            sampler.poll(client, container_id)
+    rows = {row["container_id"]: row for row in sampler.snapshot()}
+    assert rows["c2"]["cpu_percent"] == 100.0
+    assert rows["c3"]["memory"] == 900
+
+    # A stopped rune is dropped, and a polled one takes its stream
+    sampler.stop()
+    sampler.threads["c1"].join(timeout=2)
+    assert not sampler.threads["c1"].is_alive()
+    assert streams[0].closed.is_set()
+
+    sampler.stopped.clear()
+    del client.api.running["c1"]
+    sampler.discover()
+    assert list(sampler.threads) == ["c2"]
+    assert sampler.polled == ["c3"]
+    assert "c1" not in sampler.samples
+    sampler.stop()
@@ -0,0 +1,58 @@
+from conftest import FakeDockerClient
+
+from runes_cli import persistence
+from runes_cli.containers import LABEL_DB_ID, LABEL_NAME
+from runes_cli.watcher import apply_event
+
+
+def event(action, container_id, **labels):
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {"ID": container_id, "Attributes": dict(labels, image="img")},
+    }
+
+
+def reserve(status=persistence.STATUS_STARTING):
+    (row_id,) = persistence.reserve_container_states(
+        [("rune", "", None, "img")], status=status
+    )
+    return row_id
+
+
+def test_start_records_the_reserved_row_then_die_stops_it():
+    client = FakeDockerClient("local")
+    row_id = reserve()
+
+    # start_container hasn't recorded the id yet: the label finds the row
+    start = event("start", "w-started", **{LABEL_DB_ID: str(row_id)})
+    assert apply_event(start, client) == persistence.STATUS_RUNNING
+    container = persistence.get_container_state(row_id)
+    assert (container.container_id, container.pid) == ("w-started", 4242)
+    assert container.status == persistence.STATUS_RUNNING
+
+    assert apply_event(event("die", "w-started"), client) == persistence.STATUS_STOPPED
+    assert persistence.get_container_state(row_id).status == persistence.STATUS_STOPPED
+
+    # Restarting a known rune updates its row in place
+    assert apply_event(start, client) == persistence.STATUS_RUNNING
+    assert persistence.get_container_state(row_id).status == persistence.STATUS_RUNNING
+
+
+def test_rune_started_elsewhere_is_restored_from_labels():
+    client = FakeDockerClient("local")
+    start = event("start", "w-foreign", **{LABEL_NAME: "foreign"})
+    assert apply_event(start, client) == persistence.STATUS_RUNNING
+    container = persistence.find_container_state("w-foreign")
+    assert container.remote_name == "foreign"
+    assert container.image_name == "img"
+
+
+def test_pooled_and_unrelated_events_are_ignored():
+    client = FakeDockerClient("local")
+    row_id = reserve(status=persistence.STATUS_POOLED)
+
+    start = event("start", "w-pooled", **{LABEL_DB_ID: str(row_id)})
+    assert apply_event(start, client) is None
+    assert apply_event(event("pause", "w-pooled"), client) is None
+    assert persistence.get_container_state(row_id).status == persistence.STATUS_POOLED